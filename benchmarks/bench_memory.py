@@ -0,0 +1,114 @@
+"""
+Memory benchmark of image index and parsed notes as vault grows.
+For each size a vault with empty image files is generated and measured in a new process:
+
+* index: image folder is indexed and name path map is kept, like in whole run
+* parse: notes linking every image are parsed and all images in them are kept.
+  It is worst case, run keeps only images of notes in progress
+
+Resident memory after each stage and peak RSS of the process are reported.
+
+    $ poetry run python benchmarks/bench_memory.py --sizes 10000 100000 300000
+"""
+
+import argparse
+import gc
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+LINKS_PER_NOTE = 20
+
+
+def _get_rss_mb() -> float:
+    with open("/proc/self/statm") as f:
+        resident_pages = int(f.read().split()[1])
+    return resident_pages * resource.getpagesize() / 1024 / 1024
+
+
+def _get_peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KB in linux
+
+
+def generate_images(vault_path: Path, image_count: int, folders: int) -> None:
+    images_path = vault_path / "images"
+    notes_path = vault_path / "notes"
+    notes_path.mkdir(parents=True)
+    for i in range(folders):
+        (images_path / f"folder{i}" / "sub").mkdir(parents=True)
+
+    for start in range(0, image_count, LINKS_PER_NOTE):
+        lines = []
+        for i in range(start, min(start + LINKS_PER_NOTE, image_count)):
+            name = f"image{i}.png"
+            (images_path / f"folder{i % folders}" / "sub" / name).touch()
+            lines.append(f"text ![[{name}|500]] text\n")
+        (notes_path / f"note{start}.md").write_text("".join(lines))
+
+
+def measure(vault_path: Path) -> dict:
+    """
+    Runs in child process so peak RSS is of this vault only
+    """
+    from obs3dian.index import ImageIndex
+    from obs3dian.markdown import parse_md_file
+
+    gc.collect()
+    report = {"base_mb": _get_rss_mb()}
+    name_path_map = ImageIndex(vault_path / "images").refresh()
+    gc.collect()
+    report["index_mb"] = _get_rss_mb() - report["base_mb"]
+
+    notes = [
+        parse_md_file(note_path, name_path_map)
+        for note_path in (vault_path / "notes").iterdir()
+    ]
+    gc.collect()
+    report["parse_mb"] = _get_rss_mb() - report["base_mb"] - report["index_mb"]
+    report["images"] = len(name_path_map)
+    report["links"] = sum(len(note.images) for note in notes)
+    report["peak_mb"] = _get_peak_rss_mb()
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--folders", type=int, default=100)
+    parser.add_argument("--json", type=Path, help="write reports to json")
+    parser.add_argument("--child", type=Path, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args.child)))
+        return
+
+    reports = []
+    print(f"{'images':>10} {'index MB':>10} {'parse MB':>10} {'peak MB':>10}")
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            vault_path = Path(temp_dir)
+            generate_images(vault_path, size, args.folders)
+            output = subprocess.run(
+                [sys.executable, __file__, "--child", str(vault_path)],
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+        report = json.loads(output)
+        reports.append(report)
+        print(
+            f"{report['images']:>10,} {report['index_mb']:>10.1f} "
+            f"{report['parse_mb']:>10.1f} {report['peak_mb']:>10.1f}"
+        )
+
+    if args.json:
+        with args.json.open("w") as f:
+            json.dump(reports, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""
+Throughput benchmark of obs3dian run against local S3 compatible server.
+Synthetic vault is generated and converted twice:
+
+* staged: each stage (image index, parse, upload, write) runs over all notes
+  one after another, so time of each stage is measured alone
+* run: notes are converted by runner like `obs3dian run`
+
+moto server is started in process unless --endpoint-url is given (e.g. MinIO).
+
+    $ pip install -r benchmarks/requirements.txt
+    $ poetry run python benchmarks/bench_run.py --notes 500 --images 200
+"""
+
+import argparse
+import concurrent.futures
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from vault import VaultSpec, generate_vault
+
+from obs3dian.core import (
+    _upload_images_from_md,
+    create_obs3dian_runner,
+    iter_convert_futures,
+    iter_markdown_paths,
+)
+from obs3dian.metrics import metrics
+from obs3dian.async_s3 import AsyncS3
+from obs3dian.s3 import S3, KEY_MODES, classify_error
+from obs3dian.scheduler import AsyncUploadScheduler, UploadScheduler
+
+
+def _start_local_s3() -> object:
+    from moto.server import ThreadedMotoServer
+
+    server = ThreadedMotoServer(port=0, verbose=False)
+    server.start()
+    host, port = server.get_host_and_port()
+    os.environ["AWS_ENDPOINT_URL"] = f"http://{host}:{port}"  # used by boto3
+    return server
+
+
+def _create_s3(bucket_name: str, args: argparse.Namespace) -> S3:
+    s3 = S3(
+        bucket_name=bucket_name,
+        aws_access_key=os.environ.get("AWS_ACCESS_KEY_ID", "bench"),
+        aws_secret_key=os.environ.get("AWS_SECRET_ACCESS_KEY", "bench"),
+        key_mode=args.key_mode,
+        max_pool_connections=args.max_concurrency * 4,
+        region_name=args.region,
+        endpoint_url=args.endpoint_url,
+        path_style=args.path_style,
+    )
+    s3.create_bucket()
+    return s3
+
+
+def _create_uploader(
+    s3: S3, args: argparse.Namespace
+) -> tuple[S3 | AsyncS3, UploadScheduler]:
+    if args.upload_backend == "thread":
+        return s3, UploadScheduler(args.max_concurrency, classify_error)
+
+    uploader = AsyncS3(s3, args.max_connections or args.max_concurrency)
+    scheduler = AsyncUploadScheduler(args.max_concurrency, classify_error)
+    scheduler.add_shutdown_callback(uploader.close)
+    return uploader, scheduler
+
+
+def bench_staged(vault: dict, output_path: Path, args: argparse.Namespace) -> dict:
+    s3, scheduler = _create_uploader(_create_s3("obs3dian-bench-staged", args), args)
+    markdown_paths = sorted(vault["notes_path"].rglob("*.md"))
+    stages = {}
+
+    with scheduler:
+        start = time.perf_counter()
+        runner = create_obs3dian_runner(
+            s3,
+            vault["images_path"],
+            output_path,
+            scheduler=scheduler,
+            parse_processes=args.parse_processes,
+            markdown_root_path=vault["notes_path"],
+        )
+        stages["index"] = time.perf_counter() - start
+
+        parse_workers = args.parse_processes * 2 or 1  # keep every process busy
+        with concurrent.futures.ThreadPoolExecutor(parse_workers) as executor:
+            runner.parse(markdown_paths[0])  # start processes before timing
+            start = time.perf_counter()
+            notes = list(executor.map(runner.parse, markdown_paths))
+            stages["parse"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(
+            min(args.max_concurrency, 64)
+        ) as executor:
+            uploaded = list(
+                executor.map(
+                    lambda note: _upload_images_from_md(
+                        s3, scheduler, note.path, note.images
+                    ),
+                    notes,
+                )
+            )
+        stages["upload"] = time.perf_counter() - start
+
+    with concurrent.futures.ThreadPoolExecutor(parse_workers) as executor:
+        start = time.perf_counter()
+        list(executor.map(runner.write, notes, uploaded))
+        stages["write"] = time.perf_counter() - start
+    runner.close()
+    return stages
+
+
+def bench_run(vault: dict, output_path: Path, args: argparse.Namespace) -> float:
+    s3, scheduler = _create_uploader(_create_s3("obs3dian-bench-run", args), args)
+    markdown_paths = iter_markdown_paths(vault["notes_path"])
+
+    start = time.perf_counter()
+    with scheduler:
+        runner = create_obs3dian_runner(
+            s3,
+            vault["images_path"],
+            output_path,
+            scheduler=scheduler,
+            parse_processes=args.parse_processes,
+            markdown_root_path=vault["notes_path"],
+        )
+        max_workers = max(8, min(args.max_concurrency, 64))
+        with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+            for _, future in iter_convert_futures(
+                runner, executor, markdown_paths, max_workers * 4
+            ):
+                future.result()
+        runner.close()
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    for name, default in VaultSpec().__dict__.items():
+        parser.add_argument(
+            f"--{name.replace('_', '-')}", type=type(default), default=default
+        )
+    parser.add_argument("--key-mode", choices=KEY_MODES, default="note")
+    parser.add_argument("--max-concurrency", type=int, default=10)
+    parser.add_argument("--parse-processes", type=int, default=0)
+    parser.add_argument(
+        "--upload-backend", choices=("thread", "async"), default="thread"
+    )
+    parser.add_argument("--max-connections", type=int, default=0)
+    parser.add_argument("--endpoint-url", help="S3 compatible server to use")
+    parser.add_argument("--region", help="region of bucket")
+    parser.add_argument("--path-style", action="store_true", help="path addressing")
+    parser.add_argument("--json", type=Path, help="write report to json file")
+    args = parser.parse_args()
+
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "bench")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "bench")
+    if not args.endpoint_url:
+        server = _start_local_s3()
+
+    spec = VaultSpec(
+        **{name: getattr(args, name) for name in VaultSpec.__dataclass_fields__}
+    )
+    with tempfile.TemporaryDirectory() as temp_dir:
+        temp_path = Path(temp_dir)
+        vault = generate_vault(temp_path / "vault", spec)
+        (temp_path / "staged").mkdir()
+        (temp_path / "run").mkdir()
+
+        stages = bench_staged(vault, temp_path / "staged", args)
+        metrics.reset()  # metrics of run pass only
+        elapsed = bench_run(vault, temp_path / "run", args)
+
+    if not args.endpoint_url:
+        server.stop()
+
+    report = {
+        "spec": spec.__dict__,
+        "key_mode": args.key_mode,
+        "max_concurrency": args.max_concurrency,
+        "parse_processes": args.parse_processes,
+        "upload_backend": args.upload_backend,
+        "stages": stages,
+        "run_seconds": elapsed,
+        "notes_per_second": spec.notes / elapsed,
+        "images_per_second": vault["links"] / elapsed,
+        "bytes_per_second": vault["image_bytes"] / elapsed,
+        "metrics": metrics.report(),
+    }
+    for stage, seconds in stages.items():
+        print(f"{stage:<8} {seconds:>8.3f}s")
+    print(f"run      {elapsed:>8.3f}s")
+    print(f"notes/s  {report['notes_per_second']:>12,.1f}")
+    print(f"images/s {report['images_per_second']:>12,.1f}")
+    print(f"MB/s     {report['bytes_per_second'] / 1024 / 1024:>12,.2f}")
+    if args.json:
+        args.json.write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
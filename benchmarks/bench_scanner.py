@@ -0,0 +1,92 @@
+"""
+Micro benchmark of markdown image scanner.
+Compares line by line scanner of obs3dian 0.3.4 with current single pass scanner.
+
+    $ poetry run python benchmarks/bench_scanner.py --lines 200000
+"""
+
+import argparse
+import random
+import re
+import tempfile
+import time
+from pathlib import Path
+from urllib.parse import unquote
+
+from obs3dian.markdown import extract_images_from_md
+
+NO_PATH_PATT = r"!\[\[(?P<name>[^]]+\.(png|jpg|jpeg|gif))\|?(?P<metadata>[^]]+)?\]\]"
+PATH_PATT = r"!\[(?P<metadata>[^]]+)?\]\((?P<path>[^)]+\.png|jpg|jpeg|gif\))"
+
+
+def legacy_extract_images_from_md(
+    markdown_file_path: Path, name_path_map: dict[str, Path]
+) -> list:
+    """
+    Scanner of obs3dian 0.3.4. Every line is matched by two regex
+    """
+    images = []
+    with markdown_file_path.open("r") as f:
+        for line_no, line in enumerate(f):
+            for patt in (NO_PATH_PATT, PATH_PATT):
+                for match_result in re.finditer(patt, line):
+                    image_info = match_result.groupdict()
+                    if path := image_info.get("path"):
+                        if path[:4] in ("http", "https"):
+                            continue
+                        image_info["name"] = unquote(Path(path).name)
+                    if image_info["name"] in name_path_map:
+                        images.append((line_no, image_info))
+    return images
+
+
+def create_note(note_path: Path, line_count: int, image_ratio: float) -> None:
+    random.seed(0)
+    with note_path.open("w") as f:
+        for line_no in range(line_count):
+            if random.random() < image_ratio:
+                if line_no % 2:
+                    f.write(
+                        f"text before ![[image{line_no % 50}.png|500]] text after\n"
+                    )
+                else:
+                    f.write(f"![caption](./images/image{line_no % 50}.jpg)\n")
+            else:
+                f.write(f"line {line_no} of note with some [link](https://a.b) text\n")
+
+
+def measure(func, note_path: Path, name_path_map: dict, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(note_path, name_path_map)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--lines", type=int, default=200_000)
+    parser.add_argument("--image-ratio", type=float, default=0.02)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    name_path_map = {
+        f"image{i}.{suffix}": Path(f"/images/image{i}.{suffix}")
+        for i in range(50)
+        for suffix in ("png", "jpg")
+    }
+    with tempfile.TemporaryDirectory() as temp_dir:
+        note_path = Path(temp_dir) / "note.md"
+        create_note(note_path, args.lines, args.image_ratio)
+
+        for name, func in (
+            ("legacy", legacy_extract_images_from_md),
+            ("current", extract_images_from_md),
+        ):
+            elapsed = measure(func, note_path, name_path_map, args.repeat)
+            print(f"{name:<8} {args.lines / elapsed:>14,.0f} lines/s  ({elapsed:.3f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Synthetic obsidian vault generator for benchmarks.
+
+    $ poetry run python benchmarks/vault.py ./bench_vault --notes 1000 --images 300
+"""
+
+import argparse
+import os
+import random
+from dataclasses import dataclass
+from pathlib import Path
+
+SUFFIXES = ("png", "jpg", "jpeg", "gif")
+
+
+@dataclass(frozen=True)
+class VaultSpec:
+    notes: int = 200
+    images: int = 100
+    images_per_note: int = 5
+    shared_ratio: float = 0.5  # ratio of image links pointing shared images
+    shared_images: int = 10  # number of images used by many notes
+    wiki_ratio: float = 0.5  # ratio of ![[name]] links, others are ![](path)
+    min_image_kb: int = 20
+    max_image_kb: int = 200
+    text_lines: int = 50  # plain text lines per note
+    folders: int = 10  # notes and images are spread in folders
+    seed: int = 0
+
+
+def _write_image(image_path: Path, size: int) -> None:
+    with image_path.open("wb") as f:
+        f.write(os.urandom(size))  # random bytes, same size as real image
+
+
+def _image_link(image_name: str, is_wiki: bool, rng: random.Random) -> str:
+    if is_wiki:
+        metadata = rng.choice(["", "|500", "|caption"])
+        return f"![[{image_name}{metadata}]]"
+    return f"![caption](./images/{image_name})"
+
+
+def generate_vault(vault_path: Path, spec: VaultSpec) -> dict:
+    """
+    Create notes folder and images folder under vault path
+
+    Args:
+        vault_path (Path): folder to create vault
+        spec (VaultSpec): vault shape
+
+    Returns:
+        dict: notes folder, images folder, links and image bytes of vault
+    """
+    rng = random.Random(spec.seed)
+    notes_path = vault_path / "notes"
+    images_path = vault_path / "images"
+
+    image_names = []
+    image_bytes = 0
+    for i in range(spec.images):
+        folder_path = images_path / f"folder{i % spec.folders}"
+        folder_path.mkdir(parents=True, exist_ok=True)
+        image_name = f"image{i}.{SUFFIXES[i % len(SUFFIXES)]}"
+        size = rng.randint(spec.min_image_kb, spec.max_image_kb) * 1024
+        _write_image(folder_path / image_name, size)
+        image_names.append(image_name)
+        image_bytes += size
+
+    shared_names = image_names[: spec.shared_images]
+    own_names = image_names[spec.shared_images :] or image_names
+    link_count = 0
+    for i in range(spec.notes):
+        folder_path = notes_path / f"folder{i % spec.folders}"
+        folder_path.mkdir(parents=True, exist_ok=True)
+        lines = [f"# note {i}\n"]
+        for line_no in range(spec.text_lines):
+            lines.append(f"line {line_no} of note {i} with [link](https://a.b/{i})\n")
+
+        for _ in range(spec.images_per_note):
+            is_shared = rng.random() < spec.shared_ratio
+            image_name = rng.choice(shared_names if is_shared else own_names)
+            link = _image_link(image_name, rng.random() < spec.wiki_ratio, rng)
+            lines.insert(rng.randrange(1, len(lines) + 1), f"text {link} text\n")
+            link_count += 1
+
+        (folder_path / f"note{i}.md").write_text("".join(lines))
+
+    return {
+        "notes_path": notes_path,
+        "images_path": images_path,
+        "links": link_count,
+        "image_bytes": image_bytes,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("vault_path", type=Path)
+    for name, default in VaultSpec().__dict__.items():
+        parser.add_argument(
+            f"--{name.replace('_', '-')}", type=type(default), default=default
+        )
+    args = vars(parser.parse_args())
+    vault_path = args.pop("vault_path")
+    print(generate_vault(vault_path, VaultSpec(**args)))
+
+
+if __name__ == "__main__":
+    main()
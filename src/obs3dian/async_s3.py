@@ -0,0 +1,308 @@
+import asyncio
+import ssl
+import time
+from pathlib import Path
+from typing import Iterable
+from urllib.parse import quote, urlsplit
+from xml.etree import ElementTree
+
+from botocore.auth import S3SigV4Auth
+from botocore.credentials import ReadOnlyCredentials, RefreshableCredentials
+from botocore.awsrequest import AWSRequest
+from botocore.exceptions import ClientError, ConnectionClosedError, ReadTimeoutError
+
+from .metrics import metrics
+from .s3 import S3
+
+MAX_HEADER_LINES = 100
+
+
+class AsyncConnectionPool:
+    """
+    HTTP/1.1 keep-alive connections to one host for coroutines of one event loop.
+    At most max_connections are opened at once and idle connections are closed
+    after keepalive seconds. Request on reused connection closed by server is sent again once.
+    """
+
+    def __init__(
+        self,
+        endpoint_url: str,
+        max_connections: int = 100,
+        keepalive: float = 30.0,
+    ) -> None:
+        url = urlsplit(endpoint_url)
+        self.endpoint_url = endpoint_url
+        self.host = url.hostname
+        self.use_ssl = url.scheme == "https"
+        self.port = url.port or (443 if self.use_ssl else 80)
+        self.keepalive = keepalive
+        self._ssl_context = ssl.create_default_context() if self.use_ssl else None
+        self._semaphore = asyncio.Semaphore(max_connections)
+        self._idle: list[tuple[asyncio.StreamReader, asyncio.StreamWriter, float]] = []
+        return
+
+    def _get_idle(self) -> tuple[asyncio.StreamReader, asyncio.StreamWriter] | None:
+        now = time.monotonic()
+        while self._idle:
+            reader, writer, idle_since = self._idle.pop()
+            if now - idle_since < self.keepalive and not reader.at_eof():
+                return reader, writer
+            writer.close()  # expired or closed by server
+        return None
+
+    async def _read_response(
+        self, reader: asyncio.StreamReader, method: str
+    ) -> tuple[int, dict[str, str], bytes, bool]:
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("Connection is closed by server")
+        status = int(status_line.split()[1])
+
+        headers: dict[str, str] = {}
+        for _ in range(MAX_HEADER_LINES):
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        keep_alive = headers.get("connection", "").lower() != "close"
+        if method == "HEAD" or status in (204, 304):
+            body = b""
+        elif headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while size := int((await reader.readline()).split(b";")[0], 16):
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()  # \r\n after chunk
+            await reader.readline()  # end of trailer
+            body = b"".join(chunks)
+        elif "content-length" in headers:
+            body = await reader.readexactly(int(headers["content-length"]))
+        else:  # body ends when connection is closed
+            body = await reader.read()
+            keep_alive = False
+        return status, headers, body, keep_alive
+
+    async def request(
+        self, method: str, target: str, headers: dict[str, str], body: bytes = b""
+    ) -> tuple[int, dict[str, str], bytes]:
+        """
+        Send request and read whole response
+
+        Args:
+            method (str): HTTP method
+            target (str): quoted path of request
+            headers (dict[str, str]): signed headers
+            body (bytes): request body
+
+        Returns:
+            tuple[int, dict[str, str], bytes]: status, lower case headers, body
+        """
+        head = f"{method} {target} HTTP/1.1\r\n" + "".join(
+            f"{name}: {value}\r\n" for name, value in headers.items()
+        )
+        request = (head + f"Content-Length: {len(body)}\r\n\r\n").encode() + body
+
+        async with self._semaphore:
+            for attempt in range(2):
+                connection = self._get_idle()
+                is_reused = connection is not None
+                try:
+                    if connection is None:
+                        connection = await asyncio.open_connection(
+                            self.host, self.port, ssl=self._ssl_context
+                        )
+                    reader, writer = connection
+                    writer.write(request)
+                    await writer.drain()
+                    status, headers, body, keep_alive = await self._read_response(
+                        reader, method
+                    )
+                except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+                    if connection:
+                        connection[1].close()
+                    if is_reused and attempt == 0:  # server closed idle connection
+                        continue
+                    raise ConnectionClosedError(endpoint_url=self.endpoint_url) from e
+                except BaseException:  # cancelled in the middle of response
+                    if connection:
+                        connection[1].close()
+                    raise
+
+                if keep_alive:
+                    self._idle.append((reader, writer, time.monotonic()))
+                else:
+                    writer.close()
+                return status, headers, body
+
+    async def close(self) -> None:
+        while self._idle:
+            _, writer, _ = self._idle.pop()
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+
+class AsyncS3:
+    """
+    Async uploader which uses settings, keys and caches of S3.
+    Images smaller than multipart threshold are PUT by coroutines over pooled
+    keep-alive connections signed by botocore SigV4, so hundreds of uploads run in one thread.
+    Bigger images are uploaded by boto3 multipart upload in thread.
+    It should be used with AsyncUploadScheduler which runs its event loop
+    """
+
+    def __init__(
+        self,
+        s3: S3,
+        max_connections: int = 100,
+        keepalive: float = 30.0,
+        timeout: float = 60.0,
+    ) -> None:
+        self.s3 = s3
+        self.bucket_name = s3.bucket_name
+        self.key_mode = s3.key_mode
+        self.timeout = timeout
+        self.endpoint_url = s3.endpoint_url
+        self.region_name = s3.region_name
+
+        endpoint = urlsplit(self.endpoint_url)
+        if s3.is_path_style:  # S3 compatible servers like moto, MinIO
+            self.host = endpoint.netloc
+            self.path_prefix = f"/{quote(self.bucket_name)}"
+            pool_url = self.endpoint_url
+        else:  # virtual hosted style
+            self.host = f"{self.bucket_name}.{endpoint.netloc}"
+            self.path_prefix = ""
+            pool_url = f"{endpoint.scheme}://{self.host}"
+        self.base_url = f"{endpoint.scheme}://{self.host}"
+        self._pool = AsyncConnectionPool(pool_url, max_connections, keepalive)
+        self._credentials = None  # resolved in thread, providers can call network
+        self._frozen_credentials: ReadOnlyCredentials | None = None
+        self._credentials_lock: asyncio.Lock | None = None  # made in event loop
+        return
+
+    def get_image_key(self, markdown_path: Path, image_path: Path) -> str:
+        return self.s3.get_image_key(markdown_path, image_path)
+
+    def get_key_prefix(self, markdown_path: Path) -> str:
+        return self.s3.get_key_prefix(markdown_path)
+
+    def load_remote_objects(self, prefixes: Iterable[str]) -> None:
+        self.s3.load_remote_objects(prefixes)
+
+    @property
+    def list_error(self) -> ClientError | None:
+        return self.s3.list_error
+
+    def _load_credentials(self) -> ReadOnlyCredentials:
+        credentials = self._credentials or self.s3.session.get_credentials()
+        if credentials is None:
+            raise ValueError("AWS credentials are not found")
+        self._credentials = credentials
+        return credentials.get_frozen_credentials()  # refreshed if it is expiring
+
+    def _is_credentials_expiring(self) -> bool:
+        return self._frozen_credentials is None or (
+            isinstance(self._credentials, RefreshableCredentials)
+            and self._credentials.refresh_needed()
+        )
+
+    async def _get_credentials(self) -> ReadOnlyCredentials:
+        """
+        Get frozen credentials. Assume role and SSO providers can block on network,
+        so credentials are resolved and refreshed in thread, not in event loop
+        """
+        if self._is_credentials_expiring():
+            if self._credentials_lock is None:
+                self._credentials_lock = asyncio.Lock()
+            async with self._credentials_lock:  # uploads wait one refresh
+                if self._is_credentials_expiring():
+                    self._frozen_credentials = (
+                        await asyncio.get_running_loop().run_in_executor(
+                            None, self._load_credentials
+                        )
+                    )
+        return self._frozen_credentials
+
+    def _sign(
+        self,
+        credentials: ReadOnlyCredentials,
+        method: str,
+        target: str,
+        headers: dict,
+        body: bytes,
+    ) -> dict:
+        request = AWSRequest(method, self.base_url + target, headers, body)
+        S3SigV4Auth(credentials, "s3", self.region_name).add_auth(request)
+        return {"Host": self.host, **dict(request.headers.items())}
+
+    def _read_image(self, key: str, image_path: Path) -> bytes | None:
+        """
+        Check image is uploaded and read it. Returns None if image is already in bucket
+        """
+        if self.s3._is_uploaded(key, image_path):
+            return None
+        return image_path.read_bytes()
+
+    async def upload_image(self, key: str, image_path: Path) -> str:
+        """
+        Upload image by key. Upload is skipped if key is already in bucket
+
+        Args:
+            key (str): object key
+            image_path (Path): image file path
+
+        Returns:
+            str: uploaded image url
+        """
+        loop = asyncio.get_running_loop()
+        if image_path.stat().st_size >= self.s3.transfer_config.multipart_threshold:
+            return await loop.run_in_executor(
+                None, self.s3.upload_image, key, image_path
+            )  # multipart upload by boto3
+
+        body = await loop.run_in_executor(None, self._read_image, key, image_path)
+        if body is None:  # skip images already in bucket
+            metrics.count("uploads_skipped")
+            return self.s3._get_image_url(key)
+
+        start = time.perf_counter()
+        target = f"{self.path_prefix}/{quote(key, safe='/~')}"
+        extra_args = self.s3.get_extra_args(image_path)
+        headers = {"Content-Type": extra_args["ContentType"]}
+        if "CacheControl" in extra_args:
+            headers["Cache-Control"] = extra_args["CacheControl"]
+        credentials = await self._get_credentials()
+        headers = self._sign(credentials, "PUT", target, headers, body)
+        try:
+            with metrics.timer("upload"):
+                status, _, response_body = await asyncio.wait_for(
+                    self._pool.request("PUT", target, headers, body), self.timeout
+                )
+        except asyncio.TimeoutError as e:
+            raise ReadTimeoutError(endpoint_url=self.endpoint_url) from e
+
+        if status >= 300:
+            error = {"Code": str(status), "Message": ""}
+            try:
+                root = ElementTree.fromstring(response_body)
+                error["Code"] = root.findtext("Code") or error["Code"]
+                error["Message"] = root.findtext("Message") or ""
+            except ElementTree.ParseError:
+                pass
+            raise ClientError(
+                {"Error": error, "ResponseMetadata": {"HTTPStatusCode": status}},
+                "PutObject",
+            )
+
+        metrics.observe("upload", time.perf_counter() - start, str(image_path))
+        metrics.count("uploads")
+        metrics.count("bytes_uploaded", len(body))
+        self.s3._mark_uploaded(key, image_path)
+        return self.s3._get_image_url(key)
+
+    async def close(self) -> None:
+        await self._pool.close()
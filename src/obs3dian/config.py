@@ -1,12 +1,22 @@
 from dataclasses import dataclass
 import json
 from pathlib import Path
+import time
 import typer
 
 APP_NAME = "obs3dian"
 SETUP_FILE_NAME = "config.json"
+MANIFEST_FILE_NAME = "manifest.json"
+BUCKET_CACHE_FILE_NAME = "buckets.json"
 APP_DIR_PATH = typer.get_app_dir(APP_NAME)
 
+KEY_MODES = (
+    "note",  # "{note} / {image}"
+    "hash",  # "hash/{sha256}{suffix}"
+    "version",  # "{note} / {stem}.{sha256[:16]}{suffix}"
+)
+MB = 1024 * 1024
+
 
 @dataclass(frozen=True)
 class Configuration:
@@ -14,8 +24,27 @@ class Configuration:
     aws_access_key: str = ""
     aws_secret_key: str = ""
     bucket_name: str = "obs3dian"
+    region_name: str = ""  # empty is region of profile or ap-northeast-2
+    endpoint_url: str = ""  # S3 compatible server like http://minio.lan:9000
+    path_style: bool = False  # address bucket by path instead of host name
+    public_url: str = ""  # url base of uploaded images like https://cdn.example.com
     output_folder_path: str = "./output"
     image_folder_path: str = "./images"
+    key_mode: str = "note"  # note, hash or version (content addressed image keys)
+    cache_control: str | None = (
+        None  # Cache-Control of images, None is immutable for content keys, "" is none
+    )
+    max_concurrency: int = 10  # max concurrent uploads in a run
+    multipart_threshold_mb: int = 8  # upload by parts if image is bigger than it
+    multipart_chunksize_mb: int = 8  # size of each part
+    transfer_concurrency: int = 4  # concurrent part uploads of one image
+    parse_processes: int = 0  # processes to parse and write notes, 0 uses threads
+    upload_backend: str = "thread"  # thread or async (coroutines over connection pool)
+    max_connections: int = (
+        0  # connections of async backend, 0 is same as max_concurrency
+    )
+    keepalive: float = 30.0  # seconds to keep idle connection of async backend
+    bucket_check_ttl: int = 86400  # seconds to trust checked bucket, 0 checks every run
 
 
 def load_configs() -> Configuration:
@@ -54,3 +83,35 @@ def remove_config():
         config_path.unlink()
     except FileNotFoundError:
         print("Config file is not exists run config first")
+
+
+def _load_bucket_cache() -> dict:
+    try:
+        with (Path(APP_DIR_PATH) / BUCKET_CACHE_FILE_NAME).open("r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def is_bucket_checked(bucket_id: str, ttl: float) -> bool:
+    """
+    Check bucket was verified in app dir less than ttl seconds ago
+
+    Args:
+        bucket_id (str): endpoint and bucket name
+        ttl (float): seconds to trust last check
+
+    Returns:
+        bool: True if bucket does not need to be checked again
+    """
+    checked_at = _load_bucket_cache().get(bucket_id)
+    return checked_at is not None and 0 <= time.time() - checked_at < ttl
+
+
+def save_bucket_checked(bucket_id: str) -> None:
+    bucket_cache = _load_bucket_cache()
+    bucket_cache[bucket_id] = time.time()
+    app_dir_path = Path(APP_DIR_PATH)
+    app_dir_path.mkdir(parents=True, exist_ok=True)
+    with (app_dir_path / BUCKET_CACHE_FILE_NAME).open("w") as f:
+        json.dump(bucket_cache, f)
@@ -1,18 +1,39 @@
+from __future__ import annotations
+
 import concurrent.futures
+from dataclasses import dataclass, field
+from functools import partial
+import itertools
+import multiprocessing
+import os
 from pathlib import Path
-from typing import Callable, List
+import time
+from typing import TYPE_CHECKING, Iterable, Iterator, List
 
+from .hashing import get_digest
+from .index import ImageIndex
 from .markdown import (
-    get_images_name_path_map,
     write_md_file,
-    extract_images_from_md,
+    parse_md_file,
     ImageText,
+    Note,
 )
-from .s3 import S3
+from .manifest import Manifest
+from .metrics import metrics
+from .optimize import ImageOptimizer
+from .scheduler import UploadScheduler
+
+if TYPE_CHECKING:  # boto3 is imported when S3 is created
+    from .s3 import S3
 
 
 def _upload_images_from_md(
-    s3: S3, markdown_path: Path, images: List[ImageText]
+    s3: S3,
+    scheduler: UploadScheduler,
+    markdown_path: Path,
+    images: List[ImageText],
+    manifest: Manifest | None = None,
+    optimizer: ImageOptimizer | None = None,
 ) -> List[ImageText]:
     """
     Generate local images path by using generator and put images to S3.
@@ -20,33 +41,316 @@ def _upload_images_from_md(
 
     Args:
         s3 (S3): instance to control S3
+        scheduler (UploadScheduler): upload queue shared by notes
         markdown_file_name (str): makrdown file name
         image_path_generator (Generator[Path, None, None]): yield image paths to upload
+        manifest (Manifest | None): skip images uploaded in previous runs
+        optimizer (ImageOptimizer | None): upload optimized images instead of sources
 
     Returns:
         List[Path]: sccessfully put image paths
     """
-    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
-        futures = []
-        for image in images:
-            if image.path:
-                futures.append(
-                    executor.submit(s3.put_image, markdown_path, image)
-                )  # run upload by multithread
-
-        uploaded_images: List[ImageText] = []  # put success image path list
-        for future in concurrent.futures.as_completed(futures, timeout=60):
-            uploaded_images.append(future.result())
+    images = [image for image in images if image.path]
+    upload_paths = (
+        optimizer.optimize(images) if optimizer else [image.path for image in images]
+    )
+    same_images: dict[Path, List[ImageText]] = {}  # upload path -> images in md
+    for image, upload_path in zip(images, upload_paths):
+        same_images.setdefault(upload_path, []).append(image)
+
+    uploaded_images: List[ImageText] = []  # put success image path list
+    futures = {}
+    for image_path, same in same_images.items():
+        key = s3.get_image_key(markdown_path, image_path)
+        if manifest and (s3_url := manifest.get_uploaded_url(key, image_path)):
+            for image in same:  # uploaded in previous run
+                image.s3_url = s3_url
+                uploaded_images.append(image)
+            continue
+
+        # each image file is uploaded once, notes only wait their own images
+        future = scheduler.submit(
+            key, image_path, partial(s3.upload_image, key, image_path)
+        )
+        futures[future] = (key, image_path, same)
+
+    for future in concurrent.futures.as_completed(futures):
+        s3_url = future.result()
+        key, image_path, same = futures[future]
+        if manifest:
+            manifest.record_upload(key, image_path, s3_url)
+        for image in same:  # every link points same url
+            image.s3_url = s3_url
+            uploaded_images.append(image)
 
     return uploaded_images
 
 
+@dataclass
+class ConvertResult:
+    """
+    Result of converting one note
+    """
+
+    path: Path
+    is_converted: bool  # False if note is unchanged or failed
+    output_path: Path | None = None
+    images: List[ImageText] = field(default_factory=list)  # uploaded images
+    missing_names: List[str] = field(default_factory=list)  # not in image folder
+    seconds: float = 0.0
+    error: Exception | None = None
+
+
+_worker_name_path_map: dict[str, Path] = {}  # image map of parse process
+
+
+def _init_parse_worker(name_path_map: dict[str, Path]) -> None:
+    global _worker_name_path_map
+    _worker_name_path_map = name_path_map  # sent once per process, not per note
+
+
+def _parse_md_file_in_worker(markdown_file_path: Path) -> Note:
+    return parse_md_file(markdown_file_path, _worker_name_path_map)
+
+
+class Obs3dianRunner:
+    """
+    Runner converts markdown files. S3 client, image index and upload queue are kept
+    between calls, so one runner can convert notes for the whole run or watch session.
+    If parse_processes is given, notes are parsed and rewritten in process pool
+    so regex scanning uses all cores, while uploads stay in scheduler threads.
+    If optimizer is given, images are optimized before upload.
+    """
+
+    def __init__(
+        self,
+        s3: S3,
+        image_folder_path: Path,
+        output_folder_path: Path,
+        is_overwrite: bool = False,
+        manifest: Manifest | None = None,
+        scheduler: UploadScheduler | None = None,
+        index_dir_path: Path | None = None,
+        parse_processes: int = 0,
+        optimizer: ImageOptimizer | None = None,
+        markdown_root_path: Path | None = None,
+    ) -> None:
+        self.s3 = s3
+        self.output_folder_path = output_folder_path
+        self.markdown_root_path = markdown_root_path  # its folders are kept in output
+        self.is_overwrite = is_overwrite
+        self.manifest = manifest
+        self.optimizer = optimizer
+        if scheduler is None:
+            from .s3 import classify_error
+
+            scheduler = UploadScheduler(classify_error=classify_error)
+        self.scheduler = scheduler
+
+        self.image_index = ImageIndex(image_folder_path, index_dir_path)
+        self.image_index.load()
+        self.name_path_map: dict[str, Path] = {}
+        self.parse_processes = parse_processes
+        self._parse_executor: concurrent.futures.ProcessPoolExecutor | None = None
+        self.refresh_images()
+        return
+
+    def refresh_images(self) -> None:
+        """
+        Update image name path map. Only changed folders in image folder are listed
+        """
+        name_path_map = self.image_index.refresh()
+        self.image_index.save()
+
+        if self.parse_processes and (
+            self._parse_executor is None or name_path_map != self.name_path_map
+        ):  # processes keep image map, start them again when it is changed
+            if self._parse_executor:
+                self._parse_executor.shutdown()
+            self._parse_executor = concurrent.futures.ProcessPoolExecutor(
+                self.parse_processes,
+                mp_context=multiprocessing.get_context(
+                    "spawn"
+                ),  # fork with threads is unsafe
+                initializer=_init_parse_worker,
+                initargs=(name_path_map,),
+            )
+        self.name_path_map = name_path_map
+
+    @property
+    def duplicates(self) -> dict[str, List[Path]]:
+        """
+        Image names found in many folders, first path of each name is used
+        """
+        return self.image_index.duplicates
+
+    def close(self) -> None:
+        if self.optimizer:
+            self.optimizer.close()
+        if self._parse_executor:
+            self._parse_executor.shutdown()
+            self._parse_executor = None
+
+    def parse(self, markdown_file_path: Path) -> Note:
+        """
+        Parse note in this thread or in parse process
+
+        Args:
+            markdown_file_path (Path): markdown file path
+
+        Returns:
+            Note: note text and images in it
+        """
+        if self._parse_executor is None:
+            return parse_md_file(markdown_file_path, self.name_path_map)
+
+        with metrics.timer("parse"):  # metrics of worker stay in worker process
+            note = self._parse_executor.submit(
+                _parse_md_file_in_worker, markdown_file_path
+            ).result()
+        metrics.count("notes_parsed")
+        metrics.count("image_links", len(note.images))
+        metrics.count("missing_images", len(note.missing_names))
+        return note
+
+    def write(self, note: Note, uploaded_images: List[ImageText]) -> Path:
+        """
+        Write note with S3 links in this thread or in parse process
+
+        Args:
+            note (Note): parsed note
+            uploaded_images (List[ImageText]): uploaded images of note
+
+        Returns:
+            Path: written file path
+        """
+        args = (
+            note.path,
+            self.output_folder_path,
+            uploaded_images,
+            self.is_overwrite,
+            note.text,
+            self.markdown_root_path,
+        )
+        if self._parse_executor is None:
+            return write_md_file(*args)
+
+        with metrics.timer("write"):
+            output_file_path = self._parse_executor.submit(
+                write_md_file, *args
+            ).result()
+        metrics.count("notes_written")
+        return output_file_path
+
+    def preflight(self, markdown_file_paths: List[Path]) -> None:
+        """
+        List bucket prefixes of notes to convert once before uploads.
+        Images whose size and ETag match listed objects are not uploaded again
+
+        Args:
+            markdown_file_paths (List[Path]): notes to convert
+        """
+        manifest = self.manifest
+        prefixes = {
+            self.s3.get_key_prefix(markdown_file_path)
+            for markdown_file_path in markdown_file_paths
+            if not (
+                manifest
+                and manifest.is_unchanged(markdown_file_path, self.name_path_map)
+            )
+        }  # unchanged notes upload nothing
+        self.s3.load_remote_objects(prefixes)
+
+    def upload_images(
+        self, markdown_file_path: Path, images: List[ImageText]
+    ) -> List[ImageText]:
+        """
+        Upload images of note by shared upload queue and set their S3 urls
+
+        Args:
+            markdown_file_path (Path): note path, image keys are made by its name
+            images (List[ImageText]): images in note
+
+        Returns:
+            List[ImageText]: uploaded images
+        """
+        return _upload_images_from_md(
+            self.s3,
+            self.scheduler,
+            markdown_file_path,
+            images,
+            self.manifest,
+            self.optimizer,
+        )
+
+    def convert(self, markdown_file_path: Path) -> ConvertResult:
+        """
+        Extract image paths of note, upload them and replace them by S3 URLs.
+
+        Args:
+            markdown_file_path (Path): mark down file path
+
+        Returns:
+            ConvertResult: output and uploaded images, not converted if note is unchanged
+        """
+        manifest = self.manifest
+        if manifest and manifest.is_unchanged(markdown_file_path, self.name_path_map):
+            metrics.count("notes_unchanged")
+            return ConvertResult(markdown_file_path, False)
+
+        start = time.perf_counter()
+
+        note: Note = self.parse(markdown_file_path)  # read once
+        uploaded_images = self.upload_images(markdown_file_path, note.images)
+        output_file_path = self.write(
+            note, uploaded_images
+        )  # write new md with S3 link
+
+        if manifest:
+            digest = None if self.is_overwrite else get_digest(note.text)
+            manifest.record_note(
+                markdown_file_path,
+                output_file_path,
+                uploaded_images,
+                digest,
+                note.missing_names,
+            )
+        seconds = time.perf_counter() - start
+        metrics.observe("note", seconds, str(markdown_file_path))
+        return ConvertResult(
+            markdown_file_path,
+            True,
+            output_file_path,
+            uploaded_images,
+            note.missing_names,
+            seconds,
+        )
+
+    def __call__(self, markdown_file_path: Path) -> bool:
+        """
+        Run obs3dian command extract image paths and replace them by S3 URLs.
+
+        Args:
+            markdown_file_path (Path): mark down file path
+
+        Returns:
+            bool: False if note is skipped because it is not changed
+        """
+        return self.convert(markdown_file_path).is_converted
+
+
 def create_obs3dian_runner(
     s3: S3,
     image_folder_path: Path,
     output_folder_path: Path,
     is_overwrite: bool = False,
-) -> Callable:
+    manifest: Manifest | None = None,
+    scheduler: UploadScheduler | None = None,
+    index_dir_path: Path | None = None,
+    parse_processes: int = 0,
+    optimizer: ImageOptimizer | None = None,
+    markdown_root_path: Path | None = None,
+) -> Obs3dianRunner:
     """
     Create runner fucntion object
     S3 controller and ouput_folder_path would not change before config
@@ -55,27 +359,93 @@ def create_obs3dian_runner(
         s3 (S3): S3 controller
         image_folder_path (Path): image folder path
         output_folder_path (Path): output folder path
+        manifest (Manifest | None): skip unchanged notes and record converted notes
+        scheduler (UploadScheduler | None): upload queue shared by all notes
+        index_dir_path (Path | None): folder to save image folder index
+        parse_processes (int): number of processes to parse and write notes, 0 uses threads
+        optimizer (ImageOptimizer | None): optimize images before upload
+        markdown_root_path (Path | None): notes under it are written in same folders of output
 
     Returns:
-        Callable: runner
+        Obs3dianRunner: runner
     """
+    return Obs3dianRunner(
+        s3,
+        image_folder_path,
+        output_folder_path,
+        is_overwrite,
+        manifest,
+        scheduler,
+        index_dir_path,
+        parse_processes,
+        optimizer,
+        markdown_root_path,
+    )
 
-    name_path_map: dict[str, Path] = get_images_name_path_map(image_folder_path)
 
-    def run(markdown_file_path: Path) -> None:
-        """
-        Run obs3dian command extract image paths and replace them by S3 URLs.
+def iter_markdown_paths(root: Path) -> Iterator[Path]:
+    """
+    Yield .md files under folder while walking it, so conversion starts before walk ends.
+    Only one folder is opened at a time and walk state is a stack of folder paths
 
-        Args:
-            markdown_file_path (Path): mark down file path
-        """
-        images: List[ImageText] = extract_images_from_md(
-            markdown_file_path, name_path_map
-        )
-        uploaded_images = _upload_images_from_md(s3, markdown_file_path, images)
-        write_md_file(
-            markdown_file_path, output_folder_path, uploaded_images, is_overwrite
-        )  # write new md with S3 link
-        return
+    Args:
+        root (Path): folder to walk
+
+    Yields:
+        Iterator[Path]: markdown file paths
+    """
+    dir_paths = [root]
+    while dir_paths:
+        try:
+            entries = os.scandir(dir_paths.pop())
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            continue  # removed or not readable folder
+
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    dir_paths.append(Path(entry.path))
+                elif entry.name.endswith(".md") and entry.is_file():
+                    yield Path(entry.path)
+
+
+def iter_convert_futures(
+    runner: Obs3dianRunner,
+    executor: concurrent.futures.Executor,
+    markdown_file_paths: Iterable[Path],
+    max_in_flight: int,
+    preflight: bool = True,
+) -> Iterator[tuple[Path, concurrent.futures.Future]]:
+    """
+    Submit notes to executor while at most max_in_flight notes are converting
+    and yield them in completion order, so memory does not grow with vault size
+    and slow note does not hold results of others.
+    Notes are preflighted by batches of max_in_flight before they are submitted
+
+    Args:
+        runner (Obs3dianRunner): runner
+        executor (concurrent.futures.Executor): executor runs runner
+        markdown_file_paths (Iterable[Path]): notes, can be lazy generator
+        max_in_flight (int): max number of submitted and not handled notes
+        preflight (bool): list bucket for each batch before upload
+
+    Yields:
+        Iterator[tuple[Path, concurrent.futures.Future]]: note and its done future
+    """
+    in_flight: dict[concurrent.futures.Future, Path] = {}
+    markdown_file_paths = iter(markdown_file_paths)
+    while batch := list(itertools.islice(markdown_file_paths, max_in_flight)):
+        if preflight:
+            runner.preflight(batch)  # few LIST calls instead of many PUTs
+
+        for markdown_file_path in batch:
+            while len(in_flight) >= max_in_flight:  # wait free slot
+                done, _ = concurrent.futures.wait(
+                    in_flight, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    yield in_flight.pop(future), future
+            in_flight[executor.submit(runner, markdown_file_path)] = markdown_file_path
 
-    return run
+    for future in concurrent.futures.as_completed(in_flight):
+        yield in_flight[future], future
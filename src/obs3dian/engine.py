@@ -0,0 +1,154 @@
+from __future__ import annotations
+
+import concurrent.futures
+from pathlib import Path
+from threading import Lock
+from typing import TYPE_CHECKING, Iterable, List
+
+from .core import ConvertResult, Obs3dianRunner
+from .manifest import Manifest
+from .markdown import extract_images_from_text, replace_images_in_text
+from .optimize import ImageOptimizer
+from .scheduler import UploadScheduler
+
+if TYPE_CHECKING:  # boto3 is imported when S3 is created
+    from .s3 import S3
+
+
+class Obs3dianEngine:
+    """
+    Library entry point for long running services.
+    Engine owns S3 client, image index, upload queue and manifest, so they are made once
+    and every call only costs converting its notes. Results are returned instead of printed.
+    Methods can be called from many threads at once.
+
+        engine = Obs3dianEngine(S3("bucket", profile_name="default"), images, output)
+        result = engine.convert(Path("note.md"))
+        text = engine.convert_text("![[image.png]]", note_name="note")
+        engine.close()
+    """
+
+    def __init__(
+        self,
+        s3: S3,
+        image_folder_path: Path,
+        output_folder_path: Path,
+        is_overwrite: bool = False,
+        manifest: Manifest | None = None,
+        scheduler: UploadScheduler | None = None,
+        index_dir_path: Path | None = None,
+        optimizer: ImageOptimizer | None = None,
+        max_workers: int = 16,
+        preflight: bool = True,
+        markdown_root_path: Path | None = None,
+    ) -> None:
+        self.runner = Obs3dianRunner(
+            s3,
+            image_folder_path,
+            output_folder_path,
+            is_overwrite,
+            manifest,
+            scheduler,
+            index_dir_path,
+            optimizer=optimizer,
+            markdown_root_path=markdown_root_path,
+        )
+        self.preflight = preflight
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers, thread_name_prefix="obs3dian-convert"
+        )  # notes mostly wait their uploads
+        self._index_lock = Lock()
+        return
+
+    @property
+    def manifest(self) -> Manifest | None:
+        return self.runner.manifest
+
+    @property
+    def duplicates(self) -> dict[str, List[Path]]:
+        return self.runner.duplicates
+
+    def refresh_images(self) -> None:
+        """
+        Find images added to image folder since engine is created or last refresh.
+        Only changed folders are listed
+        """
+        with self._index_lock:
+            self.runner.refresh_images()
+
+    def _convert(self, markdown_file_path: Path) -> ConvertResult:
+        try:
+            return self.runner.convert(markdown_file_path)
+        except Exception as e:  # other notes are converted
+            return ConvertResult(markdown_file_path, False, error=e)
+
+    def convert(self, markdown_file_path: Path) -> ConvertResult:
+        """
+        Convert one note file
+
+        Args:
+            markdown_file_path (Path): markdown file path
+
+        Returns:
+            ConvertResult: result with error instead of raising it
+        """
+        result = self._convert(markdown_file_path)
+        self.runner.scheduler.forget_finished()  # changed images can be uploaded again
+        return result
+
+    def convert_many(self, markdown_file_paths: Iterable[Path]) -> List[ConvertResult]:
+        """
+        Convert notes concurrently. Bucket is listed once for all notes before uploads
+
+        Args:
+            markdown_file_paths (Iterable[Path]): markdown file paths
+
+        Returns:
+            List[ConvertResult]: result of each note in given order
+        """
+        markdown_file_paths = list(markdown_file_paths)
+        if self.preflight:
+            self.runner.preflight(markdown_file_paths)  # few LIST calls for batch
+        results = list(self._executor.map(self._convert, markdown_file_paths))
+        self.runner.scheduler.forget_finished()
+        return results
+
+    def convert_text(self, text: str, note_name: str = "note") -> str:
+        """
+        Convert note in memory. Images are keyed by note name like note file
+
+        Args:
+            text (str): markdown text
+            note_name (str): name of note without .md
+
+        Returns:
+            str: text whose image links are replaced by S3 links
+        """
+        markdown_path = Path(f"{note_name}.md")
+        images = extract_images_from_text(text, self.runner.name_path_map)
+        uploaded_images = self.runner.upload_images(markdown_path, images)
+        self.runner.scheduler.forget_finished()
+
+        return replace_images_in_text(text, uploaded_images)
+
+    def save(self) -> None:
+        """
+        Save manifest, so next engine skips notes and uploads done by this engine
+        """
+        if self.manifest:
+            self.manifest.save()
+
+    def close(self) -> None:
+        """
+        Wait uploads and stop workers. Manifest is saved
+        """
+        self._executor.shutdown()
+        self.runner.scheduler.shutdown()
+        self.runner.close()
+        self.save()
+
+    def __enter__(self) -> "Obs3dianEngine":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
@@ -0,0 +1,60 @@
+import hashlib
+from pathlib import Path
+
+CHUNK_SIZE = 1024 * 1024  # read files by 1MB chunks
+
+
+def get_file_digest(file_path: Path, algorithm: str = "sha256") -> str:
+    """
+    Hash file contents by streaming it from disk
+
+    Args:
+        file_path (Path): file to hash
+        algorithm (str): hashlib algorithm name
+
+    Returns:
+        str: hex digest of file contents
+    """
+    hasher = hashlib.new(algorithm)
+    with file_path.open("rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def get_digest(data: bytes, algorithm: str = "sha256") -> str:
+    """
+    Hash bytes in memory
+
+    Args:
+        data (bytes): data to hash
+        algorithm (str): hashlib algorithm name
+
+    Returns:
+        str: hex digest of data
+    """
+    return hashlib.new(algorithm, data).hexdigest()
+
+
+def get_file_etag(file_path: Path, multipart_threshold: int, part_size: int) -> str:
+    """
+    Calculate S3 ETag of file without uploading it.
+    Single part object ETag is md5 of contents. Multipart object ETag is
+    md5 of joined part md5 digests with number of parts like "{md5}-{parts}"
+
+    Args:
+        file_path (Path): file to hash
+        multipart_threshold (int): files from this size are uploaded by parts
+        part_size (int): size of each part
+
+    Returns:
+        str: ETag without quotes
+    """
+    if file_path.stat().st_size < multipart_threshold:
+        return get_file_digest(file_path, "md5")
+
+    part_digests = []
+    with file_path.open("rb") as f:
+        while part := f.read(part_size):
+            part_digests.append(hashlib.md5(part).digest())
+    return f"{hashlib.md5(b''.join(part_digests)).hexdigest()}-{len(part_digests)}"
@@ -0,0 +1,185 @@
+from collections.abc import Mapping
+import concurrent.futures
+import json
+import os
+from pathlib import Path
+from typing import Iterator, List
+
+from .hashing import get_digest
+from .metrics import metrics
+
+IMAGE_SUFFIXES = (".png", ".jpg", ".jpeg", ".gif")
+
+
+class ImagePathMap(Mapping):
+    """
+    Compact {name: Path} map of image folder.
+    Each name keeps only folder Path shared by all images in the folder,
+    and image Path is made when name is looked up, so millions of images don't keep Paths.
+    """
+
+    __slots__ = ("_dirs",)
+
+    def __init__(self, dirs: dict[str, Path] | None = None) -> None:
+        self._dirs = dirs or {}  # name -> folder Path shared in folder
+        return
+
+    def add(self, name: str, dir_path: Path) -> None:
+        self._dirs[name] = dir_path
+
+    def __getitem__(self, name: str) -> Path:
+        return self._dirs[name] / name  # child shares parts of folder Path
+
+    def get_dir(self, name: str) -> Path:
+        """
+        Get folder Path of image, which is shared by all images in the folder.
+        Raises KeyError like lookup of name
+        """
+        return self._dirs[name]
+
+    def __contains__(self, name: object) -> bool:
+        return name in self._dirs
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._dirs)
+
+    def __len__(self) -> int:
+        return len(self._dirs)
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, ImagePathMap):
+            return self._dirs == other._dirs
+        if not isinstance(other, Mapping) or len(other) != len(self):
+            return False
+        return all(other.get(name) == self[name] for name in self._dirs)
+
+    def __reduce__(self) -> tuple:
+        return ImagePathMap, (self._dirs,)  # same folder string is pickled once
+
+
+class ImageIndex:
+    """
+    Index of image folder which maps image name to its path.
+    Folders are kept with their mtime, so only folders whose entries are changed
+    are listed again in next refresh. Folders are walked by thread pool.
+    Images with same name in other folders are reported as duplicates.
+    """
+
+    def __init__(
+        self,
+        image_folder_path: Path,
+        index_dir_path: Path | None = None,
+        max_workers: int = 8,
+    ) -> None:
+        self.image_folder_path = image_folder_path
+        self.max_workers = max_workers
+        self.index_path = None  # index is not saved if index dir is not given
+        if index_dir_path:
+            folder_digest = get_digest(str(image_folder_path).encode(), "sha1")
+            self.index_path = index_dir_path / f"image_index_{folder_digest[:12]}.json"
+
+        self.dirs: dict[str, dict] = {}  # relative folder path -> folder record
+        self.duplicates: dict[str, List[Path]] = {}  # name -> all paths of name
+        return
+
+    def load(self) -> None:
+        """
+        Load saved index. Index is rebuilt if file is not exists or broken
+        """
+        if not self.index_path:
+            return
+        try:
+            with self.index_path.open("r") as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+
+        if data.get("root") == str(self.image_folder_path):
+            self.dirs = data.get("dirs", {})
+
+    def save(self) -> None:
+        if not self.index_path:
+            return
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = self.index_path.with_name(self.index_path.name + ".tmp")
+        with temp_path.open("w") as f:
+            json.dump({"root": str(self.image_folder_path), "dirs": self.dirs}, f)
+        os.replace(temp_path, self.index_path)
+
+    def _scan_dir(self, relative_dir: str) -> tuple[str, dict]:
+        """
+        List folder only if its mtime is changed since last scan
+
+        Args:
+            relative_dir (str): folder path relative to image folder
+
+        Returns:
+            tuple[str, dict]: relative folder path, folder record
+        """
+        dir_path = self.image_folder_path / relative_dir
+        mtime_ns = os.stat(dir_path).st_mtime_ns
+        record = self.dirs.get(relative_dir)
+        if record and record["mtime_ns"] == mtime_ns:  # no entry is added or removed
+            return relative_dir, record
+
+        metrics.count("index_dirs_listed")
+        files: List[str] = []  # image names
+        subdirs: List[str] = []
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                elif entry.name.endswith(IMAGE_SUFFIXES) and entry.is_file():
+                    files.append(entry.name)
+        files.sort()
+        return relative_dir, {"mtime_ns": mtime_ns, "files": files, "subdirs": subdirs}
+
+    def _walk(self) -> dict[str, dict]:
+        dirs: dict[str, dict] = {}
+        with concurrent.futures.ThreadPoolExecutor(self.max_workers) as executor:
+            pending = {executor.submit(self._scan_dir, "")}
+            while pending:
+                done, pending = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    try:
+                        relative_dir, record = future.result()
+                    except FileNotFoundError:  # folder is removed while walking
+                        continue
+
+                    dirs[relative_dir] = record
+                    for subdir in record["subdirs"]:
+                        subdir_path = (
+                            f"{relative_dir}/{subdir}" if relative_dir else subdir
+                        )
+                        pending.add(executor.submit(self._scan_dir, subdir_path))
+        return dirs
+
+    def refresh(self) -> ImagePathMap:
+        """
+        Update index from image folder and create [name, Path] map of all images.
+        If name is duplicated, image in shallower folder is used
+
+        Returns:
+            ImagePathMap: {name, Path}
+        """
+        with metrics.timer("index"):
+            self.dirs = self._walk()
+
+            name_path_map = ImagePathMap()
+            self.duplicates = {}
+            for relative_dir in sorted(
+                self.dirs, key=lambda path: (path.count("/"), path)
+            ):
+                dir_path = self.image_folder_path / relative_dir
+                for name in sorted(
+                    self.dirs[relative_dir]["files"]
+                ):  # dict in old index
+                    if name in name_path_map:
+                        self.duplicates.setdefault(name, [name_path_map[name]]).append(
+                            dir_path / name
+                        )
+                        continue
+                    name_path_map.add(name, dir_path)
+        return name_path_map
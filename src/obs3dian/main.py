@@ -1,16 +1,52 @@
 import concurrent.futures as concurrent_futures
+from dataclasses import asdict
+import itertools
+import json
 from threading import Event, Thread
 
 import typer
 from typing_extensions import Annotated
-from typing import Optional
+from typing import TYPE_CHECKING, Iterator, List, Optional
 
 from pathlib import Path
 import time
 
-from .core import create_obs3dian_runner
-from .config import load_configs, save_config, remove_config, APP_NAME, Configuration
-from .s3 import S3
+from .core import (
+    create_obs3dian_runner,
+    iter_convert_futures,
+    iter_markdown_paths,
+    Obs3dianRunner,
+)
+from .config import (
+    load_configs,
+    save_config,
+    remove_config,
+    APP_NAME,
+    is_bucket_checked,
+    save_bucket_checked,
+    APP_DIR_PATH,
+    KEY_MODES,
+    MANIFEST_FILE_NAME,
+    SETUP_FILE_NAME,
+    MB,
+    Configuration,
+)
+from .index import ImageIndex
+from .manifest import Manifest
+from .metrics import metrics
+from .optimize import ImageOptimizer
+from .scheduler import AsyncUploadScheduler, UploadScheduler
+from .shard import get_shard_index, parse_shard
+from .watch import create_watcher, watch_changes
+
+if TYPE_CHECKING:  # boto3 is imported only by commands which use S3
+    from .s3 import S3
+
+UPLOAD_BACKENDS = ("thread", "async")
+FORGET_FINISHED_INTERVAL = 1000  # notes between dropping finished uploads in run
+MAX_NOTE_WORKERS = (
+    64  # notes wait their uploads, uploads can be more with async backend
+)
 
 
 app = typer.Typer(name=APP_NAME)
@@ -65,23 +101,37 @@ def set_bucket(
     Raises:
         e: invalid output path
     """
-    if profile_name:
-        s3 = S3(
-            profile_name=profile_name,
-            bucket_name=bucket_name,
-        )
-    elif aws_access_key and aws_secret_key:
-        s3 = S3(
-            bucket_name=bucket_name,
-            aws_access_key=aws_access_key,
-            aws_secret_key=aws_secret_key,
-        )
+    from .s3 import S3
+
+    s3 = S3(
+        bucket_name=bucket_name,
+        profile_name=profile_name,
+        aws_access_key=aws_access_key,
+        aws_secret_key=aws_secret_key,
+    )
+    _verify_bucket(s3)
+
+
+def _verify_bucket(s3: "S3", ttl: float = 0) -> None:
+    """
+    Create bucket if it is not exists. Checked bucket is cached in app dir,
+    so bucket is not checked again in runs within ttl seconds
+
+    Args:
+        s3 (S3): S3 controller of bucket
+        ttl (float): seconds to trust last check, 0 always checks bucket
+    """
+    bucket_name = s3.bucket_name
+    bucket_id = f"{s3.s3.meta.endpoint_url} {bucket_name}"
+    if ttl and is_bucket_checked(bucket_id, ttl):
+        return
 
     if s3.create_bucket():
         print(f"Bucket {bucket_name} created")
         print("Bucket has public read access so anyone can see files in your bucket")
     else:
         print(f"Bucket {bucket_name} is already exists try with other name")
+    save_bucket_checked(bucket_id)
 
 
 @app.command()
@@ -118,6 +168,7 @@ def config(
     bucket_name = configs.bucket_name
     output_path = configs.output_folder_path
     image_folder_path = configs.image_folder_path
+    key_mode = configs.key_mode
 
     typer.echo("AWS-CLI profile name or AWS key is required")
     if input("Do you want to config AWS-CLI profile name? (Y/N): ") in ["y", "Y"]:
@@ -137,13 +188,19 @@ def config(
     image_folder_path = Path(default_input("Image Folder Path", image_folder_path))
     image_folder_path = _convert_path_absoulte(image_folder_path, True)
 
+    key_mode = default_input(f"Image Key Mode ({'/'.join(KEY_MODES)})", key_mode)
+    if key_mode not in KEY_MODES:
+        raise ValueError(f"Image key mode should be one of {', '.join(KEY_MODES)}")
+
     json_data = {
+        **asdict(configs),  # keep settings which are not asked
         "profile_name": profile_name,
         "aws_access_key": aws_access_key,
         "aws_secret_key": aws_secret_key,
         "bucket_name": bucket_name,
         "output_folder_path": str(output_path),
         "image_folder_path": str(image_folder_path),
+        "key_mode": key_mode,
     }
 
     save_config(json_data)
@@ -168,6 +225,204 @@ def _render_animation(echo_text: str, event: Event) -> None:
     return
 
 
+def _create_runner(
+    overwrite: bool = False,
+    bucket_name: str | None = None,
+    aws_access_key: str | None = None,
+    aws_secret_key: str | None = None,
+    profile_name: str | None = None,
+    output_folder_path: str | None = None,
+    image_folder_path: str | None = None,
+    key_mode: str | None = None,
+    cache_control: str | None = None,
+    region_name: str | None = None,
+    endpoint_url: str | None = None,
+    path_style: bool = False,
+    public_url: str | None = None,
+    max_concurrency: int | None = None,
+    multipart_threshold_mb: int | None = None,
+    multipart_chunksize_mb: int | None = None,
+    transfer_concurrency: int | None = None,
+    parse_processes: int | None = None,
+    upload_backend: str | None = None,
+    max_connections: int | None = None,
+    keepalive: float | None = None,
+    optimize: bool = False,
+    resize: bool = False,
+    webp: bool = False,
+    optimize_processes: int | None = None,
+    manifest_path: str | None = None,
+    force: bool = False,
+    markdown_root_path: Path | None = None,
+) -> Obs3dianRunner:
+    """
+    Apply settings and create runner. Options not given are read from config.json
+
+    Returns:
+        Obs3dianRunner: runner with S3 client, upload scheduler and manifest
+    """
+    from .async_s3 import AsyncS3
+    from .s3 import S3, classify_error
+
+    configs: Configuration = load_configs()
+    bucket_name = bucket_name or configs.bucket_name
+    if not (profile_name or (aws_access_key and aws_secret_key)):
+        profile_name = configs.profile_name  # credentials are not given in command
+        aws_access_key = configs.aws_access_key
+        aws_secret_key = configs.aws_secret_key
+    if output_folder_path:
+        set_output_folder(output_folder_path)
+
+    output_folder_path = output_folder_path or configs.output_folder_path
+    image_folder_path = image_folder_path or configs.image_folder_path
+    key_mode = key_mode or configs.key_mode
+    cache_control = (
+        cache_control if cache_control is not None else configs.cache_control
+    )  # "" sends no Cache-Control even for content keys
+    region_name = region_name or configs.region_name
+    endpoint_url = endpoint_url or configs.endpoint_url
+    path_style = path_style or configs.path_style
+    public_url = public_url or configs.public_url
+    max_concurrency = max_concurrency or configs.max_concurrency
+    multipart_threshold_mb = multipart_threshold_mb or configs.multipart_threshold_mb
+    multipart_chunksize_mb = multipart_chunksize_mb or configs.multipart_chunksize_mb
+    transfer_concurrency = transfer_concurrency or configs.transfer_concurrency
+    parse_processes = parse_processes or configs.parse_processes
+    upload_backend = upload_backend or configs.upload_backend
+    max_connections = max_connections or configs.max_connections or max_concurrency
+    keepalive = keepalive or configs.keepalive
+    if upload_backend not in UPLOAD_BACKENDS:
+        raise ValueError(
+            f"Upload backend should be one of {', '.join(UPLOAD_BACKENDS)}"
+        )
+
+    s3 = S3(
+        profile_name=profile_name,
+        aws_access_key=aws_access_key,
+        aws_secret_key=aws_secret_key,
+        bucket_name=bucket_name,
+        key_mode=key_mode,
+        max_pool_connections=max_concurrency * transfer_concurrency,
+        multipart_threshold=multipart_threshold_mb * MB,
+        multipart_chunksize=multipart_chunksize_mb * MB,
+        transfer_concurrency=transfer_concurrency,
+        cache_control=cache_control,
+        region_name=region_name,
+        endpoint_url=endpoint_url,
+        path_style=path_style,
+        public_url=public_url,
+    )  # one session and client for whole command
+    if bucket_name:
+        _verify_bucket(s3, configs.bucket_check_ttl)
+    typer.echo("")  # new line
+
+    if upload_backend == "async":
+        uploader = AsyncS3(s3, max_connections, keepalive)
+        scheduler = AsyncUploadScheduler(max_concurrency, classify_error)
+        scheduler.add_shutdown_callback(uploader.close)  # close pool in its loop
+    else:
+        uploader = s3
+        scheduler = UploadScheduler(
+            max_concurrency, classify_error
+        )  # uploads of all notes share it, retried and throttled by it
+
+    optimizer = None
+    settings = {
+        "bucket_name": bucket_name,
+        "key_mode": key_mode,
+        "output_folder_path": str(output_folder_path),
+        "is_overwrite": overwrite,
+        "output_layout": "mirror",  # outputs of flat layout are written again
+    }
+    if optimize or resize or webp:
+        optimizer = ImageOptimizer(
+            Path(APP_DIR_PATH) / "image_cache", resize, webp, optimize_processes
+        )  # optimized images are cached between runs
+        settings["optimize"] = {"resize": resize, "webp": webp}  # other urls
+    # notes written with other image urls are converted again
+    if s3.url_base != f"https://{bucket_name}.s3.{s3.region_name}.amazonaws.com":
+        settings["url_base"] = s3.url_base
+
+    manifest = Manifest.load(
+        Path(manifest_path or Path(APP_DIR_PATH) / MANIFEST_FILE_NAME), settings
+    )  # notes not changed since last run are skipped
+    if force:
+        manifest.notes.clear()
+        manifest.uploads.clear()
+
+    return create_obs3dian_runner(
+        uploader,
+        Path(image_folder_path),
+        Path(output_folder_path),
+        overwrite,
+        manifest,
+        scheduler,
+        Path(APP_DIR_PATH),
+        parse_processes,
+        optimizer,
+        markdown_root_path,
+    )  # create main function
+
+
+def _echo_duplicates(runner: Obs3dianRunner, reported: set[str]) -> None:
+    for name, paths in runner.duplicates.items():
+        if name not in reported:  # report each name once
+            reported.add(name)
+            typer.echo(f"Image name {name} is duplicated, {paths[0]} is used")
+
+
+def _echo_errors(runner: Obs3dianRunner) -> None:
+    if runner.s3.list_error:
+        typer.echo("Can't list objects in bucket, uploads are not skipped")
+        typer.echo(runner.s3.list_error)
+    if runner.optimizer:
+        for image_path, error in runner.optimizer.errors.items():
+            typer.echo(f"Can't optimize {image_path}: {error}")
+
+
+def _get_markdown_root(absolute_md_file_path: Path) -> Path:
+    """
+    Folder which notes are sharded by and mirrored in output folder
+    """
+    if absolute_md_file_path.is_dir():
+        return absolute_md_file_path
+    return absolute_md_file_path.parent
+
+
+def _iter_input_markdown_paths(
+    absolute_md_file_path: Path, shard: str | None = None
+) -> Iterator[Path]:
+    """
+    Yield md files of input path, only notes in shard if shard is given
+
+    Args:
+        absolute_md_file_path (Path): md file or folder
+        shard (str | None): shard like 1/4
+
+    Returns:
+        Iterator[Path]: md file paths
+    """
+    root = _get_markdown_root(absolute_md_file_path)
+    if absolute_md_file_path.is_dir():
+        markdown_file_paths = iter_markdown_paths(
+            absolute_md_file_path
+        )  # .md files under input dir are yielded while walking
+    else:
+        markdown_file_paths = iter([absolute_md_file_path])
+
+    if not shard:
+        return markdown_file_paths
+    try:
+        shard_index, shard_count = parse_shard(shard)
+    except ValueError as e:
+        raise typer.BadParameter(str(e), param_hint="'--shard'") from e
+    return (
+        markdown_file_path
+        for markdown_file_path in markdown_file_paths
+        if get_shard_index(markdown_file_path, root, shard_count) == shard_index
+    )  # other machines convert other shards
+
+
 @app.command()
 def run(
     md_file_path: Path,
@@ -195,6 +450,135 @@ def run(
     image_folder_path: Annotated[
         Optional[str], typer.Option(help="Image File Folder Path")
     ] = None,
+    key_mode: Annotated[
+        Optional[str],
+        typer.Option(
+            help="Image key mode. 'note' keys images by note name, 'hash' keys images by content so same image is uploaded once, 'version' keys images by note name and content so changed image gets new url"
+        ),
+    ] = None,
+    cache_control: Annotated[
+        Optional[str],
+        typer.Option(
+            help="Cache-Control of uploaded images, '' sends none (default is long max-age immutable for 'hash' and 'version' keys)"
+        ),
+    ] = None,
+    region: Annotated[
+        Optional[str],
+        typer.Option(help="AWS region of bucket (default is ap-northeast-2)"),
+    ] = None,
+    endpoint_url: Annotated[
+        Optional[str],
+        typer.Option(help="S3 compatible server url like http://minio.lan:9000"),
+    ] = None,
+    path_style: Annotated[
+        bool,
+        typer.Option(
+            help="Address bucket by path (endpoint/bucket/key) instead of host name"
+        ),
+    ] = False,
+    public_url: Annotated[
+        Optional[str],
+        typer.Option(
+            help="Url base written in notes like https://cdn.example.com (default is bucket url)"
+        ),
+    ] = None,
+    force: Annotated[
+        bool,
+        typer.Option(
+            help="Convert all notes even if they are not changed since last run"
+        ),
+    ] = False,
+    max_concurrency: Annotated[
+        Optional[int],
+        typer.Option(help="Max number of concurrent uploads in whole run"),
+    ] = None,
+    multipart_threshold_mb: Annotated[
+        Optional[int],
+        typer.Option(help="Images bigger than this size (MB) are uploaded by parts"),
+    ] = None,
+    multipart_chunksize_mb: Annotated[
+        Optional[int], typer.Option(help="Part size (MB) of multipart upload")
+    ] = None,
+    transfer_concurrency: Annotated[
+        Optional[int],
+        typer.Option(help="Max number of concurrent part uploads of one image"),
+    ] = None,
+    parse_processes: Annotated[
+        Optional[int],
+        typer.Option(
+            help="Parse and rewrite notes in this many processes to use all cores (default uses threads)"
+        ),
+    ] = None,
+    upload_backend: Annotated[
+        Optional[str],
+        typer.Option(
+            help="Upload backend. 'thread' uploads by thread pool, 'async' uploads by coroutines over keep-alive connection pool for hundreds of concurrent uploads"
+        ),
+    ] = None,
+    max_connections: Annotated[
+        Optional[int],
+        typer.Option(
+            help="Connection pool size of async backend (default is max concurrency)"
+        ),
+    ] = None,
+    keepalive: Annotated[
+        Optional[float],
+        typer.Option(help="Seconds to keep idle connection of async backend"),
+    ] = None,
+    optimize: Annotated[
+        bool,
+        typer.Option(
+            help="Recompress PNG and JPEG images without metadata before upload (needs Pillow)"
+        ),
+    ] = False,
+    resize: Annotated[
+        bool,
+        typer.Option(
+            help="Downscale images to width in note like ![[image.png|500]] (implies --optimize)"
+        ),
+    ] = False,
+    webp: Annotated[
+        bool,
+        typer.Option(help="Convert PNG and JPEG images to WebP (implies --optimize)"),
+    ] = False,
+    optimize_processes: Annotated[
+        Optional[int],
+        typer.Option(
+            help="Number of processes to optimize images (default is number of cores)"
+        ),
+    ] = None,
+    manifest_path: Annotated[
+        Optional[str],
+        typer.Option(
+            help="Manifest file path to record converted notes (default is in app dir)"
+        ),
+    ] = None,
+    shard: Annotated[
+        Optional[str],
+        typer.Option(
+            help="Convert only notes in shard like 1/4, notes are split by hash of path under md_file_path"
+        ),
+    ] = None,
+    resume: Annotated[
+        bool,
+        typer.Option(
+            help="Continue previous run which was killed, uploads and notes done in it are skipped"
+        ),
+    ] = False,
+    preflight: Annotated[
+        bool,
+        typer.Option(
+            help="List objects in bucket before uploads and skip images already uploaded"
+        ),
+    ] = True,
+    profile: Annotated[
+        bool,
+        typer.Option(help="Print time of each stage and slowest notes and images"),
+    ] = False,
+    metrics_json: Annotated[
+        Optional[Path],
+        typer.Option(help="Write stage times, upload latencies and counters to json"),
+    ] = None,
 ):
     """
     Get images local file paths from md files in given path.
@@ -205,66 +589,397 @@ def run(
         absolute_md_file_path (Path): your markdown file path to convert. (dir or file)
     """
 
-    configs: Configuration = load_configs()
-    bucket_name = bucket_name or configs.bucket_name
-    if output_folder_path:
-        set_output_folder(output_folder_path)
-    if bucket_name:
-        set_bucket(bucket_name, profile_name, aws_access_key, aws_secret_key)
-    typer.echo("")  # new line
-
     absolute_md_file_path = _convert_path_absoulte(md_file_path)
-    output_folder_path = output_folder_path or configs.output_folder_path
-    image_folder_path = image_folder_path or configs.image_folder_path
+    metrics.reset()
+    markdown_file_paths = _iter_input_markdown_paths(absolute_md_file_path, shard)
 
-    s3 = S3(
-        profile_name=profile_name,
-        aws_access_key=aws_access_key,
-        aws_secret_key=aws_secret_key,
-        bucket_name=bucket_name,
+    first_markdown_file_path = next(markdown_file_paths, None)
+    if first_markdown_file_path is None and shard:
+        typer.echo(f"No md files in shard {shard}")
+        return
+    assert (
+        first_markdown_file_path
+    ), f"No md files in {md_file_path}"  # raise error when no md file in input path
+    markdown_file_paths = itertools.chain(
+        [first_markdown_file_path], markdown_file_paths
     )
 
-    runner = create_obs3dian_runner(
-        s3, Path(image_folder_path), Path(output_folder_path), overwrite
+    runner = _create_runner(
+        overwrite=overwrite,
+        bucket_name=bucket_name,
+        aws_access_key=aws_access_key,
+        aws_secret_key=aws_secret_key,
+        profile_name=profile_name,
+        output_folder_path=output_folder_path,
+        image_folder_path=image_folder_path,
+        key_mode=key_mode,
+        cache_control=cache_control,
+        region_name=region,
+        endpoint_url=endpoint_url,
+        path_style=path_style,
+        public_url=public_url,
+        max_concurrency=max_concurrency,
+        multipart_threshold_mb=multipart_threshold_mb,
+        multipart_chunksize_mb=multipart_chunksize_mb,
+        transfer_concurrency=transfer_concurrency,
+        parse_processes=parse_processes,
+        upload_backend=upload_backend,
+        max_connections=max_connections,
+        keepalive=keepalive,
+        optimize=optimize,
+        resize=resize,
+        webp=webp,
+        optimize_processes=optimize_processes,
+        manifest_path=manifest_path,
+        force=force,
+        markdown_root_path=_get_markdown_root(absolute_md_file_path),
     )  # create main function
+    _echo_duplicates(runner, set())
+    scheduler, manifest = runner.scheduler, runner.manifest
+    replayed_count = manifest.open_journal(resume)  # records are journaled until save
+    if replayed_count:
+        typer.echo(f"Resume previous run ({replayed_count} records are replayed)")
 
-    if absolute_md_file_path.is_dir():
-        markdown_file_paths = [
-            markdown_path for markdown_path in md_file_path.rglob("**/*.md")
-        ]  # get all .md file under input dir
-    else:
-        markdown_file_paths = [md_file_path]
-
-    assert len(
-        markdown_file_paths
-    ), f"No md files in {md_file_path}"  # raise error when no md file in input path
     event = Event()
     animation_thread = Thread(
         target=_render_animation, args=("Processing files...", event), daemon=True
     )
 
-    with concurrent_futures.ThreadPoolExecutor(
-        max_workers=8
-    ) as executor:  # thread for aniamtion
-        futures = {
-            executor.submit(runner, markdown_file_path): markdown_file_path
-            for markdown_file_path in markdown_file_paths
-        }
-        typer.echo("")  # new line
-        animation_thread.start()  # start loading animaton thread
-
-        with typer.progressbar(
-            label="Processing", iterable=futures.items(), show_eta=False
-        ) as progeress:  # typer progress bar
-            for future, markdown_file_path in progeress:
-                # print progress bar
-                typer.echo("")  # new line
-                future.result()  # check future result
-                typer.echo(f"\rFinished    [{markdown_file_path.name}]")
+    total_count = 0
+    skipped_count = 0
+    try:
+        max_workers = max(8, min(scheduler.max_concurrency, MAX_NOTE_WORKERS))
+        with concurrent_futures.ThreadPoolExecutor(
+            max_workers=max_workers
+        ) as executor:  # notes mostly wait their uploads in scheduler
+            futures = iter_convert_futures(
+                runner,
+                executor,
+                markdown_file_paths,
+                max_workers * 4,  # keep workers busy without holding whole vault
+                preflight,
+            )
+            typer.echo("")  # new line
+            animation_thread.start()  # start loading animaton thread
+
+            with typer.progressbar(
+                label="Processing", iterable=futures, show_eta=False, show_pos=True
+            ) as progeress:  # typer progress bar, total is not known while walking
+                for markdown_file_path, future in progeress:
+                    # print progress bar
+                    typer.echo("")  # new line
+                    total_count += 1
+                    if total_count % FORGET_FINISHED_INTERVAL == 0:
+                        # uploaded keys are skipped by S3, futures of them aren't kept
+                        scheduler.forget_finished()
+                    try:
+                        is_converted = future.result()  # check future result
+                    except Exception as e:
+                        typer.echo(f"\rFailed      [{markdown_file_path.name}] {e}")
+                        raise e
+                    if is_converted:
+                        typer.echo(f"\rFinished    [{markdown_file_path.name}]")
+                    else:
+                        skipped_count += 1
+                        typer.echo(f"\rUnchanged   [{markdown_file_path.name}]")
+    finally:
+        scheduler.shutdown()
+        runner.close()
+        _echo_errors(runner)
+        manifest.save()  # keep records of converted notes even if run failed
+        manifest.close_journal()
+        if metrics_json:
+            metrics.save(metrics_json)
 
     typer.echo("\n")  # new line after progress bar
     typer.echo(
-        f"Total converts: {len(markdown_file_paths)}\nobs3dian is successfully finished\n"
+        f"Total converts: {total_count - skipped_count} (unchanged: {skipped_count})\nobs3dian is successfully finished\n"
+    )
+    if profile:
+        typer.echo(metrics.format_summary())
+
+
+@app.command()
+def plan(
+    md_file_path: Path,
+    image_folder_path: Annotated[
+        Optional[str], typer.Option(help="Image File Folder Path")
+    ] = None,
+    key_mode: Annotated[
+        Optional[str],
+        typer.Option(
+            help="Image key mode to count uploads, 'note', 'hash' or 'version'"
+        ),
+    ] = None,
+    shard: Annotated[
+        Optional[str], typer.Option(help="Plan only notes in shard like 1/4")
+    ] = None,
+    max_concurrency: Annotated[
+        Optional[int], typer.Option(help="Concurrent uploads of projected run")
+    ] = None,
+    put_latency_ms: Annotated[
+        Optional[float], typer.Option(help="Milliseconds of one PUT request")
+    ] = None,
+    bandwidth_mb: Annotated[
+        Optional[float], typer.Option(help="Upload bandwidth (MB/s) of whole run")
+    ] = None,
+    measured_metrics: Annotated[
+        Optional[Path],
+        typer.Option(
+            help="Metrics json of earlier run (--metrics-json), its upload latency and throughput are used"
+        ),
+    ] = None,
+    plan_json: Annotated[
+        Optional[Path], typer.Option(help="Write plan report to json")
+    ] = None,
+):
+    """
+    Report what run would upload without any network call.
+    Notes are parsed with image index like run, and notes, images, bytes, missing images,
+    duplicate names and largest notes are reported.
+    Run time is projected if PUT latency, bandwidth or metrics of earlier run is given.
+
+    Args:
+        md_file_path (Path): your markdown file path to plan. (dir or file)
+    """
+    from .plan import UploadPlan
+
+    absolute_md_file_path = _convert_path_absoulte(md_file_path)
+    configs = (
+        load_configs()
+        if (Path(APP_DIR_PATH) / SETUP_FILE_NAME).exists()
+        else Configuration()
+    )  # plan doesn't need bucket or credentials
+    key_mode = key_mode or configs.key_mode
+    if key_mode not in KEY_MODES:
+        raise ValueError(f"Key mode should be one of {', '.join(KEY_MODES)}")
+
+    put_latency = put_latency_ms / 1000 if put_latency_ms else None
+    bandwidth = bandwidth_mb * MB if bandwidth_mb else None
+    if measured_metrics:
+        with measured_metrics.open("r") as f:
+            report = json.load(f)
+        upload_latency = report["latencies"].get("upload")
+        if upload_latency and not put_latency:
+            put_latency = upload_latency["p50"]  # typical image PUT
+        bytes_uploaded = report["counters"].get("bytes_uploaded", 0)
+        if bytes_uploaded and not bandwidth:
+            bandwidth = bytes_uploaded / report["elapsed"]  # throughput of whole run
+
+    upload_plan = UploadPlan(
+        ImageIndex(
+            _convert_path_absoulte(Path(image_folder_path or configs.image_folder_path))
+        ),
+        key_mode,
+        configs.multipart_threshold_mb * MB,
+        configs.multipart_chunksize_mb * MB,
+    )
+    upload_plan.add_notes(_iter_input_markdown_paths(absolute_md_file_path, shard))
+
+    projection = {
+        "put_latency": put_latency,
+        "bandwidth": bandwidth,
+        "max_concurrency": max_concurrency or configs.max_concurrency,
+    }
+    typer.echo(upload_plan.format_summary(**projection))
+    if plan_json:
+        upload_plan.save(plan_json, **projection)
+
+
+@app.command()
+def watch(
+    md_file_path: Path,
+    overwrite: Annotated[
+        bool,
+        typer.Option(
+            help="Overwrites original md file in same file path. (default is creating new file under output folder)"
+        ),
+    ] = False,
+    bucket_name: Annotated[
+        Optional[str], typer.Option(help="Aws S3 Bucket Name")
+    ] = None,
+    aws_access_key: Annotated[
+        Optional[str], typer.Option(help="AWS Access Key to use")
+    ] = None,
+    aws_secret_key: Annotated[
+        Optional[str], typer.Option(help="AWS Secret Key to use")
+    ] = None,
+    profile_name: Annotated[
+        Optional[str], typer.Option(help="Aws CLI Profile Name")
+    ] = None,
+    output_folder_path: Annotated[
+        Optional[str], typer.Option(help="Converted Output Folder Path")
+    ] = None,
+    image_folder_path: Annotated[
+        Optional[str], typer.Option(help="Image File Folder Path")
+    ] = None,
+    key_mode: Annotated[
+        Optional[str],
+        typer.Option(
+            help="Image key mode. 'note', 'hash' or 'version' (content addressed)"
+        ),
+    ] = None,
+    max_concurrency: Annotated[
+        Optional[int],
+        typer.Option(help="Max number of concurrent uploads in whole session"),
+    ] = None,
+    debounce: Annotated[
+        float,
+        typer.Option(help="Seconds to wait after last save before converting"),
+    ] = 1.0,
+    polling: Annotated[
+        bool, typer.Option(help="Watch by polling instead of inotify")
+    ] = False,
+    poll_interval: Annotated[
+        float, typer.Option(help="Seconds between polls when watching by polling")
+    ] = 1.0,
+):
+    """
+    Watch markdown folder and convert notes as soon as they are saved.
+    S3 client, image index and upload state are kept between saves,
+    so each save only costs converting that note.
+
+    Args:
+        md_file_path (Path): your markdown folder to watch
+    """
+    absolute_md_file_path = _convert_path_absoulte(md_file_path)
+    assert absolute_md_file_path.is_dir(), f"{md_file_path} is not a folder"
+
+    runner = _create_runner(
+        overwrite=overwrite,
+        bucket_name=bucket_name,
+        aws_access_key=aws_access_key,
+        aws_secret_key=aws_secret_key,
+        profile_name=profile_name,
+        output_folder_path=output_folder_path,
+        image_folder_path=image_folder_path,
+        key_mode=key_mode,
+        max_concurrency=max_concurrency,
+        markdown_root_path=absolute_md_file_path,
+    )
+    reported_duplicates: set[str] = set()
+    _echo_duplicates(runner, reported_duplicates)
+    scheduler, manifest = runner.scheduler, runner.manifest
+    ignore_paths = [
+        _convert_path_absoulte(runner.output_folder_path, strict=False)
+    ]  # outputs written in vault should not be converted again
+    watcher = create_watcher(
+        absolute_md_file_path,
+        ignore_paths,
+        polling,
+        poll_interval,
+        on_overflow=lambda: typer.echo(
+            "Too many changes at once, some notes could be missed"
+        ),
+        on_fallback=lambda e: typer.echo(f"Can't use inotify ({e}), watch by polling"),
+        image_root=_convert_path_absoulte(
+            runner.image_index.image_folder_path, strict=False
+        ),
+    )
+    replayed_count = manifest.open_journal(resume=True)  # records of stopped watch
+    if replayed_count:
+        typer.echo(f"Resume previous watch ({replayed_count} records are replayed)")
+
+    typer.echo(f"Watching {absolute_md_file_path} ... (Ctrl+C to stop)")
+    try:
+        with concurrent_futures.ThreadPoolExecutor(
+            max_workers=max(8, min(scheduler.max_concurrency, MAX_NOTE_WORKERS))
+        ) as executor:
+            for markdown_file_paths in watch_changes(watcher, debounce):
+                if watcher.take_images_changed():  # images could be added with note
+                    runner.refresh_images()
+                    _echo_duplicates(runner, reported_duplicates)
+                futures = {
+                    executor.submit(runner, markdown_file_path): markdown_file_path
+                    for markdown_file_path in markdown_file_paths
+                }
+                for future in concurrent_futures.as_completed(futures):
+                    markdown_file_path = futures[future]
+                    try:
+                        if future.result():
+                            typer.echo(f"Finished    [{markdown_file_path.name}]")
+                    except Exception as e:  # keep watching other notes
+                        typer.echo(f"Failed      [{markdown_file_path.name}] {e}")
+
+                scheduler.forget_finished()  # records are appended to journal
+
+    except KeyboardInterrupt:
+        typer.echo("\nStop watching")
+
+    finally:
+        watcher.close()
+        scheduler.shutdown()
+        manifest.save()
+        manifest.close_journal()
+
+
+@app.command()
+def split_manifest(
+    manifest_path: Path,
+    md_file_path: Path,
+    shards: Annotated[int, typer.Option(help="Number of shards")],
+    output_folder_path: Annotated[
+        Optional[Path],
+        typer.Option(
+            help="Folder to write shard manifests (default is manifest folder)"
+        ),
+    ] = None,
+):
+    """
+    Split manifest to manifest-{i}-of-{N}.json for each shard of run --shard i/N.
+    Every shard manifest has all uploads, so images shared by shards are not uploaded again.
+
+    Args:
+        manifest_path (Path): manifest to split
+        md_file_path (Path): markdown folder given to run
+    """
+    root = _convert_path_absoulte(md_file_path)
+    output_folder_path = output_folder_path or manifest_path.parent
+    manifest_paths = [
+        output_folder_path / f"{manifest_path.stem}-{i}-of-{shards}.json"
+        for i in range(1, shards + 1)
+    ]
+    manifest = Manifest.read(manifest_path)
+    shard_manifests = manifest.split(
+        manifest_paths,
+        lambda note_path: (
+            get_shard_index(note_path, root, shards)
+            if note_path.is_relative_to(root)
+            else None
+        ),  # manifest in app dir has notes of other vaults too
+    )
+    for shard_manifest in shard_manifests:
+        shard_manifest.save()
+        typer.echo(
+            f"{shard_manifest.manifest_path} ({len(shard_manifest.notes)} notes)"
+        )
+
+    skipped_count = len(manifest.notes) - sum(
+        len(shard_manifest.notes) for shard_manifest in shard_manifests
+    )
+    if skipped_count:
+        typer.echo(f"{skipped_count} notes outside {root} are not in shards")
+
+
+@app.command()
+def merge_manifest(
+    output_manifest_path: Path,
+    manifest_paths: Annotated[List[Path], typer.Argument(help="Manifests to merge")],
+):
+    """
+    Merge manifests written by shards of run into one manifest.
+    Manifests should be written with same settings
+
+    Args:
+        output_manifest_path (Path): merged manifest path
+    """
+    merged = Manifest.read(manifest_paths[0])
+    merged.manifest_path = output_manifest_path
+    for manifest_path in manifest_paths[1:]:
+        merged.merge(Manifest.read(manifest_path))
+    merged.save()
+    typer.echo(
+        f"{output_manifest_path} ({len(merged.notes)} notes, {len(merged.uploads)} uploads)"
     )
 
 
@@ -0,0 +1,333 @@
+import json
+import os
+from pathlib import Path
+from threading import Lock
+import time
+from typing import IO, Callable, List
+
+from .hashing import get_file_digest
+from .markdown import ImageText
+
+JOURNAL_SYNC_INTERVAL = 1.0  # seconds between fsync of journal
+
+
+def _get_file_stat(file_path: Path) -> dict:
+    stat = file_path.stat()
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+class Manifest:
+    """
+    Persistent record of converted notes and uploaded images.
+    Each note keeps its size, mtime, content hash, output path and used images,
+    so notes which are not changed since last run can be skipped.
+    Records are discarded when run settings (bucket, key mode, output...) are changed.
+    While journal is opened, each record is also appended to journal file as it is made,
+    so work of run killed before save can be replayed by next run.
+    """
+
+    def __init__(self, manifest_path: Path, settings: dict) -> None:
+        self.manifest_path = manifest_path
+        self.settings = settings
+        self.notes: dict[str, dict] = {}  # note path -> note record
+        self.uploads: dict[str, dict] = {}  # object key -> upload record
+        self.journal_path = manifest_path.with_name(manifest_path.name + ".journal")
+        self._journal: IO[str] | None = None
+        self._last_sync = 0.0
+        self._lock = Lock()
+        return
+
+    @classmethod
+    def load(cls, manifest_path: Path, settings: dict) -> "Manifest":
+        """
+        Load manifest json file. Returns empty manifest if file is not exists
+        or it was written with other settings
+
+        Args:
+            manifest_path (Path): manifest json file path
+            settings (dict): settings of current run
+
+        Returns:
+            Manifest: loaded manifest
+        """
+        manifest = cls(manifest_path, settings)
+        try:
+            with manifest_path.open("r") as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return manifest
+
+        if data.get("settings") == settings:  # records are valid in same settings
+            manifest.notes = data.get("notes", {})
+            manifest.uploads = data.get("uploads", {})
+        return manifest
+
+    @classmethod
+    def read(cls, manifest_path: Path) -> "Manifest":
+        """
+        Load manifest json file with settings written in it
+
+        Args:
+            manifest_path (Path): manifest json file path
+
+        Returns:
+            Manifest: loaded manifest
+        """
+        with manifest_path.open("r") as f:
+            settings = json.load(f).get("settings", {})
+        return cls.load(manifest_path, settings)
+
+    def merge(self, other: "Manifest") -> None:
+        """
+        Add records of other manifest, like manifests written by shards of one run.
+        Records of other manifest are used for same note or key
+
+        Args:
+            other (Manifest): manifest written with same settings
+        """
+        if other.settings != self.settings:
+            raise ValueError(
+                f"{other.manifest_path} is written with other settings {other.settings}"
+            )
+        with self._lock:
+            self.notes.update(other.notes)
+            self.uploads.update(other.uploads)
+
+    def split(
+        self, manifest_paths: List[Path], get_shard: Callable[[Path], int | None]
+    ) -> List["Manifest"]:
+        """
+        Split notes to manifest of each shard. Every shard gets all uploads, so images
+        shared by notes in other shards are not uploaded again and have same url.
+        Uploads are hashed, so they are valid on machine where images have other mtime.
+        Notes without shard, like notes of other vaults, are not put in any shard
+
+        Args:
+            manifest_paths (List[Path]): manifest path of each shard
+            get_shard (Callable[[Path], int | None]): returns shard index of note
+
+        Returns:
+            List[Manifest]: manifest of each shard
+        """
+        with self._lock:
+            for record in self.uploads.values():
+                if "digest" not in record and self._is_image_unchanged(record):
+                    record["digest"] = get_file_digest(Path(record["path"]))
+
+            shards = [Manifest(path, self.settings) for path in manifest_paths]
+            for shard in shards:
+                shard.uploads = dict(self.uploads)
+            for note, record in self.notes.items():
+                shard_index = get_shard(Path(note))
+                if shard_index is not None:
+                    shards[shard_index].notes[note] = record
+        return shards
+
+    def save(self) -> None:
+        """
+        Write manifest by temp file and replace it, so manifest is never half written
+        """
+        with self._lock:
+            data = {
+                "settings": self.settings,
+                "notes": self.notes,
+                "uploads": self.uploads,
+            }
+            self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = self.manifest_path.with_name(self.manifest_path.name + ".tmp")
+            with temp_path.open("w") as f:
+                json.dump(data, f)
+            os.replace(temp_path, self.manifest_path)
+            if self._journal:  # records are saved in manifest
+                self._reset_journal()
+
+    def _reset_journal(self) -> None:
+        self._journal.seek(0)
+        self._journal.truncate()
+        self._journal.write(json.dumps({"settings": self.settings}) + "\n")
+        self._journal.flush()
+
+    def _replay_journal(self) -> int:
+        try:
+            with self.journal_path.open("r") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return 0
+
+        replayed = 0
+        for line_no, line in enumerate(lines):
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:  # last line could be cut by crash
+                continue
+            if line_no == 0:
+                if entry.get("settings") != self.settings:
+                    return 0  # journal of run with other settings
+            elif "note" in entry:
+                self.notes[entry["note"]] = entry["record"]
+                replayed += 1
+            elif "upload" in entry:
+                self.uploads[entry["upload"]] = entry["record"]
+                replayed += 1
+        return replayed
+
+    def open_journal(self, resume: bool = False) -> int:
+        """
+        Start journaling records. If resume is given, records of previous run which was
+        not saved are replayed first. Otherwise previous journal is discarded
+
+        Args:
+            resume (bool): replay journal of previous run
+
+        Returns:
+            int: number of replayed records
+        """
+        with self._lock:
+            replayed = self._replay_journal() if resume else 0
+            self.journal_path.parent.mkdir(parents=True, exist_ok=True)
+            self._journal = self.journal_path.open("a+")
+            if replayed:  # keep replayed records until manifest is saved
+                self._journal.write("\n")  # end line cut by crash
+                self._journal.flush()
+            else:
+                self._reset_journal()
+        return replayed
+
+    def close_journal(self) -> None:
+        with self._lock:
+            if self._journal:
+                self._journal.close()
+                self._journal = None
+
+    def _append_journal(self, entry: dict) -> None:
+        """
+        Append record to journal. Should be called with lock
+        """
+        if not self._journal:
+            return
+        self._journal.write(json.dumps(entry) + "\n")
+        self._journal.flush()  # survive process crash
+        if time.monotonic() - self._last_sync > JOURNAL_SYNC_INTERVAL:
+            os.fsync(
+                self._journal.fileno()
+            )  # survive power loss, at most once per interval
+            self._last_sync = time.monotonic()
+
+    def _is_image_unchanged(self, image_record: dict) -> bool:
+        try:
+            image_stat = _get_file_stat(Path(image_record["path"]))
+        except OSError:  # image is removed
+            return False
+        if image_stat["size"] != image_record["size"]:
+            return False
+        if image_stat["mtime_ns"] == image_record["mtime_ns"]:
+            return True
+
+        digest = image_record.get("digest")  # written by split for other machines
+        if digest and digest == get_file_digest(Path(image_record["path"])):
+            image_record["mtime_ns"] = image_stat["mtime_ns"]  # touched by checkout
+            return True
+        return False
+
+    def is_unchanged(
+        self, markdown_path: Path, name_path_map: dict[str, Path] | None = None
+    ) -> bool:
+        """
+        Check note and its images are same as last converted.
+        Content hash is compared only when size is same but mtime is changed.
+
+        Args:
+            markdown_path (Path): markdown file path
+            name_path_map (dict[str, Path] | None): current images, note is changed
+                if image which was missing in last run is added
+
+        Returns:
+            bool: True if note doesn't need to be converted again
+        """
+        with self._lock:
+            record = self.notes.get(str(markdown_path))
+        if record is None or not Path(record["output"]).exists():
+            return False
+
+        try:
+            note_stat = _get_file_stat(markdown_path)
+        except OSError:
+            return False
+
+        if note_stat["size"] != record["size"]:
+            return False
+
+        if name_path_map and any(
+            name in name_path_map for name in record.get("missing", [])
+        ):
+            return False
+
+        if note_stat["mtime_ns"] != record["mtime_ns"]:  # touched, compare contents
+            if get_file_digest(markdown_path) != record["digest"]:
+                return False
+            with self._lock:
+                record["mtime_ns"] = note_stat["mtime_ns"]
+
+        return all(self._is_image_unchanged(image) for image in record["images"])
+
+    def record_note(
+        self,
+        markdown_path: Path,
+        output_path: Path,
+        images: List[ImageText],
+        digest: str | None = None,
+        missing_names: List[str] | None = None,
+    ) -> None:
+        """
+        Record converted note. Should be called after output is written
+
+        Args:
+            markdown_path (Path): markdown file path
+            output_path (Path): converted output file path
+            images (List[ImageText]): uploaded images in note
+            digest (str | None): content hash of note. md file is hashed if not given
+            missing_names (List[str] | None): image names not found in image folder
+        """
+        image_records: dict[str, dict] = {}
+        for image in images:
+            if str(image.path) not in image_records:
+                image_records[str(image.path)] = {
+                    "name": image.name,
+                    "path": str(image.path),
+                    "url": image.s3_url,
+                    **_get_file_stat(image.path),
+                }
+
+        record = {
+            **_get_file_stat(markdown_path),
+            "digest": digest or get_file_digest(markdown_path),
+            "output": str(output_path),
+            "images": list(image_records.values()),
+            "missing": sorted(set(missing_names or [])),
+        }
+        with self._lock:
+            self.notes[str(markdown_path)] = record
+            self._append_journal({"note": str(markdown_path), "record": record})
+
+    def get_uploaded_url(self, key: str, image_path: Path) -> str | None:
+        """
+        Get url of image uploaded in previous runs. Returns None if image is changed
+
+        Args:
+            key (str): object key of image
+            image_path (Path): image file path
+
+        Returns:
+            str | None: uploaded url
+        """
+        with self._lock:
+            record = self.uploads.get(key)
+        if record is None or record["path"] != str(image_path):
+            return None
+        return record["url"] if self._is_image_unchanged(record) else None
+
+    def record_upload(self, key: str, image_path: Path, url: str) -> None:
+        record = {"path": str(image_path), "url": url, **_get_file_stat(image_path)}
+        with self._lock:
+            self.uploads[key] = record
+            self._append_journal({"upload": key, "record": record})
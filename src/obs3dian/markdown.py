@@ -1,70 +1,156 @@
+import mmap
+import os
 import re
 from pathlib import Path
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import shutil
-from typing import List, Callable, Tuple
+import sys
+from typing import Iterable, Iterator, List, Tuple
 from urllib.parse import unquote
 
+from .index import ImageIndex, ImagePathMap
+from .metrics import metrics
 
-@dataclass
+
+@dataclass(slots=True, init=False)
 class ImageText:
     """
     Data container for image.
-    This class contains image file name, path and line number in markdown.
+    This class contains image file name, path, line number and link span in markdown.
+    Slotted, so images of many notes don't keep __dict__ for each link.
+    Folder Path is shared by all images in the folder and image path is made
+    when it is used, so each link doesn't keep its own Path.
     """
 
     name: str
     line_no: int
-    path: Path
+    dir_path: Path  # folder of image, path.name should be name
     metadata: str
-    s3_url: str | None = None
+    s3_url: str | None
+    span: Tuple[int, int] | None  # (start, end) offset of link in note text
+
+    def __init__(
+        self,
+        name: str,
+        line_no: int,
+        path: Path | None = None,
+        metadata: str | None = "",
+        s3_url: str | None = None,
+        span: Tuple[int, int] | None = None,
+        dir_path: Path | None = None,
+    ) -> None:
+        self.name = name
+        self.line_no = line_no
+        self.dir_path = dir_path if dir_path is not None else path.parent
+        self.metadata = "" if not metadata else metadata
+        self.s3_url = s3_url
+        self.span = span
+
+    @property
+    def path(self) -> Path:
+        return self.dir_path / self.name
+
+
+IMAGE_PATT = re.compile(
+    r"!\[\[(?P<name>[^]|\n]+\.(?:png|jpg|jpeg|gif))(?:\|(?P<wiki_metadata>[^]\n]*))?\]\]"  # ![[name|metadata]]
+    r"|!\[(?P<metadata>[^]\n]*)\]\((?P<path>[^)\n]+\.(?:png|jpg|jpeg|gif))\)"  # ![metadata](path)
+)  # both image link styles are matched in one pass, links never span lines
+IMAGE_PATT_BYTES = re.compile(IMAGE_PATT.pattern.encode())  # for bytes and mmap buffer
+LARGE_NOTE_SIZE = 8 * 1024 * 1024  # notes bigger than it are scanned by mmap
 
-    def __post_init__(self):
-        self.metadata = "" if not self.metadata else self.metadata
 
+def _get_image_info(
+    name: str | None, wiki_metadata: str | None, metadata: str | None, path: str | None
+) -> tuple[str, str | None] | None:
+    """
+    Convert matched groups to image info. External links are ignored
 
-def _extract_image_from_no_path_patt(match_result: re.Match) -> dict:
-    image_info = match_result.groupdict()
-    image_name = image_info.get("name")
-    assert image_name, "ImageText doesn't have path"
-    return image_info
+    Args:
+        name, wiki_metadata, metadata, path: groups of IMAGE_PATT match
 
+    Returns:
+        tuple[str, str | None] | None: image name, metadata
+    """
+    if name:  # ![[name|metadata]]
+        return name, wiki_metadata
 
-def _extract_image_from_path_patt(match_result: re.Match) -> dict | None:
-    image_info = match_result.groupdict()
-    image_path = image_info.get("path")
-    assert image_path, "ImageText doesn't have path"
-    if image_path[:4] in ("http", "https"):  # if link is external link
+    if path.startswith("http"):  # if link is external link
         return None
 
     try:
-        image_info["name"] = unquote(Path(image_path).name)  # update imageText name
-        return image_info
+        return unquote(Path(path).name), metadata  # update imageText name
 
     except Exception:
-        raise ValueError(f"{image_path} is invalid path")
+        raise ValueError(f"{path} is invalid path")
+
+
+def _decode_groups(match_result: re.Match) -> tuple[str | None, ...]:
+    return tuple(
+        value.decode("utf-8") if value is not None else None
+        for value in match_result.groups()
+    )
 
 
-def _extract_image_by_patt(
-    func_patt_map: List[Tuple[Callable, str]],
+def extract_images_from_text(
+    text: str | bytes | mmap.mmap,
     name_path_map: dict[str, Path],
-    line: str,
-    line_no: int,
-) -> List[dict]:
+    missing_names: List[str] | None = None,
+) -> List[ImageText]:
+    """
+    Extract images from whole markdown text.
+    Text could be bytes or mmap of file for very large notes
+
+    Args:
+        text (str | bytes | mmap.mmap): markdown text
+        name_path_map (dict[str, Path]): image name path map {abc.png : /foo/abc.png}
+        missing_names (List[str] | None): collects image names not in image folder
+
+    Returns:
+        List[ImageText]: Image data in markdown
+    """
+    is_bytes = not isinstance(text, str)
+    new_line = b"\n" if is_bytes else "\n"
+    if text.find(b"![" if is_bytes else "![") == -1:  # most notes have no image
+        return []
+
+    images: List[ImageText] = []
+    line_no, line_start = 0, 0
+    get_dir = (
+        name_path_map.get_dir  # shared folder Path, no Path for each link
+        if isinstance(name_path_map, ImagePathMap)
+        else lambda name: name_path_map[name].parent
+    )
+    patt = IMAGE_PATT_BYTES if is_bytes else IMAGE_PATT
+    for match_result in patt.finditer(text):
+        groups = _decode_groups(match_result) if is_bytes else match_result.groups()
+        image_info = _get_image_info(*groups)
+        if image_info is None:
+            continue
 
-    image_infos: List[dict] = []
-    for func, patt in func_patt_map:
-        if match_results := re.finditer(patt, line):  # match pattern
-            for match_result in match_results:
-                if image_info := func(match_result):  # run match func for patt
-                    try:
-                        image_info["path"] = name_path_map[image_info["name"]]
-                        image_info["line_no"] = line_no
-                        image_infos.append(image_info)
-                    except KeyError:  # image file could be not exists
-                        continue
+        name, metadata = image_info
+        try:
+            dir_path = get_dir(name)
+        except KeyError:  # image file could be not exists
+            if missing_names is not None:
+                missing_names.append(name)
+            continue
 
-    return image_infos
+        if isinstance(text, mmap.mmap):  # mmap has no count, count on sliced bytes
+            line_no += text[line_start : match_result.start()].count(new_line)
+        else:
+            line_no += text.count(new_line, line_start, match_result.start())
+        line_start = match_result.start()  # count new lines only once
+        images.append(
+            ImageText(
+                name=name,
+                line_no=line_no,
+                metadata=sys.intern(metadata) if metadata else "",  # like 500
+                span=match_result.span(),
+                dir_path=dir_path,
+            )
+        )
+
+    return images
 
 
 def extract_images_from_md(
@@ -80,24 +166,47 @@ def extract_images_from_md(
     Returns:
         List[ImageText]: Image data in markdown
     """
-    no_path_patt = r"!\[\[(?P<name>[^]]+\.(png|jpg|jpeg|gif))\|?(?P<metadata>[^]]+)?\]\]"  # group 1 = file_name, group 2 = foramt, group3 = imageText metadata
-    path_patt = r"!\[(?P<metadata>[^]]+)?\]\((?P<path>[^)]+\.png|jpg|jpeg|gif\))"  # group 1 = metadata group 2 = file path
+    with metrics.timer("parse"), markdown_file_path.open("rb") as f:
+        metrics.count("notes_parsed")
+        if os.fstat(f.fileno()).st_size < LARGE_NOTE_SIZE:
+            return extract_images_from_text(f.read(), name_path_map)
 
-    func_patt_map: List[Tuple[Callable, str]] = [
-        (_extract_image_from_no_path_patt, no_path_patt),
-        (_extract_image_from_path_patt, path_patt),
-    ]  # regex patt and match function
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            return extract_images_from_text(buffer, name_path_map)
 
-    images: List[ImageText] = []
-    with markdown_file_path.open("r") as f:
-        for line_no, line in enumerate(f):  # read lines
-            image_infos = _extract_image_by_patt(
-                func_patt_map, name_path_map, line, line_no
-            )
-            for image_info in image_infos:
-                images.append(ImageText(**image_info))
 
-    return images
+@dataclass(slots=True)
+class Note:
+    """
+    Parsed markdown note. Keeps note text so it is written without reading again
+    """
+
+    path: Path
+    text: bytes
+    images: List[ImageText]
+    missing_names: List[str] = field(default_factory=list)  # not in image folder
+
+
+def parse_md_file(markdown_file_path: Path, name_path_map: dict[str, Path]) -> Note:
+    """
+    Read md file once and extract images with their link spans
+
+    Args:
+        markdown_file_path (Path): markdown file path
+        name_path_map (dict[str, Path]): image name path map {abc.png : /foo/abc.png}
+
+    Returns:
+        Note: note text and images in it
+    """
+    with metrics.timer("parse"):
+        text = markdown_file_path.read_bytes()
+        missing_names: List[str] = []
+        images = extract_images_from_text(text, name_path_map, missing_names)
+
+    metrics.count("notes_parsed")
+    metrics.count("image_links", len(images))
+    metrics.count("missing_images", len(missing_names))
+    return Note(markdown_file_path, text, images, missing_names)
 
 
 def get_images_name_path_map(image_folder_path: Path) -> dict[str, Path]:
@@ -110,13 +219,118 @@ def get_images_name_path_map(image_folder_path: Path) -> dict[str, Path]:
     Returns:
         dict[str, Path]: {name, Path}
     """
-    patt = r".*\.(png|jpg|jpeg|gif)$"
-    name_path_map: dict[str, Path] = {}
-    # search all subfolders
-    for file_path in image_folder_path.rglob("**/*"):
-        if re.search(patt, file_path.suffix):
-            name_path_map[file_path.name] = file_path
-    return name_path_map
+    return ImageIndex(image_folder_path).refresh()  # search all subfolders
+
+
+def _iter_replaced_text(
+    text: str | bytes, uploaded_images: List[ImageText]
+) -> Iterator[str | bytes]:
+    """
+    Yield note text chunks in which only image link spans are replaced by S3 links
+
+    Args:
+        text (str | bytes): note text which images are extracted from
+        uploaded_images (List[ImageText]): uploaded images
+
+    Yields:
+        Iterator[str | bytes]: text chunks
+    """
+    position = 0
+    for image in sorted(uploaded_images, key=lambda image: image.span):
+        start, end = image.span
+        if start < position:  # same link is given twice
+            continue
+
+        link = f"![{image.metadata}]({image.s3_url})"
+        yield text[position:start]
+        yield link if isinstance(text, str) else link.encode("utf-8")
+        position = end
+    yield text[position:]
+
+
+def replace_images_in_text(
+    text: str | bytes, uploaded_images: List[ImageText]
+) -> str | bytes:
+    """
+    Replace image links in note text by S3 links
+
+    Args:
+        text (str | bytes): note text which images are extracted from
+        uploaded_images (List[ImageText]): uploaded images with link spans
+
+    Returns:
+        str | bytes: converted text
+    """
+    images = [image for image in uploaded_images if image.span and image.s3_url]
+    chunks = _iter_replaced_text(text, images)
+    return "".join(chunks) if isinstance(text, str) else b"".join(chunks)
+
+
+def _write_atomic(file_path: Path, chunks: Iterable[str | bytes]) -> None:
+    """
+    Write chunks to temp file in same folder and replace file by it.
+    Readers never see half written file
+
+    Args:
+        file_path (Path): file path to write
+        chunks (Iterable[str | bytes]): contents
+    """
+    temp_path = file_path.with_name(f".{file_path.name}.{os.urandom(4).hex()}.tmp")
+    # new file gets mode of open() by umask of this moment like other files
+    fd = os.open(temp_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666)
+    try:
+        with os.fdopen(fd, "wb") as temp_file:
+            for chunk in chunks:
+                temp_file.write(
+                    chunk.encode("utf-8") if isinstance(chunk, str) else chunk
+                )
+
+        if file_path.exists():
+            shutil.copymode(file_path, temp_path)  # keep permission of origin
+        os.replace(temp_path, file_path)
+
+    except BaseException as e:
+        temp_path.unlink(missing_ok=True)
+        raise e
+
+
+def _is_same_file(file_path: Path, content: bytes) -> bool:
+    """
+    Check file has same content, size is compared before reading it
+    """
+    try:
+        with file_path.open("rb") as f:
+            if os.fstat(f.fileno()).st_size != len(content):
+                return False
+            return f.read() == content
+    except FileNotFoundError:
+        return False
+
+
+def get_output_path(
+    markdown_file_path: Path,
+    output_folder_path: Path,
+    is_overwrite: bool = False,
+    markdown_root_path: Path | None = None,
+) -> Path:
+    """
+    Get output path of note. Folders of note under markdown root are kept in output folder,
+    so notes with same name in other folders don't overwrite each other
+
+    Args:
+        markdown_file_path (Path): md file path
+        output_folder_path (Path): output folder path
+        is_overwrite (bool): overwrite md file instead of writing in output folder
+        markdown_root_path (Path | None): folder given to run, note name is used if not given
+
+    Returns:
+        Path: output file path
+    """
+    if is_overwrite:
+        return markdown_file_path
+    if markdown_root_path and markdown_file_path.is_relative_to(markdown_root_path):
+        return output_folder_path / markdown_file_path.relative_to(markdown_root_path)
+    return output_folder_path / markdown_file_path.name
 
 
 def write_md_file(
@@ -124,23 +338,43 @@ def write_md_file(
     output_folder_path: Path,
     uploaded_images: List[ImageText],
     is_overwrite: bool = False,
-):
+    text: str | bytes | None = None,
+    markdown_root_path: Path | None = None,
+) -> Path:
     """
     Write new .md that replace local file link to S3 url.
-    Only replace imageText file link and other things are same
+    Only replace imageText file link and other things are same.
+    Output is not touched if it already has same content, so syncs of output folder
+    only see changed notes
     Args:
         markdown_file_path (Path): md file path
         output_folder_path (Path): output file path
-        link_replace_map (List[tuple[str, str]]): file link -> s3 url
+        uploaded_images (List[ImageText]): uploaded images with link spans
+        is_overwrite (bool): overwrite md file instead of writing in output folder
+        text (str | bytes | None): parsed note text. md file is read if not given
+        markdown_root_path (Path | None): folder given to run, its folders are mirrored
+
+    Returns:
+        Path: written file path
     """
-    out_file_path = output_folder_path.joinpath(markdown_file_path.name)
-    with open(markdown_file_path, "r") as origin_file:  # open origin file
-        with open(out_file_path, "w") as output_file:
-            for line_no, line in enumerate(origin_file):
-                for image in uploaded_images:
-                    if line_no == image.line_no:
-                        line = f"![{image.metadata}]({image.s3_url})\n"
-                output_file.write(line)  # if no replace just copy line
+    with metrics.timer("write"):
+        if text is None:
+            text = markdown_file_path.read_bytes()
 
-    if is_overwrite:
-        shutil.move(out_file_path, markdown_file_path)
+        out_file_path = get_output_path(
+            markdown_file_path, output_folder_path, is_overwrite, markdown_root_path
+        )
+        images = [image for image in uploaded_images if image.span and image.s3_url]
+        content = b"".join(
+            chunk.encode("utf-8") if isinstance(chunk, str) else chunk
+            for chunk in _iter_replaced_text(text, images)
+        )
+        if _is_same_file(out_file_path, content):  # keep mtime of unchanged output
+            metrics.count("outputs_unchanged")
+            return out_file_path
+
+        out_file_path.parent.mkdir(parents=True, exist_ok=True)
+        _write_atomic(out_file_path, [content])
+
+    metrics.count("notes_written")
+    return out_file_path
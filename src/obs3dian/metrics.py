@@ -0,0 +1,195 @@
+import heapq
+import json
+import math
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from threading import Lock
+from typing import Iterator, List
+
+SLOWEST_SIZE = 10  # number of slowest notes and images kept in report
+LATENCY_SAMPLES = 10000  # samples kept exactly, more are counted in buckets
+LATENCY_BUCKET_BASE = 1.01  # bucket bounds grow by 1%, so percentiles are within 1%
+MIN_LATENCY = 1e-6
+
+
+def _get_percentile(sorted_values: List[float], percent: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = round(percent / 100 * (len(sorted_values) - 1))  # nearest rank
+    return sorted_values[index]
+
+
+class Latency:
+    """
+    Latency samples of one name. First LATENCY_SAMPLES samples are kept exactly,
+    then they are counted in log buckets, so memory doesn't grow with size of run
+    """
+
+    __slots__ = ("count", "total", "max", "samples", "buckets")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples: List[float] | None = []
+        self.buckets: dict[int, int] = {}  # bucket index -> number of samples
+        return
+
+    def _add_to_bucket(self, seconds: float) -> None:
+        index = math.ceil(
+            math.log(max(seconds, MIN_LATENCY)) / math.log(LATENCY_BUCKET_BASE)
+        )
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def add(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        if self.samples is None:
+            self._add_to_bucket(seconds)
+            return
+
+        self.samples.append(seconds)
+        if len(self.samples) > LATENCY_SAMPLES:  # switch to buckets
+            for sample in self.samples:
+                self._add_to_bucket(sample)
+            self.samples = None
+
+    def get_percentile(self, percent: float) -> float:
+        if self.samples is not None:
+            return _get_percentile(sorted(self.samples), percent)
+
+        rank = round(percent / 100 * (self.count - 1))  # nearest rank
+        for index in sorted(self.buckets):
+            rank -= self.buckets[index]
+            if rank < 0:  # upper bound of bucket, at most max
+                return min(LATENCY_BUCKET_BASE**index, self.max)
+        return self.max
+
+
+class Metrics:
+    """
+    Thread safe timers and counters of run.
+    Stages (index, parse, upload, write) are summed over all threads, so stage totals
+    show where time goes even if stages overlap. Latencies are bounded (see Latency)
+    and slowest items are kept by small heap.
+    """
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self.reset()
+        return
+
+    def reset(self) -> None:
+        with self._lock:
+            self.started_at = time.perf_counter()
+            self.stages: dict[str, List[float]] = {}  # stage -> [seconds, count]
+            self.counters: dict[str, int] = {}
+            self.latencies: dict[str, Latency] = {}  # name -> latency samples
+            self.slowest: dict[str, List[tuple[float, str]]] = {}  # name -> min heap
+
+    @contextmanager
+    def timer(self, stage: str) -> Iterator[None]:
+        """
+        Add elapsed time of block to stage
+
+        Args:
+            stage (str): stage name
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                total = self.stages.setdefault(stage, [0.0, 0])
+                total[0] += elapsed
+                total[1] += 1
+
+    def count(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, seconds: float, label: str) -> None:
+        """
+        Record latency sample and keep it if it is one of slowest
+
+        Args:
+            name (str): latency name (upload, note)
+            seconds (float): latency
+            label (str): item of sample like image path
+        """
+        with self._lock:
+            self.latencies.setdefault(name, Latency()).add(seconds)
+            slowest = self.slowest.setdefault(name, [])
+            if len(slowest) < SLOWEST_SIZE:
+                heapq.heappush(slowest, (seconds, label))
+            elif seconds > slowest[0][0]:
+                heapq.heapreplace(slowest, (seconds, label))
+
+    def report(self) -> dict:
+        """
+        Create report of stage totals, counters, latency percentiles and slowest items
+
+        Returns:
+            dict: report which can be dumped to json
+        """
+        with self._lock:
+            latencies = {}
+            for name, latency in self.latencies.items():
+                latencies[name] = {
+                    "count": latency.count,
+                    "mean": latency.total / latency.count,
+                    "p50": latency.get_percentile(50),
+                    "p90": latency.get_percentile(90),
+                    "p99": latency.get_percentile(99),
+                    "max": latency.max,
+                }
+
+            return {
+                "elapsed": time.perf_counter() - self.started_at,
+                "stages": {
+                    stage: {"seconds": seconds, "count": count}
+                    for stage, (seconds, count) in self.stages.items()
+                },
+                "counters": dict(self.counters),
+                "latencies": latencies,
+                "slowest": {
+                    name: [
+                        {"label": label, "seconds": seconds}
+                        for seconds, label in sorted(slowest, reverse=True)
+                    ]
+                    for name, slowest in self.slowest.items()
+                },
+            }
+
+    def save(self, report_path: Path) -> None:
+        with report_path.open("w") as f:
+            json.dump(self.report(), f, indent=2)
+
+    def format_summary(self) -> str:
+        """
+        Human readable summary of report for --profile
+        """
+        report = self.report()
+        lines = [f"Elapsed {report['elapsed']:.3f}s"]
+        for stage, total in report["stages"].items():
+            lines.append(
+                f"  {stage:<10} {total['seconds']:>9.3f}s  ({total['count']} calls)"
+            )
+        for name, value in report["counters"].items():
+            lines.append(f"  {name:<20} {value:>12,}")
+        for name, latency in report["latencies"].items():
+            lines.append(
+                f"  {name} latency p50 {latency['p50'] * 1000:.1f}ms "
+                f"p90 {latency['p90'] * 1000:.1f}ms p99 {latency['p99'] * 1000:.1f}ms"
+            )
+        for name, slowest in report["slowest"].items():
+            lines.append(f"  slowest {name}")
+            for item in slowest[:5]:
+                lines.append(f"    {item['seconds']:>8.3f}s  {item['label']}")
+        return "\n".join(lines)
+
+
+metrics = Metrics()  # shared by all modules in process
@@ -0,0 +1,205 @@
+import concurrent.futures
+import multiprocessing
+import os
+import re
+from pathlib import Path
+from threading import Lock
+from typing import List
+
+from .hashing import get_file_digest
+from .markdown import ImageText
+from .metrics import metrics
+
+OPTIMIZE_SUFFIXES = (
+    ".png",
+    ".jpg",
+    ".jpeg",
+)  # gif can be animated, it is uploaded as is
+WIDTH_PATT = re.compile(r"^\s*(\d+)(?:\s*x\s*\d+)?\s*$")  # 500 or 500x300
+JPEG_QUALITY = 90  # quality of resized jpeg and webp from jpeg
+EXIF_ORIENTATION = 0x0112
+
+
+def get_display_width(metadata: str) -> int | None:
+    """
+    Get width from image metadata like ![[x.png|500]] or ![caption|500x300](x.png)
+
+    Args:
+        metadata (str): image metadata
+
+    Returns:
+        int | None: width in pixel, None if metadata has no width
+    """
+    match_result = WIDTH_PATT.match(metadata.rsplit("|", 1)[-1])
+    return int(match_result.group(1)) if match_result else None
+
+
+def _optimize_file(
+    source_path: Path, output_path: Path, width: int | None, is_webp: bool
+) -> None:
+    """
+    Recompress image without metadata and downscale it to width.
+    Runs in process pool, so Pillow is imported in worker
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(source_path) as image:
+        image_format = image.format
+        quantization = getattr(image, "quantization", None)
+        if image.getexif().get(EXIF_ORIENTATION, 1) != 1:
+            # apply orientation before EXIF is dropped, copy is not a JpegImageFile
+            image = ImageOps.exif_transpose(image)
+            quantization = None
+        is_resized = bool(width and image.width > width)
+        if is_resized:
+            height = round(image.height * width / image.width)
+            image = image.resize((width, height), Image.LANCZOS)
+
+        temp_path = output_path.with_name(output_path.name + f".{os.getpid()}.tmp")
+        if is_webp:
+            image.save(
+                temp_path,
+                "WEBP",
+                lossless=image_format == "PNG",
+                quality=JPEG_QUALITY if image_format == "JPEG" else 100,
+                method=6,
+            )
+        elif image_format == "PNG":
+            image.save(temp_path, "PNG", optimize=True)  # lossless, no text chunks
+        elif is_resized or not quantization:
+            image.convert("RGB").save(
+                temp_path, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True
+            )
+        else:  # same quantization tables, only huffman tables are optimized
+            image.save(temp_path, "JPEG", quality="keep", optimize=True)
+    os.replace(temp_path, output_path)
+
+
+def _get_failed_path(output_path: Path) -> Path:
+    return output_path.with_name(output_path.name + ".failed")
+
+
+class ImageOptimizer:
+    """
+    Optimize images before upload. PNG and JPEG are recompressed without EXIF,
+    optionally downscaled to width in note metadata and converted to WebP.
+    Outputs are cached by source hash and options in cache dir, so unchanged images are
+    not transformed again in next runs. Transforms run in process pool.
+    If optimized image is not smaller than source, source is uploaded.
+    """
+
+    def __init__(
+        self,
+        cache_dir_path: Path,
+        is_resize: bool = False,
+        is_webp: bool = False,
+        processes: int | None = None,
+    ) -> None:
+        try:
+            import PIL  # noqa: F401
+        except ImportError as e:
+            raise ImportError(
+                "Pillow is required to optimize images (pip install obs3dian[optimize])"
+            ) from e
+
+        self.cache_dir_path = cache_dir_path
+        self.is_resize = is_resize
+        self.is_webp = is_webp
+        self.cache_dir_path.mkdir(parents=True, exist_ok=True)
+        self._executor = concurrent.futures.ProcessPoolExecutor(
+            processes or os.cpu_count(),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        self._futures: dict[Path, concurrent.futures.Future] = {}
+        self._digests: dict[Path, tuple] = {}  # source path -> (file stat, digest)
+        self._lock = Lock()
+        self.errors: dict[Path, str] = {}  # source path -> error, uploaded as is
+        return
+
+    def _get_digest(self, image_path: Path) -> str:
+        stat = image_path.stat()
+        file_stat = (stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            cached_stat, digest = self._digests.get(image_path, (None, None))
+
+        if cached_stat != file_stat:  # hash each source once until it is changed
+            digest = get_file_digest(image_path)
+            with self._lock:
+                self._digests[image_path] = (file_stat, digest)
+        return digest
+
+    def _get_output_path(self, image: ImageText) -> tuple[Path, int | None]:
+        width = get_display_width(image.metadata) if self.is_resize else None
+        digest = self._get_digest(image.path)
+        name = f"{image.path.stem}-w{width}" if width else image.path.stem
+        name += image.path.suffix  # x.png and x.jpg of note get other keys
+        if self.is_webp:
+            name += ".webp"
+        return self.cache_dir_path / digest[:32] / name, width
+
+    def _submit(
+        self, image: ImageText
+    ) -> tuple[Path, concurrent.futures.Future | None]:
+        output_path, width = self._get_output_path(image)
+        if output_path.exists():  # transformed in previous run
+            metrics.count("optimize_cached")
+            return output_path, None
+        if _get_failed_path(output_path).exists():  # not tried again in next runs
+            return image.path, None
+
+        with self._lock:
+            future = self._futures.get(output_path)
+            if future is None:  # same image in other notes waits same transform
+                output_path.parent.mkdir(exist_ok=True)
+                future = self._executor.submit(
+                    _optimize_file, image.path, output_path, width, self.is_webp
+                )
+                self._futures[output_path] = future
+        return output_path, future
+
+    def optimize(self, images: List[ImageText]) -> List[Path]:
+        """
+        Optimize images of note in process pool
+
+        Args:
+            images (List[ImageText]): images with local path
+
+        Returns:
+            List[Path]: path to upload for each image, optimized or source path
+        """
+        submitted = []
+        for image in images:
+            if image.path.suffix.lower() not in OPTIMIZE_SUFFIXES:
+                submitted.append((image.path, None))
+                continue
+            submitted.append(self._submit(image))
+
+        upload_paths = []
+        for image, (output_path, future) in zip(images, submitted):
+            if output_path == image.path:
+                upload_paths.append(image.path)
+                continue
+
+            try:
+                if future:
+                    with metrics.timer("optimize"):
+                        future.result()
+                    metrics.count("optimized")
+            except Exception as e:  # broken image is uploaded as is
+                metrics.count("optimize_failed")
+                with self._lock:
+                    self.errors[image.path] = str(e)
+                _get_failed_path(output_path).touch()
+                upload_paths.append(image.path)
+                continue
+
+            saved_size = image.path.stat().st_size - output_path.stat().st_size
+            if saved_size > 0:
+                metrics.count("optimized_bytes_saved", saved_size)
+                upload_paths.append(output_path)
+            else:  # source is already small enough
+                upload_paths.append(image.path)
+        return upload_paths
+
+    def close(self) -> None:
+        self._executor.shutdown()
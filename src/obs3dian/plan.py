@@ -0,0 +1,222 @@
+import heapq
+import json
+import math
+from pathlib import Path
+from typing import Iterable, List
+
+from .config import MB
+from .index import ImageIndex
+from .markdown import parse_md_file
+
+LARGEST_SIZE = 10  # number of largest notes and duplicates kept in report
+
+
+class UploadPlan:
+    """
+    Offline plan of run. Notes are parsed with image index like run, but nothing is
+    uploaded or written, so size of migration is known before it starts.
+    Uploads are counted by key mode: note and version keys upload image once per note,
+    hash keys upload each image file once.
+    Run time is projected from per PUT latency and bandwidth if they are given.
+    """
+
+    def __init__(
+        self,
+        image_index: ImageIndex,
+        key_mode: str = "note",
+        multipart_threshold: int = 8 * MB,
+        multipart_chunksize: int = 8 * MB,
+    ) -> None:
+        self.image_index = image_index
+        self.name_path_map = image_index.refresh()
+        self.key_mode = key_mode
+        self.multipart_threshold = multipart_threshold
+        self.multipart_chunksize = multipart_chunksize
+
+        self.note_count = 0
+        self.note_bytes = 0
+        self.image_links = 0
+        self.missing_images: dict[str, int] = {}  # name -> number of links
+        self.image_sizes: dict[Path, int] = {}  # referenced image -> bytes
+        self.upload_keys: set[tuple] = set()  # uploads by key mode
+        self.upload_bytes = 0
+        self.requests = 0  # PUT requests with parts of multipart uploads
+        self.referenced_duplicates: set[str] = set()
+        self.largest_notes: List[tuple[int, int, str]] = []  # min heap of image bytes
+        return
+
+    def _get_image_size(self, image_path: Path) -> int:
+        size = self.image_sizes.get(image_path)
+        if size is None:  # stat each image once
+            size = self.image_sizes[image_path] = image_path.stat().st_size
+        return size
+
+    def _get_requests(self, size: int) -> int:
+        if size < self.multipart_threshold:
+            return 1
+        return math.ceil(size / self.multipart_chunksize) + 2  # create and complete
+
+    def add_note(self, markdown_file_path: Path) -> None:
+        """
+        Parse note and add its images to plan
+
+        Args:
+            markdown_file_path (Path): markdown file path
+        """
+        note = parse_md_file(markdown_file_path, self.name_path_map)
+        self.note_count += 1
+        self.note_bytes += len(note.text)
+        self.image_links += len(note.images)
+        for name in note.missing_names:
+            self.missing_images[name] = self.missing_images.get(name, 0) + 1
+
+        image_bytes = 0
+        for image in note.images:
+            size = self._get_image_size(image.path)
+            image_bytes += size
+            if image.name in self.image_index.duplicates:
+                self.referenced_duplicates.add(image.name)
+
+            upload_key = (
+                (image.path,)
+                if self.key_mode == "hash"
+                else (markdown_file_path.stem, image.path)
+            )  # same key is uploaded once in run
+            if upload_key not in self.upload_keys:
+                self.upload_keys.add(upload_key)
+                self.upload_bytes += size
+                self.requests += self._get_requests(size)
+
+        item = (image_bytes, len(note.images), str(markdown_file_path))
+        if len(self.largest_notes) < LARGEST_SIZE:
+            heapq.heappush(self.largest_notes, item)
+        elif item > self.largest_notes[0]:
+            heapq.heapreplace(self.largest_notes, item)
+
+    def add_notes(self, markdown_file_paths: Iterable[Path]) -> None:
+        for markdown_file_path in markdown_file_paths:
+            self.add_note(markdown_file_path)
+
+    def project_seconds(
+        self,
+        put_latency: float | None,
+        bandwidth: float | None,
+        max_concurrency: int,
+    ) -> float | None:
+        """
+        Project wall clock time of uploads. Requests wait their latency in
+        max_concurrency slots, and all bytes share bandwidth, so slower one bounds run
+
+        Args:
+            put_latency (float | None): seconds of one PUT request
+            bandwidth (float | None): upload bytes per second of whole run
+            max_concurrency (int): concurrent uploads in run
+
+        Returns:
+            float | None: seconds, None if neither latency nor bandwidth is given
+        """
+        if not (put_latency or bandwidth):
+            return None
+        latency_seconds = self.requests * (put_latency or 0) / max_concurrency
+        transfer_seconds = self.upload_bytes / bandwidth if bandwidth else 0
+        return max(latency_seconds, transfer_seconds)
+
+    def report(
+        self,
+        put_latency: float | None = None,
+        bandwidth: float | None = None,
+        max_concurrency: int = 10,
+    ) -> dict:
+        """
+        Create report of plan
+
+        Returns:
+            dict: report which can be dumped to json
+        """
+        return {
+            "notes": self.note_count,
+            "note_bytes": self.note_bytes,
+            "image_links": self.image_links,
+            "unique_images": len(self.image_sizes),
+            "total_bytes": sum(self.image_sizes.values()),
+            "key_mode": self.key_mode,
+            "uploads": len(self.upload_keys),
+            "upload_bytes": self.upload_bytes,
+            "requests": self.requests,
+            "missing_images": dict(
+                sorted(self.missing_images.items(), key=lambda item: -item[1])
+            ),
+            "duplicate_names": len(self.image_index.duplicates),
+            "referenced_duplicates": {
+                name: [str(path) for path in self.image_index.duplicates[name]]
+                for name in sorted(self.referenced_duplicates)
+            },
+            "largest_notes": [
+                {"path": path, "images": images, "image_bytes": image_bytes}
+                for image_bytes, images, path in sorted(
+                    self.largest_notes, reverse=True
+                )
+            ],
+            "projection": {
+                "put_latency": put_latency,
+                "bandwidth": bandwidth,
+                "max_concurrency": max_concurrency,
+                "seconds": self.project_seconds(
+                    put_latency, bandwidth, max_concurrency
+                ),
+            },
+        }
+
+    def save(self, report_path: Path, **kwargs) -> None:
+        with report_path.open("w") as f:
+            json.dump(self.report(**kwargs), f, indent=2)
+
+    def format_summary(self, **kwargs) -> str:
+        """
+        Human readable summary of report for plan command
+        """
+        report = self.report(**kwargs)
+        missing_links = sum(report["missing_images"].values())
+        rows = [
+            ("Notes", report["notes"], f"{report['note_bytes'] / MB:,.1f} MB"),
+            ("Image links", report["image_links"], ""),
+            (
+                "Unique images",
+                report["unique_images"],
+                f"{report['total_bytes'] / MB:,.1f} MB",
+            ),
+            (
+                f"Uploads ({report['key_mode']} keys)",
+                report["uploads"],
+                f"{report['upload_bytes'] / MB:,.1f} MB, {report['requests']:,} requests",
+            ),
+            (
+                "Missing images",
+                len(report["missing_images"]),
+                f"{missing_links:,} links",
+            ),
+            (
+                "Duplicate names",
+                report["duplicate_names"],
+                f"{len(report['referenced_duplicates']):,} used in notes",
+            ),
+        ]
+        lines = [f"{label:<22} {value:>12,}  {detail}" for label, value, detail in rows]
+        for name, count in list(report["missing_images"].items())[:LARGEST_SIZE]:
+            lines.append(f"  missing {name} ({count} links)")
+        for name, paths in list(report["referenced_duplicates"].items())[:LARGEST_SIZE]:
+            lines.append(f"  duplicated {name}, {paths[0]} is used")
+
+        lines.append("Largest notes")
+        for note in report["largest_notes"]:
+            lines.append(
+                f"  {note['image_bytes'] / MB:>9.1f} MB {note['images']:>6} images  {note['path']}"
+            )
+
+        projection = report["projection"]
+        if projection["seconds"] is not None:
+            lines.append(
+                f"Projected upload time {projection['seconds']:,.1f}s "
+                f"with {projection['max_concurrency']} concurrent uploads"
+            )
+        return "\n".join(lines)
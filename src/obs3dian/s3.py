@@ -1,10 +1,116 @@
 import boto3
-from botocore.exceptions import ClientError
+from boto3.exceptions import S3UploadFailedError
+from boto3.s3.transfer import TransferConfig
+from s3transfer.utils import ChunksizeAdjuster
+from botocore.config import Config
+from botocore.exceptions import (
+    ClientError,
+    ConnectionError as BotoConnectionError,
+    HTTPClientError,
+)
+import concurrent.futures
 import json
+import mimetypes
+import os
 from pathlib import Path
+from threading import Lock
+import time
+from typing import Iterable
 from urllib import parse
 
+from .config import KEY_MODES, MB
+from .hashing import get_file_digest, get_file_etag
 from .markdown import ImageText
+from .metrics import metrics
+from .scheduler import THROTTLE, TRANSIENT
+
+DEFAULT_REGION = "ap-northeast-2"
+CONTENT_KEY_MODES = ("hash", "version")  # key is changed when image is changed
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+HASH_KEY_PREFIX = "hash/"  # hash keys are listed without note keys
+NOTE_KEY_SEPARATOR = " / "
+LIST_PREFIX_LIMIT = 32  # more prefixes list whole bucket if it fits in one page
+LIST_PAGE_KEYS = 1000  # max keys of one LIST call
+
+IMAGE_CONTENT_TYPES = {
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".gif": "image/gif",
+    ".webp": "image/webp",
+    ".avif": "image/avif",
+    ".svg": "image/svg+xml",
+    ".bmp": "image/bmp",
+    ".ico": "image/x-icon",
+    ".tif": "image/tiff",
+    ".tiff": "image/tiff",
+}  # mime.types of os can miss newer formats
+
+
+THROTTLE_ERROR_CODES = (
+    "SlowDown",
+    "Throttling",
+    "ThrottlingException",
+    "RequestLimitExceeded",
+    "TooManyRequestsException",
+)
+TRANSIENT_ERROR_CODES = ("RequestTimeout", "InternalError", "ServiceUnavailable")
+
+
+def classify_error(error: Exception) -> str | None:
+    """
+    Classify upload error for UploadScheduler
+
+    Args:
+        error (Exception): error raised by upload
+
+    Returns:
+        str | None: THROTTLE, TRANSIENT or None if retry would not help
+    """
+    if isinstance(error, S3UploadFailedError) and error.__context__:
+        error = error.__context__  # s3transfer wraps ClientError of failed part
+
+    if isinstance(error, ClientError):
+        code = error.response.get("Error", {}).get("Code")
+        status = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0)
+        if code in THROTTLE_ERROR_CODES or status in (429, 503):
+            return THROTTLE
+        if code in TRANSIENT_ERROR_CODES or status >= 500:
+            return TRANSIENT
+        return None
+
+    if isinstance(error, (BotoConnectionError, HTTPClientError)):  # reset, timeout
+        return TRANSIENT
+    return None
+
+
+def get_content_type(image_path: Path) -> str:
+    """
+    Get MIME type of image by suffix
+
+    Args:
+        image_path (Path): image file path
+
+    Returns:
+        str: MIME type like image/png, application/octet-stream if it is unknown
+    """
+    suffix = image_path.suffix.lower()
+    if suffix in IMAGE_CONTENT_TYPES:
+        return IMAGE_CONTENT_TYPES[suffix]
+    content_type, _ = mimetypes.guess_type(image_path.name)
+    return content_type or "application/octet-stream"
+
+
+def _get_file_stat(file_path: Path) -> tuple[int, int]:
+    stat = file_path.stat()
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _count_retries(parsed: dict | None = None, **kwargs) -> None:
+    # botocore retries bucket calls, listings and parts by itself
+    attempts = (parsed or {}).get("ResponseMetadata", {}).get("RetryAttempts", 0)
+    if attempts:
+        metrics.count("retries", attempts)
 
 
 class S3:
@@ -20,21 +126,86 @@ class S3:
         profile_name: str | None = None,
         aws_access_key: str | None = None,
         aws_secret_key: str | None = None,
+        key_mode: str = "note",
+        max_pool_connections: int = 10,
+        multipart_threshold: int = 8 * MB,
+        multipart_chunksize: int = 8 * MB,
+        transfer_concurrency: int = 4,
+        cache_control: str | None = None,
+        region_name: str | None = None,
+        endpoint_url: str | None = None,
+        path_style: bool = False,
+        public_url: str | None = None,
     ) -> None:
 
-        if profile_name:
-            self.session = boto3.Session(profile_name=profile_name)
+        if key_mode not in KEY_MODES:
+            raise ValueError(f"Key mode should be one of {', '.join(KEY_MODES)}")
+
+        if profile_name:  # region of profile is used if region is not given
+            self.session = boto3.Session(
+                profile_name=profile_name, region_name=region_name or None
+            )
         elif aws_access_key and aws_secret_key:
             self.session = boto3.Session(
                 aws_access_key_id=aws_access_key,
                 aws_secret_access_key=aws_secret_key,
-                region_name="ap-northeast-2",
+                region_name=region_name or DEFAULT_REGION,
             )
         else:
             raise ValueError("Need profile name or Access Key & Secret Key")
 
-        self.s3 = self.session.client("s3")
+        client_config = Config(
+            max_pool_connections=max_pool_connections,
+            s3={"addressing_style": "path" if path_style else "auto"},
+        )  # connections should cover concurrent uploads
+        self.s3 = self.session.client(
+            "s3",
+            endpoint_url=endpoint_url or None,  # AWS_ENDPOINT_URL is used if not given
+            config=client_config,
+        )  # botocore retries bucket calls, listings and parts of multipart uploads
+        self._put_client = self.session.client(
+            "s3",
+            endpoint_url=endpoint_url or None,
+            config=client_config.merge(Config(retries={"total_max_attempts": 1})),
+        )  # single PUTs are retried and throttled by UploadScheduler
+        for client in (self.s3, self._put_client):
+            client.meta.events.register("after-call.s3", _count_retries)
         self.bucket_name = bucket_name
+        self.region_name = self.s3.meta.region_name or DEFAULT_REGION
+        self.endpoint_url = self.s3.meta.endpoint_url
+        endpoint = parse.urlsplit(self.endpoint_url)
+        self.is_path_style = path_style or not endpoint.hostname.endswith(
+            "amazonaws.com"
+        )  # S3 compatible servers like MinIO are addressed by path
+        if public_url:  # CDN or domain in front of bucket
+            self.url_base = public_url.rstrip("/")
+        elif self.is_path_style:
+            self.url_base = (
+                f"{self.endpoint_url.rstrip('/')}/{parse.quote(bucket_name)}"
+            )
+        else:
+            self.url_base = f"{endpoint.scheme}://{bucket_name}.{endpoint.netloc}"
+        self.key_mode = key_mode
+        self.is_content_key = key_mode in CONTENT_KEY_MODES
+        if cache_control is None and self.is_content_key:
+            cache_control = IMMUTABLE_CACHE_CONTROL  # url always points same content
+        self.cache_control = cache_control or None  # "" sets no Cache-Control
+        self.transfer_config = TransferConfig(
+            multipart_threshold=multipart_threshold,
+            multipart_chunksize=multipart_chunksize,
+            max_concurrency=transfer_concurrency,
+            use_threads=transfer_concurrency > 1,
+        )  # files bigger than threshold are uploaded by parts
+
+        self._lock = Lock()
+        self._digests: dict[Path, tuple] = {}  # image path -> (file stat, digest)
+        self._uploaded_keys: dict[str, tuple | None] = {}  # key -> file stat uploaded
+        self._etags: dict[Path, tuple] = {}  # image path -> (file stat, local ETag)
+        self._max_list_workers = max_pool_connections
+        self._listed_prefixes: set[str] = set()
+        self._remote_objects: dict[str, tuple[int, str]] = {}  # key -> (size, ETag)
+        self.list_error: ClientError | None = None  # last failed listing
+        self._is_big_bucket = False  # whole bucket doesn't fit in one LIST page
         return
 
     def _check_bucket_exist(self) -> bool:
@@ -79,21 +250,30 @@ class S3:
                 return False
 
             bucket_name = self.bucket_name
+            bucket_config = {}
+            if self.region_name != "us-east-1":  # us-east-1 has no location constraint
+                bucket_config["CreateBucketConfiguration"] = {
+                    "LocationConstraint": self.region_name
+                }
             self.s3.create_bucket(
-                CreateBucketConfiguration={"LocationConstraint": "ap-northeast-2"},
                 Bucket=bucket_name,
                 ObjectOwnership="ObjectWriter",
+                **bucket_config,
             )
 
-            self.s3.put_public_access_block(
-                Bucket=bucket_name,
-                PublicAccessBlockConfiguration={
-                    "BlockPublicAcls": False,
-                    "IgnorePublicAcls": False,
-                    "BlockPublicPolicy": False,
-                    "RestrictPublicBuckets": False,
-                },
-            )
+            try:
+                self.s3.put_public_access_block(
+                    Bucket=bucket_name,
+                    PublicAccessBlockConfiguration={
+                        "BlockPublicAcls": False,
+                        "IgnorePublicAcls": False,
+                        "BlockPublicPolicy": False,
+                        "RestrictPublicBuckets": False,
+                    },
+                )
+            except ClientError as e:  # S3 compatible servers like MinIO have no block
+                if e.response["Error"]["Code"] != "NotImplemented":
+                    raise e
             self._put_public_access_policy()
             return True
 
@@ -101,24 +281,258 @@ class S3:
             print("Error occured in create bucket")
             raise e
 
-    def _get_image_url(self, markdown_path: Path, image_path: Path) -> str:
-        region = self.session.region_name
-        key = f"{markdown_path.stem} / {image_path.name}"
-        s3_url = f"https://{self.bucket_name}.s3.{region}.amazonaws.com/{parse.quote(key)}"  # image uploaded url
-        return s3_url
-
-    def put_image(self, markdown_path: Path, image: ImageText) -> ImageText:
+    def _check_object_exist(self, key: str) -> bool:
         try:
-            self.s3.put_object(
-                Bucket=self.bucket_name,
-                Body=image.path.open("rb"),
-                Key=f"{markdown_path.stem} / {image.name}",
-                ContentType=f"image/{image.path.suffix}",
-            )  # upload image
-            s3_url = self._get_image_url(markdown_path, image.path)
-            image.s3_url = s3_url
-            return image
+            self.s3.head_object(Bucket=self.bucket_name, Key=key)
+            return True
 
         except ClientError as e:
-            print(f"Error Occured in uploading {image.path}")
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                return False
             raise e
+
+    def _get_image_digest(self, image_path: Path) -> str:
+        file_stat = _get_file_stat(image_path)
+        with self._lock:
+            cached_stat, digest = self._digests.get(image_path, (None, None))
+
+        if cached_stat != file_stat:  # hash each file only once until it is changed
+            digest = get_file_digest(image_path)
+            with self._lock:
+                self._digests[image_path] = (file_stat, digest)
+        return digest
+
+    def _get_upload_stat(self, image_path: Path) -> tuple | None:
+        # content key already tells content, note key is same after image is changed
+        return None if self.is_content_key else _get_file_stat(image_path)
+
+    def get_key_prefix(self, markdown_path: Path) -> str:
+        """
+        Get common prefix of image keys of note. Hash keys of all notes share one prefix
+
+        Args:
+            markdown_path (Path): markdown file path
+
+        Returns:
+            str: key prefix
+        """
+        if self.key_mode == "hash":
+            return HASH_KEY_PREFIX
+        return f"{markdown_path.stem}{NOTE_KEY_SEPARATOR}"
+
+    def _list_prefix(self, prefix: str) -> dict[str, tuple[int, str]]:
+        objects = {}
+        paginator = self.s3.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix):
+            for content in page.get("Contents", []):  # 1000 keys per page
+                objects[content["Key"]] = (content["Size"], content["ETag"].strip('"'))
+        return objects
+
+    def _list_small_bucket(self) -> dict[str, tuple[int, str]] | None:
+        """
+        List first page of bucket. Keys of big or shared bucket are not kept in memory
+
+        Returns:
+            dict[str, tuple[int, str]] | None: objects, None if bucket has more pages
+        """
+        if self._is_big_bucket:  # probed in previous batch
+            return None
+        response = self.s3.list_objects_v2(
+            Bucket=self.bucket_name, MaxKeys=LIST_PAGE_KEYS
+        )
+        if response.get("IsTruncated"):
+            self._is_big_bucket = True
+            return None
+        return {
+            content["Key"]: (content["Size"], content["ETag"].strip('"'))
+            for content in response.get("Contents", [])
+        }
+
+    def load_remote_objects(self, prefixes: Iterable[str]) -> None:
+        """
+        List objects under prefixes once, so images already in bucket are found
+        without HEAD or PUT for each image. Listing is skipped if it is not allowed.
+        If there are more than LIST_PREFIX_LIMIT prefixes, like one for each note,
+        and whole bucket fits in one page, bucket is listed by one LIST call.
+        Otherwise prefixes are listed in parallel, so only keys of notes are kept
+
+        Args:
+            prefixes (Iterable[str]): key prefixes to list, "" lists whole bucket
+        """
+        with self._lock:
+            if "" in self._listed_prefixes:  # every key is already listed
+                return
+            prefixes = set(prefixes) - self._listed_prefixes
+        if "" in prefixes:
+            prefixes = {""}
+        if not prefixes:
+            return
+
+        try:
+            if len(prefixes) > LIST_PREFIX_LIMIT:
+                with metrics.timer("list"):
+                    objects = self._list_small_bucket()
+                if objects is not None:  # whole bucket is listed
+                    with self._lock:
+                        self._remote_objects.update(objects)
+                        self._listed_prefixes.add("")
+                    metrics.count("listed_objects", len(objects))
+                    return
+
+            workers = min(self._max_list_workers, len(prefixes))
+            with metrics.timer("list"), concurrent.futures.ThreadPoolExecutor(
+                workers
+            ) as executor:
+                for prefix, objects in zip(
+                    prefixes, executor.map(self._list_prefix, prefixes)
+                ):
+                    with self._lock:
+                        self._remote_objects.update(objects)
+                        self._listed_prefixes.add(prefix)
+                    metrics.count("listed_objects", len(objects))
+
+        except ClientError as e:  # uploads are not skipped, caller reports it
+            self.list_error = e
+
+    def _get_remote_object(self, key: str) -> tuple[bool, tuple[int, str] | None]:
+        """
+        Returns:
+            tuple[bool, tuple[int, str] | None]: key is listed, (size, ETag) of object
+        """
+        if key.startswith(HASH_KEY_PREFIX):
+            prefix = HASH_KEY_PREFIX
+        else:
+            prefix = f"{key.split(NOTE_KEY_SEPARATOR, 1)[0]}{NOTE_KEY_SEPARATOR}"
+        with self._lock:
+            is_listed = "" in self._listed_prefixes or prefix in self._listed_prefixes
+            return is_listed, self._remote_objects.get(key)
+
+    def _get_local_etag(self, image_path: Path) -> str:
+        file_stat = _get_file_stat(image_path)
+        with self._lock:
+            cached_stat, etag = self._etags.get(image_path, (None, None))
+
+        if cached_stat != file_stat:
+            part_size = ChunksizeAdjuster().adjust_chunksize(
+                self.transfer_config.multipart_chunksize, file_stat[0]
+            )  # same part size as upload_fileobj
+            etag = get_file_etag(
+                image_path, self.transfer_config.multipart_threshold, part_size
+            )
+            with self._lock:
+                self._etags[image_path] = (file_stat, etag)
+        return etag
+
+    def _mark_uploaded(self, key: str, image_path: Path) -> None:
+        with self._lock:
+            self._uploaded_keys[key] = self._get_upload_stat(image_path)
+
+    def _is_uploaded(self, key: str, image_path: Path) -> bool:
+        upload_stat = self._get_upload_stat(image_path)
+        with self._lock:
+            if key in self._uploaded_keys and self._uploaded_keys[key] == upload_stat:
+                return True
+
+        is_listed, remote_object = self._get_remote_object(key)
+        if is_listed:
+            is_same = (
+                remote_object is not None
+                and remote_object[0] == image_path.stat().st_size
+            )
+            if is_same and not self.is_content_key:  # content key already tells it
+                is_same = remote_object[1] == self._get_local_etag(image_path)
+            if is_same:
+                with self._lock:
+                    self._uploaded_keys[key] = upload_stat
+            return is_same
+
+        if not self.is_content_key:  # note keys can point to stale content
+            return False
+
+        if self._check_object_exist(key):  # same digest means same content
+            with self._lock:
+                self._uploaded_keys[key] = None
+            return True
+        return False
+
+    def get_image_key(self, markdown_path: Path, image_path: Path) -> str:
+        """
+        Get object key of image. In hash mode same image shares one key in all notes.
+        In version mode key of note has digest of image, so changed image gets new url
+
+        Args:
+            markdown_path (Path): markdown file path which uses image
+            image_path (Path): image file path
+
+        Returns:
+            str: S3 object key
+        """
+        if self.key_mode == "hash":
+            digest = self._get_image_digest(image_path)
+            return f"{HASH_KEY_PREFIX}{digest}{image_path.suffix.lower()}"
+        if self.key_mode == "version":
+            digest = self._get_image_digest(image_path)[:16]
+            return (
+                f"{markdown_path.stem} / {image_path.stem}.{digest}{image_path.suffix}"
+            )
+        return f"{markdown_path.stem} / {image_path.name}"
+
+    def get_extra_args(self, image_path: Path) -> dict[str, str]:
+        """
+        Get object metadata of image upload
+
+        Args:
+            image_path (Path): image file path
+
+        Returns:
+            dict[str, str]: ContentType and CacheControl args of PutObject
+        """
+        extra_args = {"ContentType": get_content_type(image_path)}
+        if self.cache_control:
+            extra_args["CacheControl"] = self.cache_control
+        return extra_args
+
+    def _get_image_url(self, key: str) -> str:
+        return f"{self.url_base}/{parse.quote(key)}"  # image uploaded url
+
+    def upload_image(self, key: str, image_path: Path) -> str:
+        """
+        Upload image by key. Upload is skipped if key is already in bucket
+
+        Args:
+            key (str): object key
+            image_path (Path): image file path
+
+        Returns:
+            str: uploaded image url
+        """
+        if self._is_uploaded(key, image_path):  # skip images already in bucket
+            metrics.count("uploads_skipped")
+            return self._get_image_url(key)
+
+        start = time.perf_counter()
+        with metrics.timer("upload"), image_path.open("rb") as f:
+            uploaded_bytes = os.fstat(f.fileno()).st_size
+            client = (
+                self.s3
+                if uploaded_bytes >= self.transfer_config.multipart_threshold
+                else self._put_client
+            )  # failed part is retried alone, not whole file
+            client.upload_fileobj(
+                f,
+                self.bucket_name,
+                key,
+                ExtraArgs=self.get_extra_args(image_path),
+                Config=self.transfer_config,
+            )  # stream file from disk, multipart if it is big
+
+        metrics.observe("upload", time.perf_counter() - start, str(image_path))
+        metrics.count("uploads")
+        metrics.count("bytes_uploaded", uploaded_bytes)
+        self._mark_uploaded(key, image_path)
+        return self._get_image_url(key)
+
+    def put_image(self, markdown_path: Path, image: ImageText) -> ImageText:
+        key = self.get_image_key(markdown_path, image.path)
+        image.s3_url = self.upload_image(key, image.path)
+        return image
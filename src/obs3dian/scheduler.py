@@ -0,0 +1,316 @@
+import asyncio
+import concurrent.futures
+import inspect
+import random
+import time
+from pathlib import Path
+from threading import Condition, Lock, Thread
+from typing import Awaitable, Callable
+
+from .metrics import metrics
+
+
+def _get_size(file_path: Path) -> int:
+    try:
+        return file_path.stat().st_size
+    except OSError:  # removed after upload
+        return 0
+
+
+THROTTLE = "throttle"  # server asks to slow down, concurrency is decreased
+TRANSIENT = "transient"  # timeout, reset or 5xx, upload is retried
+LATENCY_TOLERANCE = 3.0  # concurrency is not increased if upload is this times slower
+MIN_COST_SIZE = 64 * 1024  # small files are counted as this size in latency per byte
+
+
+class AdaptiveLimiter:
+    """
+    AIMD limit of in-flight uploads.
+    Limit grows by 1 after every `limit` fast uploads and is halved on throttle response,
+    at most once per round trip so a burst of throttles counts as one.
+    Latency is compared by seconds per byte because images have different sizes.
+    """
+
+    def __init__(
+        self, max_limit: int, min_limit: int = 1, decrease_factor: float = 0.5
+    ) -> None:
+        self.max_limit = max_limit
+        self.min_limit = min(min_limit, max_limit)
+        self.decrease_factor = decrease_factor
+        self.limit = float(max_limit)  # start at configured max, decrease on throttle
+
+        self._in_flight = 0
+        self._condition = Condition()
+        self._base_cost: float | None = None  # lowest smoothed seconds per byte
+        self._cost: float | None = None  # smoothed seconds per byte
+        self._latency = 1.0  # smoothed seconds of upload
+        self._last_decrease = 0.0
+        return
+
+    def acquire(self) -> None:
+        with self._condition:
+            while self._in_flight >= int(self.limit):
+                self._condition.wait()
+            self._in_flight += 1
+
+    def release(
+        self, latency: float | None = None, size: int = 0, is_throttled: bool = False
+    ) -> None:
+        """
+        Release slot and adjust limit
+
+        Args:
+            latency (float | None): seconds of successful upload, None if upload failed
+            size (int): uploaded bytes
+            is_throttled (bool): upload is failed by throttle response
+        """
+        with self._condition:
+            self._in_flight -= 1
+            self._adjust(latency, size, is_throttled)
+            self._condition.notify_all()
+
+    def _adjust(self, latency: float | None, size: int, is_throttled: bool) -> None:
+        if is_throttled:
+            now = time.monotonic()
+            if now - self._last_decrease > self._latency:
+                self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+                self._last_decrease = now
+                metrics.count("concurrency_decreases")
+
+        elif latency is not None:
+            self._latency = self._latency * 0.8 + latency * 0.2
+            cost = latency / max(size, MIN_COST_SIZE)
+            self._cost = cost if self._cost is None else self._cost * 0.8 + cost * 0.2
+            self._base_cost = min(self._base_cost or self._cost, self._cost)
+            if self._cost <= self._base_cost * LATENCY_TOLERANCE:  # not congested
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+
+class AsyncAdaptiveLimiter(AdaptiveLimiter):
+    """
+    AdaptiveLimiter for coroutines in one event loop
+    """
+
+    def __init__(
+        self, max_limit: int, min_limit: int = 1, decrease_factor: float = 0.5
+    ) -> None:
+        super().__init__(max_limit, min_limit, decrease_factor)
+        self._async_condition = asyncio.Condition()
+        return
+
+    async def acquire(self) -> None:
+        async with self._async_condition:
+            await self._async_condition.wait_for(
+                lambda: self._in_flight < int(self.limit)
+            )
+            self._in_flight += 1
+
+    async def release(
+        self, latency: float | None = None, size: int = 0, is_throttled: bool = False
+    ) -> None:
+        async with self._async_condition:
+            self._in_flight -= 1
+            self._adjust(latency, size, is_throttled)
+            self._async_condition.notify_all()
+
+
+class UploadScheduler:
+    """
+    Upload queue shared by all notes in a run.
+    All uploads run in one bounded thread pool, and in-flight uploads are limited by
+    AdaptiveLimiter, so concurrent PUTs never exceed max_concurrency and shrink on throttle.
+    Same (key, file) is queued once and every note waits on the same future.
+    Throttled and transient failures are retried with jittered exponential backoff.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 10,
+        classify_error: Callable[[Exception], str | None] | None = None,
+        max_retries: int = 5,
+        base_delay: float = 0.2,
+        max_delay: float = 20.0,
+    ) -> None:
+        if max_concurrency < 1:
+            raise ValueError("Max concurrency should be bigger than 0")
+
+        self.max_concurrency = max_concurrency
+        self.classify_error = classify_error  # returns THROTTLE, TRANSIENT or None
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.limiter = AdaptiveLimiter(max_concurrency)
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix="obs3dian-upload"
+        )
+        self._futures: dict[tuple[str, Path], concurrent.futures.Future] = {}
+        self._lock = Lock()
+        return
+
+    def _get_backoff(self, attempt: int) -> float:
+        # full jitter spreads retries of uploads throttled at same time
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+    def _run(self, image_path: Path, upload: Callable[[], str]) -> str:
+        attempt = 0
+        while True:
+            self.limiter.acquire()
+            start = time.perf_counter()
+            try:
+                url = upload()
+            except Exception as e:
+                kind = self.classify_error(e) if self.classify_error else None
+                self.limiter.release(is_throttled=kind == THROTTLE)
+                if kind is None or attempt >= self.max_retries:
+                    raise e
+
+                metrics.count("retries")
+                if kind == THROTTLE:
+                    metrics.count("throttles")
+                time.sleep(self._get_backoff(attempt))
+                attempt += 1
+                continue
+
+            self.limiter.release(time.perf_counter() - start, _get_size(image_path))
+            return url
+
+    def _start(
+        self, image_path: Path, upload: Callable[[], str]
+    ) -> concurrent.futures.Future:
+        return self._executor.submit(self._run, image_path, upload)
+
+    def submit(
+        self, key: str, image_path: Path, upload: Callable[[], str]
+    ) -> concurrent.futures.Future:
+        """
+        Queue upload of image. Returns queued future if same image is already queued
+
+        Args:
+            key (str): object key to upload
+            image_path (Path): image file path
+            upload (Callable[[], str]): function uploads image and returns url
+
+        Returns:
+            concurrent.futures.Future: future of uploaded url
+        """
+        with self._lock:
+            future = self._futures.get((key, image_path))
+            if future is None:
+                future = self._start(image_path, upload)
+                self._futures[(key, image_path)] = future
+        return future
+
+    def forget_finished(self) -> None:
+        """
+        Drop finished uploads, so changed images can be queued again in long running session
+        """
+        with self._lock:
+            self._futures = {
+                upload: future
+                for upload, future in self._futures.items()
+                if not future.done()
+            }
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
+
+    def __enter__(self) -> "UploadScheduler":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.shutdown()
+
+
+class AsyncUploadScheduler(UploadScheduler):
+    """
+    UploadScheduler which runs uploads as coroutines in one event loop thread,
+    so hundreds of uploads can be in flight without thread for each upload.
+    Upload function may return awaitable like AsyncS3.upload_image
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 100,
+        classify_error: Callable[[Exception], str | None] | None = None,
+        max_retries: int = 5,
+        base_delay: float = 0.2,
+        max_delay: float = 20.0,
+    ) -> None:
+        if max_concurrency < 1:
+            raise ValueError("Max concurrency should be bigger than 0")
+
+        self.max_concurrency = max_concurrency
+        self.classify_error = classify_error
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.limiter = AsyncAdaptiveLimiter(max_concurrency)
+        self._futures: dict[tuple[str, Path], concurrent.futures.Future] = {}
+        self._lock = Lock()
+        self._shutdown_callbacks: list[Callable[[], Awaitable]] = []
+
+        self.loop = asyncio.new_event_loop()
+        self._thread = Thread(
+            target=self.loop.run_forever, name="obs3dian-upload-loop", daemon=True
+        )
+        self._thread.start()
+        return
+
+    def add_shutdown_callback(self, callback: Callable[[], Awaitable]) -> None:
+        """
+        Add coroutine function to run in event loop before it is stopped,
+        like closing connection pool
+        """
+        self._shutdown_callbacks.append(callback)
+
+    async def _run_async(self, image_path: Path, upload: Callable) -> str:
+        attempt = 0
+        while True:
+            await self.limiter.acquire()
+            start = time.perf_counter()
+            try:
+                url = upload()
+                if inspect.isawaitable(url):
+                    url = await url
+            except Exception as e:
+                kind = self.classify_error(e) if self.classify_error else None
+                await self.limiter.release(is_throttled=kind == THROTTLE)
+                if kind is None or attempt >= self.max_retries:
+                    raise e
+
+                metrics.count("retries")
+                if kind == THROTTLE:
+                    metrics.count("throttles")
+                await asyncio.sleep(self._get_backoff(attempt))
+                attempt += 1
+                continue
+
+            await self.limiter.release(
+                time.perf_counter() - start, _get_size(image_path)
+            )
+            return url
+
+    def _start(self, image_path: Path, upload: Callable) -> concurrent.futures.Future:
+        return asyncio.run_coroutine_threadsafe(
+            self._run_async(image_path, upload), self.loop
+        )
+
+    async def _close(self) -> None:
+        for callback in self._shutdown_callbacks:
+            await callback()
+
+    def shutdown(self, wait: bool = True) -> None:
+        if self.loop.is_closed():
+            return
+        with self._lock:
+            futures = list(self._futures.values())
+        if wait:
+            concurrent.futures.wait(futures)
+        else:
+            for future in futures:
+                future.cancel()
+
+        asyncio.run_coroutine_threadsafe(self._close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
@@ -0,0 +1,40 @@
+import hashlib
+from pathlib import Path
+
+
+def parse_shard(shard: str) -> tuple[int, int]:
+    """
+    Parse shard option like 2/4 (second of 4 shards)
+
+    Args:
+        shard (str): "{index}/{count}", index starts from 1
+
+    Returns:
+        tuple[int, int]: index from 0, number of shards
+    """
+    try:
+        index, count = (int(number) for number in shard.split("/"))
+    except ValueError as e:
+        raise ValueError(f"Shard should be like 1/4, not {shard}") from e
+
+    if not 1 <= index <= count:
+        raise ValueError(f"Shard index should be in 1 ~ {count}, not {index}")
+    return index - 1, count
+
+
+def get_shard_index(markdown_path: Path, root: Path, shard_count: int) -> int:
+    """
+    Get shard of note by hash of its path relative to vault root,
+    so every machine puts note in same shard even if vault is in other folder
+
+    Args:
+        markdown_path (Path): markdown file path under root
+        root (Path): vault folder given to run
+        shard_count (int): number of shards
+
+    Returns:
+        int: shard index from 0
+    """
+    relative_path = markdown_path.relative_to(root).as_posix()
+    digest = hashlib.sha256(relative_path.encode()).digest()
+    return int.from_bytes(digest[:8], "big") % shard_count
@@ -0,0 +1,343 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Iterator, List
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_MOVED_FROM | IN_DELETE
+EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, name length
+
+
+def _is_ignored(path: Path, root: Path, ignore_paths: List[Path]) -> bool:
+    """
+    Hidden files and folders (.obsidian, .trash, temp files) and ignored paths
+    like output folder are not watched
+    """
+    if any(path == ignore or ignore in path.parents for ignore in ignore_paths):
+        return True
+    return any(part.startswith(".") for part in path.relative_to(root).parts)
+
+
+def _iter_markdown_files(root: Path, ignore_paths: List[Path]) -> Iterator[Path]:
+    for dir_path, dir_names, file_names in os.walk(root):
+        dir_names[:] = [
+            name
+            for name in dir_names
+            if not _is_ignored(Path(dir_path) / name, root, ignore_paths)
+        ]  # do not walk into ignored folders
+        for file_name in file_names:
+            file_path = Path(dir_path) / file_name
+            if file_name.endswith(".md") and not _is_ignored(
+                file_path, root, ignore_paths
+            ):
+                yield file_path
+
+
+class PollingWatcher:
+    """
+    Watcher compares size and mtime of all notes in every interval.
+    Folders of image root are compared by mtime, which is changed when images are
+    added, removed or renamed in them. It is used when inotify is not available
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        ignore_paths: List[Path],
+        interval: float = 1.0,
+        image_root: Path | None = None,
+    ) -> None:
+        self.root = root
+        self.ignore_paths = ignore_paths
+        self.interval = interval
+        self.image_root = image_root
+        self._snapshot = self._take_snapshot()
+        self._image_dirs = self._take_image_snapshot()
+        self._is_images_changed = False
+        self._last_poll = time.monotonic()
+        return
+
+    def _take_image_snapshot(self) -> dict[Path, int]:
+        image_dirs = {}
+        if self.image_root is None:
+            return image_dirs
+        for dir_path, dir_names, _ in os.walk(self.image_root):
+            dir_names[:] = [
+                name
+                for name in dir_names
+                if not _is_ignored(
+                    Path(dir_path) / name, self.image_root, self.ignore_paths
+                )
+            ]
+            try:
+                image_dirs[Path(dir_path)] = os.stat(dir_path).st_mtime_ns
+            except FileNotFoundError:  # removed while walking
+                continue
+        return image_dirs
+
+    def _is_image_dirs_changed(self) -> bool:
+        for dir_path, mtime_ns in self._image_dirs.items():
+            try:
+                if os.stat(dir_path).st_mtime_ns != mtime_ns:
+                    return True
+            except FileNotFoundError:
+                return True
+        return False
+
+    def take_images_changed(self) -> bool:
+        """
+        Check images are changed since last call, so image map is refreshed only then
+        """
+        is_changed, self._is_images_changed = self._is_images_changed, False
+        return is_changed
+
+    def _take_snapshot(self) -> dict[Path, tuple[int, int]]:
+        snapshot = {}
+        for markdown_path in _iter_markdown_files(self.root, self.ignore_paths):
+            try:
+                stat = markdown_path.stat()
+            except FileNotFoundError:  # removed while walking
+                continue
+            snapshot[markdown_path] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def poll(self, timeout: float | None) -> set[Path]:
+        """
+        Wait changes of notes
+
+        Args:
+            timeout (float | None): max seconds to wait, None waits next interval
+
+        Returns:
+            set[Path]: created or modified notes
+        """
+        wait = self.interval - (time.monotonic() - self._last_poll)
+        if timeout is not None:
+            wait = min(wait, timeout)
+        if wait > 0:
+            time.sleep(wait)
+
+        snapshot = self._take_snapshot()
+        if self._is_image_dirs_changed():  # only folders are stat, not each image
+            self._is_images_changed = True
+            self._image_dirs = self._take_image_snapshot()
+        self._last_poll = time.monotonic()
+        changed = {
+            path for path, stat in snapshot.items() if self._snapshot.get(path) != stat
+        }
+        self._snapshot = snapshot
+        return changed
+
+    def close(self) -> None:
+        return
+
+
+class InotifyWatcher:
+    """
+    Watcher uses Linux inotify. Every folder in vault is watched
+    and notes are reported when they are written and closed or moved in.
+    Image root is watched too, even if it is out of vault, and events of
+    other files in it mark images as changed.
+    on_overflow is called when kernel drops events, so caller can report it
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        ignore_paths: List[Path],
+        on_overflow: Callable[[], None] | None = None,
+        image_root: Path | None = None,
+    ) -> None:
+        self.root = root
+        self.ignore_paths = ignore_paths
+        self.on_overflow = on_overflow
+        self.image_root = image_root
+        self._is_images_changed = False
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "Can't initialize inotify")
+
+        self._watch_dirs: dict[int, Path] = {}  # watch descriptor -> folder path
+        try:
+            self._add_watch_tree(root)
+            if image_root and not image_root.is_relative_to(root):
+                self._add_watch_tree(image_root)
+        except OSError as e:
+            os.close(self._fd)
+            raise e
+        return
+
+    def _add_watch(self, dir_path: Path) -> None:
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(dir_path), WATCH_MASK)
+        if wd < 0:  # ENOSPC if watch limit is exceeded
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"Can't watch {dir_path}: {os.strerror(errno)}")
+        self._watch_dirs[wd] = dir_path
+
+    def _get_root(self, path: Path) -> Path:
+        return self.root if path.is_relative_to(self.root) else self.image_root
+
+    def _is_image_path(self, path: Path) -> bool:
+        return self.image_root is not None and path.is_relative_to(self.image_root)
+
+    def take_images_changed(self) -> bool:
+        """
+        Check images are changed since last call, so image map is refreshed only then
+        """
+        is_changed, self._is_images_changed = self._is_images_changed, False
+        return is_changed
+
+    def _add_watch_tree(self, dir_path: Path) -> set[Path]:
+        """
+        Watch folder and its subfolders. Notes which are already in folder are returned
+        because they could be created before watch is added
+        """
+        markdown_paths = set()
+        root = self._get_root(dir_path)
+        is_note_dir = dir_path.is_relative_to(self.root)
+        self._add_watch(dir_path)
+        for sub_dir_path, dir_names, file_names in os.walk(dir_path):
+            dir_names[:] = [
+                name
+                for name in dir_names
+                if not _is_ignored(Path(sub_dir_path) / name, root, self.ignore_paths)
+            ]
+            for name in dir_names:
+                self._add_watch(Path(sub_dir_path) / name)
+            if is_note_dir:  # notes in image root out of vault are not converted
+                markdown_paths.update(
+                    Path(sub_dir_path) / name
+                    for name in file_names
+                    if name.endswith(".md")
+                )
+        return markdown_paths
+
+    def poll(self, timeout: float | None) -> set[Path]:
+        """
+        Wait changes of notes
+
+        Args:
+            timeout (float | None): max seconds to wait, None waits until any event
+
+        Returns:
+            set[Path]: created or modified notes
+        """
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+
+        changed: set[Path] = set()
+        buffer = os.read(self._fd, 64 * 1024)
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, _, name_length = EVENT_HEADER.unpack_from(buffer, offset)
+            name_start = offset + EVENT_HEADER.size
+            name = os.fsdecode(
+                buffer[name_start : name_start + name_length].rstrip(b"\0")
+            )
+            offset = name_start + name_length
+
+            if mask & IN_Q_OVERFLOW:  # some notes could be missed
+                if self.on_overflow:
+                    self.on_overflow()
+                continue
+            if mask & IN_IGNORED:  # folder is removed
+                self._watch_dirs.pop(wd, None)
+                continue
+
+            dir_path = self._watch_dirs.get(wd)
+            if dir_path is None:
+                continue
+            path = dir_path / name
+            if _is_ignored(path, self._get_root(path), self.ignore_paths):
+                continue
+
+            if self._is_image_path(path) and (
+                mask & IN_ISDIR or not name.endswith(".md")
+            ):  # image map is refreshed by caller
+                self._is_images_changed = True
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):  # watch new folder
+                    changed.update(self._add_watch_tree(path))
+            elif (
+                mask & (IN_CLOSE_WRITE | IN_MOVED_TO)
+                and name.endswith(".md")
+                and path.is_relative_to(self.root)
+            ):
+                changed.add(path)
+        return changed
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+def create_watcher(
+    root: Path,
+    ignore_paths: List[Path],
+    use_polling: bool = False,
+    interval: float = 1.0,
+    on_overflow: Callable[[], None] | None = None,
+    on_fallback: Callable[[Exception], None] | None = None,
+    image_root: Path | None = None,
+) -> InotifyWatcher | PollingWatcher:
+    """
+    Create inotify watcher on Linux. Polling watcher is used on other platforms
+    or when inotify can't watch whole vault
+
+    Args:
+        root (Path): vault folder to watch
+        ignore_paths (List[Path]): paths not to watch like output folder
+        use_polling (bool): force polling watcher
+        interval (float): polling interval seconds
+        on_overflow (Callable[[], None] | None): called when inotify drops events
+        on_fallback (Callable[[Exception], None] | None): called with error of inotify
+            when polling watcher is used instead
+        image_root (Path | None): image folder, changes in it are reported by
+            take_images_changed of watcher
+
+    Returns:
+        InotifyWatcher | PollingWatcher: watcher
+    """
+    if not use_polling and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(root, ignore_paths, on_overflow, image_root)
+        except (OSError, AttributeError) as e:
+            if on_fallback:
+                on_fallback(e)
+    return PollingWatcher(root, ignore_paths, interval, image_root)
+
+
+def watch_changes(
+    watcher: InotifyWatcher | PollingWatcher, debounce: float = 1.0
+) -> Iterator[set[Path]]:
+    """
+    Yield changed notes after saves are quiet for debounce seconds,
+    so burst of saves on same note is converted once
+
+    Args:
+        watcher (InotifyWatcher | PollingWatcher): watcher
+        debounce (float): seconds to wait after last change
+
+    Yields:
+        Iterator[set[Path]]: changed notes
+    """
+    while True:
+        changed = watcher.poll(None)
+        while changed and (more := watcher.poll(debounce)):  # wait until quiet
+            changed |= more
+        changed = {path for path in changed if path.exists()}  # removed notes
+        if changed:
+            yield changed
@@ -0,0 +1,145 @@
+import asyncio
+import datetime
+import pathlib
+import threading
+
+from botocore.auth import S3SigV4Auth
+from botocore.awsrequest import AWSRequest
+from botocore.credentials import ReadOnlyCredentials, RefreshableCredentials
+
+from obs3dian.async_s3 import AsyncConnectionPool, AsyncS3
+from obs3dian.s3 import S3
+
+
+def _is_signed(
+    credentials: ReadOnlyCredentials, url: str, method: str, headers: dict, body: bytes
+) -> bool:
+    """
+    Sign received request again with headers listed in its signature, like S3 does
+    """
+    authorization = headers["authorization"]
+    signed_names = authorization.split("SignedHeaders=")[1].split(",")[0].split(";")
+    request = AWSRequest(
+        method, url, {name: headers[name] for name in signed_names}, body
+    )
+    request.context["timestamp"] = headers["x-amz-date"]
+    auth = S3SigV4Auth(credentials, "s3", "ap-northeast-2")
+    string_to_sign = auth.string_to_sign(request, auth.canonical_request(request))
+    return authorization.endswith(
+        f"Signature={auth.signature(string_to_sign, request)}"
+    )
+
+
+class TestAsyncConnectionPool:
+    def test_connection_is_reused(self):
+        async def run() -> tuple[list, int]:
+            accepted = []
+
+            async def handle(reader, writer) -> None:
+                accepted.append(1)
+                while await reader.readline():
+                    while (await reader.readline()) != b"\r\n":  # headers
+                        pass
+                    await reader.readexactly(5)  # body
+                    writer.write(
+                        b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n"
+                        b"2\r\nok\r\n0\r\n\r\n"
+                    )
+                    await writer.drain()
+                writer.close()
+
+            server = await asyncio.start_server(handle, "127.0.0.1", 0)
+            port = server.sockets[0].getsockname()[1]
+            pool = AsyncConnectionPool(f"http://127.0.0.1:{port}", 4)
+            responses = [
+                await pool.request("PUT", "/bucket/key", {"Host": "test"}, b"image")
+                for _ in range(3)
+            ]
+            await pool.close()
+            server.close()
+            return responses, len(accepted)
+
+        responses, connections = asyncio.run(run())
+        assert [(status, body) for status, _, body in responses] == [(200, b"ok")] * 3
+        assert connections == 1
+
+
+class TestAsyncS3:
+    def test_signed_put_is_accepted(self, tmp_path: pathlib.Path):
+        image_path = tmp_path / "image.png"
+        image_path.write_bytes(b"image")
+        credentials = ReadOnlyCredentials("access-key", "secret-key", "token")
+        refresh_threads = []
+
+        def refresh() -> dict:
+            refresh_threads.append(threading.get_ident())
+            expiry = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(
+                hours=1
+            )
+            return {
+                "access_key": credentials.access_key,
+                "secret_key": credentials.secret_key,
+                "token": credentials.token,
+                "expiry_time": expiry.isoformat(),
+            }
+
+        async def run() -> tuple[list, list, int]:
+            received = []
+
+            async def handle(reader, writer) -> None:
+                while request_line := await reader.readline():
+                    method, target, _ = request_line.decode().split(" ")
+                    headers = {}
+                    while (line := await reader.readline()) != b"\r\n":
+                        name, value = line.decode().rstrip("\r\n").split(": ", 1)
+                        headers[name.lower()] = value
+                    body = await reader.readexactly(int(headers["content-length"]))
+                    is_signed = _is_signed(
+                        credentials,
+                        f"http://{headers['host']}{target}",
+                        method,
+                        headers,
+                        body,
+                    )
+                    received.append((target, body, is_signed))
+                    status = b"200 OK" if is_signed else b"403 Forbidden"
+                    writer.write(
+                        b"HTTP/1.1 " + status + b"\r\nContent-Length: 0\r\n\r\n"
+                    )
+                    await writer.drain()
+                writer.close()
+
+            server = await asyncio.start_server(handle, "127.0.0.1", 0)
+            port = server.sockets[0].getsockname()[1]
+            s3 = S3(
+                bucket_name="obs3dian",
+                aws_access_key="unused",
+                aws_secret_key="unused",
+                endpoint_url=f"http://127.0.0.1:{port}",
+                path_style=True,
+            )
+            s3.session.get_credentials = lambda: RefreshableCredentials(
+                "expired",
+                "expired",
+                None,
+                datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc),
+                refresh,
+                "test",
+            )  # like assume role, refreshed when it is expiring
+            uploader = AsyncS3(s3)
+            urls = [
+                await uploader.upload_image(f"note{i} / image.png", image_path)
+                for i in range(2)
+            ]
+            await uploader.close()
+            server.close()
+            return urls, received, threading.get_ident()
+
+        urls, received, loop_thread = asyncio.run(run())
+        assert urls[0].endswith("/obs3dian/note0%20/%20image.png")
+        assert received == [
+            ("/obs3dian/note0%20/%20image.png", b"image", True),
+            ("/obs3dian/note1%20/%20image.png", b"image", True),
+        ]
+        assert len(refresh_threads) == 1  # frozen credentials are reused
+        assert refresh_threads[0] != loop_thread
@@ -0,0 +1,64 @@
+import pathlib
+import concurrent.futures
+from threading import Lock
+
+from obs3dian.core import Obs3dianRunner, iter_convert_futures, iter_markdown_paths
+from obs3dian.markdown import parse_md_file
+
+
+class FakeRunner:
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.running = [0, 0]  # current, max
+        self.preflighted = []
+
+    def preflight(self, markdown_file_paths) -> None:
+        self.preflighted.extend(markdown_file_paths)
+
+    def __call__(self, markdown_file_path: pathlib.Path) -> bool:
+        with self.lock:
+            self.running[0] += 1
+            self.running[1] = max(self.running)
+        with self.lock:
+            self.running[0] -= 1
+        return True
+
+
+class TestConvertStream:
+    def test_iter_markdown_paths(self, tmp_path: pathlib.Path):
+        (tmp_path / "a" / "b").mkdir(parents=True)
+        for path in ("x.md", "a/y.md", "a/b/z.md", "a/b/image.png"):
+            (tmp_path / path).touch()
+
+        assert sorted(iter_markdown_paths(tmp_path)) == sorted(tmp_path.rglob("*.md"))
+
+    def test_in_flight_is_bounded(self):
+        runner = FakeRunner()
+        paths = (pathlib.Path(f"{i}.md") for i in range(100))  # lazy
+        with concurrent.futures.ThreadPoolExecutor(8) as executor:
+            results = [
+                (path, future.result())
+                for path, future in iter_convert_futures(runner, executor, paths, 4)
+            ]
+
+        assert len(results) == 100 and all(result for _, result in results)
+        assert len(runner.preflighted) == 100
+        assert runner.running[1] <= 4
+
+
+class TestParseProcesses:
+    test_files_path = pathlib.Path(__file__).parent / "test_files"
+
+    def test_process_parse_is_same_as_thread_parse(self, tmp_path: pathlib.Path):
+        markdown_path = self.test_files_path / "test_png.md"
+        runner = Obs3dianRunner(None, self.test_files_path, tmp_path, parse_processes=1)
+        try:
+            note = runner.parse(markdown_path)
+            assert note == parse_md_file(markdown_path, runner.name_path_map)
+
+            for image in note.images:
+                image.s3_url = "https://s3/test.png"
+            output_path = runner.write(note, note.images)
+        finally:
+            runner.close()
+        assert "https://s3/test.png" in output_path.read_text()
@@ -0,0 +1,70 @@
+import pathlib
+import shutil
+from threading import Lock
+
+from obs3dian.engine import Obs3dianEngine
+
+
+class FakeS3:
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.uploaded = []
+
+    def get_image_key(self, markdown_path: pathlib.Path, image_path: pathlib.Path):
+        return f"{markdown_path.stem} / {image_path.name}"
+
+    def get_key_prefix(self, markdown_path: pathlib.Path) -> str:
+        return f"{markdown_path.stem} / "
+
+    def load_remote_objects(self, prefixes) -> None:
+        pass
+
+    def upload_image(self, key: str, image_path: pathlib.Path) -> str:
+        with self.lock:
+            self.uploaded.append(key)
+        return f"https://s3/{key}"
+
+
+class TestEngine:
+    test_files_path = pathlib.Path(__file__).parent / "test_files"
+
+    def test_convert_many(self, tmp_path: pathlib.Path):
+        notes_path = tmp_path / "notes"
+        notes_path.mkdir()
+        for name in ("test_png.md", "test_jpg.md"):
+            shutil.copy(self.test_files_path / name, notes_path / name)
+        output_path = tmp_path / "output"
+        output_path.mkdir()
+
+        s3 = FakeS3()
+        with Obs3dianEngine(s3, self.test_files_path, output_path) as engine:
+            results = engine.convert_many(
+                [
+                    notes_path / "test_png.md",
+                    notes_path / "test_jpg.md",
+                    tmp_path / "x.md",
+                ]
+            )
+            assert [result.is_converted for result in results] == [True, True, False]
+            assert (
+                "https://s3/test_png / test.png" in results[0].output_path.read_text()
+            )
+            assert isinstance(results[2].error, FileNotFoundError)  # not raised
+            assert len(s3.uploaded) == 2
+
+    def test_convert_text(self, tmp_path: pathlib.Path):
+        s3 = FakeS3()
+        with Obs3dianEngine(s3, self.test_files_path, tmp_path) as engine:
+            text = engine.convert_text("a ![[test.png|300]] b ![[none.png]]", "post")
+        assert text == "a ![300](https://s3/post / test.png) b ![[none.png]]"
+
+    def test_duplicates(self, tmp_path: pathlib.Path, capsys):
+        images_path = tmp_path / "images"
+        (images_path / "sub").mkdir(parents=True)
+        shutil.copy(self.test_files_path / "test.png", images_path / "test.png")
+        shutil.copy(self.test_files_path / "test.png", images_path / "sub" / "test.png")
+
+        with Obs3dianEngine(FakeS3(), images_path, tmp_path) as engine:
+            engine.refresh_images()
+            assert list(engine.duplicates) == ["test.png"]
+        assert capsys.readouterr().out == ""  # returned instead of printed
@@ -0,0 +1,69 @@
+import pytest
+import pathlib
+import os
+import pickle
+
+from obs3dian.index import ImageIndex
+from obs3dian.markdown import extract_images_from_text
+
+
+class TestImageIndex:
+    @pytest.fixture
+    def image_folder_path(self, tmp_path: pathlib.Path) -> pathlib.Path:
+        image_folder_path = tmp_path / "images"
+        (image_folder_path / "a" / "b").mkdir(parents=True)
+        (image_folder_path / "c").mkdir()
+        for image_path in ("a/b/x.png", "a/y.jpg", "c/x.png", "c/z.txt"):
+            (image_folder_path / image_path).write_bytes(b"image")
+        return image_folder_path
+
+    def test_duplicates_are_reported(self, image_folder_path: pathlib.Path):
+        image_index = ImageIndex(image_folder_path)
+        name_path_map = image_index.refresh()
+
+        assert set(name_path_map) == {"x.png", "y.jpg"}
+        assert name_path_map["x.png"] == image_folder_path / "c" / "x.png"
+        assert image_index.duplicates == {
+            "x.png": [image_folder_path / "c/x.png", image_folder_path / "a/b/x.png"]
+        }
+
+    def test_only_changed_folders_are_listed(
+        self, image_folder_path: pathlib.Path, tmp_path: pathlib.Path, monkeypatch
+    ):
+        image_index = ImageIndex(image_folder_path, tmp_path / "app")
+        image_index.refresh()
+        image_index.save()
+
+        (image_folder_path / "a" / "b" / "new.gif").write_bytes(b"image")
+        scanned = []
+        scandir = os.scandir
+        monkeypatch.setattr(
+            os, "scandir", lambda path: scanned.append(path) or scandir(path)
+        )
+
+        image_index = ImageIndex(image_folder_path, tmp_path / "app")
+        image_index.load()
+        name_path_map = image_index.refresh()
+        assert name_path_map["new.gif"] == image_folder_path / "a" / "b" / "new.gif"
+        assert scanned == [image_folder_path / "a" / "b"]
+
+    def test_image_path_map_is_compact(self, image_folder_path: pathlib.Path):
+        name_path_map = ImageIndex(image_folder_path).refresh()
+        assert name_path_map == {
+            "x.png": image_folder_path / "c" / "x.png",
+            "y.jpg": image_folder_path / "a" / "y.jpg",
+        }
+        assert "z.txt" not in name_path_map
+
+        copied = pickle.loads(pickle.dumps(name_path_map))  # sent to parse processes
+        assert copied == name_path_map
+        assert copied["y.jpg"] == image_folder_path / "a" / "y.jpg"
+
+    def test_links_share_folder_path(self, image_folder_path: pathlib.Path):
+        name_path_map = ImageIndex(image_folder_path).refresh()
+        images = extract_images_from_text("![[x.png]] ![[x.png|500]]", name_path_map)
+        assert images[0].dir_path is images[1].dir_path  # no Path for each link
+        assert images[0].path == image_folder_path / "c" / "x.png"
+
+        copied = pickle.loads(pickle.dumps(images))  # sent from parse processes
+        assert copied == images and copied[1].path == images[1].path
@@ -0,0 +1,142 @@
+import pytest
+import pathlib
+import shutil
+
+from obs3dian.manifest import Manifest
+from obs3dian.markdown import ImageText
+
+
+class TestManifest:
+    test_files_path = pathlib.Path(__file__).parent / "test_files"
+    settings = {"bucket_name": "obs3dian", "key_mode": "note"}
+
+    @pytest.fixture
+    def note_path(self, tmp_path: pathlib.Path) -> pathlib.Path:
+        note_path = tmp_path / "note.md"
+        shutil.copy(self.test_files_path / "test_png.md", note_path)
+        shutil.copy(self.test_files_path / "test.png", tmp_path / "test.png")
+        return note_path
+
+    def _record(self, manifest: Manifest, note_path: pathlib.Path) -> None:
+        image_path = note_path.parent / "test.png"
+        output_path = note_path.parent / "output.md"
+        output_path.write_text("converted")
+        image = ImageText("test.png", 0, image_path, "", "https://s3/test.png")
+        manifest.record_note(note_path, output_path, [image])
+        manifest.record_upload("note / test.png", image_path, image.s3_url)
+
+    def test_unchanged_note_is_skipped(self, note_path: pathlib.Path):
+        manifest_path = note_path.parent / "manifest.json"
+        manifest = Manifest.load(manifest_path, self.settings)
+        assert not manifest.is_unchanged(note_path)
+
+        self._record(manifest, note_path)
+        manifest.save()
+
+        manifest = Manifest.load(manifest_path, self.settings)
+        assert manifest.is_unchanged(note_path)
+        assert manifest.get_uploaded_url(
+            "note / test.png", note_path.parent / "test.png"
+        )
+
+    def test_changed_note_is_converted(self, note_path: pathlib.Path):
+        manifest = Manifest.load(note_path.parent / "manifest.json", self.settings)
+        self._record(manifest, note_path)
+
+        with note_path.open("a") as f:
+            f.write("\nnew line")
+        assert not manifest.is_unchanged(note_path)
+
+    def test_changed_image_is_converted(self, note_path: pathlib.Path):
+        manifest = Manifest.load(note_path.parent / "manifest.json", self.settings)
+        self._record(manifest, note_path)
+
+        (note_path.parent / "test.png").write_bytes(b"new image")
+        assert not manifest.is_unchanged(note_path)
+        assert not manifest.get_uploaded_url(
+            "note / test.png", note_path.parent / "test.png"
+        )
+
+    def test_other_settings_are_discarded(self, note_path: pathlib.Path):
+        manifest_path = note_path.parent / "manifest.json"
+        manifest = Manifest.load(manifest_path, self.settings)
+        self._record(manifest, note_path)
+        manifest.save()
+
+        manifest = Manifest.load(manifest_path, {**self.settings, "key_mode": "hash"})
+        assert not manifest.is_unchanged(note_path)
+
+    def test_journal_is_replayed_on_resume(self, note_path: pathlib.Path):
+        manifest_path = note_path.parent / "manifest.json"
+        manifest = Manifest.load(manifest_path, self.settings)
+        manifest.open_journal()
+        self._record(manifest, note_path)  # killed before save
+        with manifest.journal_path.open("a") as f:
+            f.write('{"note": "cut by cr')
+
+        manifest = Manifest.load(manifest_path, self.settings)
+        assert not manifest.is_unchanged(note_path)
+        assert manifest.open_journal(resume=True) == 2
+        assert manifest.is_unchanged(note_path)
+        manifest.close_journal()
+
+    def test_journal_is_reset_on_save(self, note_path: pathlib.Path):
+        manifest_path = note_path.parent / "manifest.json"
+        manifest = Manifest.load(manifest_path, self.settings)
+        manifest.open_journal()
+        self._record(manifest, note_path)
+        manifest.save()
+        manifest.close_journal()
+
+        assert len(manifest.journal_path.read_text().splitlines()) == 1  # header
+        manifest = Manifest.load(manifest_path, self.settings)
+        assert manifest.open_journal(resume=True) == 0
+        assert manifest.is_unchanged(note_path)
+        manifest.close_journal()
+
+    def test_split_and_merge(self, note_path: pathlib.Path):
+        manifest = Manifest.load(note_path.parent / "manifest.json", self.settings)
+        self._record(manifest, note_path)
+        other_path = note_path.parent / "other.md"
+        shutil.copy(note_path, other_path)
+        manifest.record_note(other_path, note_path.parent / "output.md", [])
+
+        shard_paths = [note_path.parent / f"shard{i}.json" for i in range(2)]
+        shards = manifest.split(shard_paths, lambda path: int(path == other_path))
+        assert [list(shard.notes) for shard in shards] == [
+            [str(note_path)],
+            [str(other_path)],
+        ]
+        assert all(shard.uploads.keys() == manifest.uploads.keys() for shard in shards)
+
+        image_path = note_path.parent / "test.png"
+        image_path.touch()  # checkout on other machine changes mtime
+        assert shards[1].get_uploaded_url("note / test.png", image_path)
+
+        merged = Manifest(note_path.parent / "merged.json", self.settings)
+        for shard in shards:
+            merged.merge(shard)
+        assert merged.notes.keys() == manifest.notes.keys()
+        with pytest.raises(ValueError):
+            merged.merge(Manifest(note_path.parent / "x.json", {"key_mode": "hash"}))
+
+    def test_split_skips_notes_of_other_vaults(self, note_path: pathlib.Path):
+        from obs3dian.main import split_manifest
+
+        vault_path = note_path.parent / "vault"
+        vault_path.mkdir()
+        vault_note_path = vault_path / "note.md"
+        shutil.copy(note_path, vault_note_path)
+        shutil.copy(note_path.parent / "test.png", vault_path / "test.png")
+        manifest = Manifest(note_path.parent / "manifest.json", self.settings)
+        self._record(manifest, note_path)  # note of other vault in shared manifest
+        self._record(manifest, vault_note_path)
+        manifest.save()
+
+        split_manifest(manifest.manifest_path, vault_path, shards=2)
+        shard_notes = {}
+        for i in (1, 2):
+            shard_notes.update(
+                Manifest.read(note_path.parent / f"manifest-{i}-of-2.json").notes
+            )
+        assert list(shard_notes) == [str(vault_note_path)]
@@ -1,6 +1,14 @@
+import os
 import pytest
 import pathlib
-from obs3dian.markdown import extract_images_from_md, get_images_name_path_map
+from obs3dian import markdown
+from obs3dian.markdown import (
+    extract_images_from_md,
+    extract_images_from_text,
+    get_images_name_path_map,
+    parse_md_file,
+    write_md_file,
+)
 
 
 class TestRun:
@@ -13,3 +21,97 @@ class TestRun:
         name_path_map = get_images_name_path_map(self.user_input_path)
         images = extract_images_from_md(markdown_path, name_path_map)
         print(images)
+
+
+class TestExtractImages:
+    test_files_path = pathlib.Path(__file__).parent / "test_files"
+
+    @pytest.mark.parametrize("suffix", ["png", "jpg", "jpeg"])
+    def test_both_link_styles(self, suffix: str):
+        markdown_path = self.test_files_path / f"test_{suffix}.md"
+        name_path_map = get_images_name_path_map(self.test_files_path)
+        images = extract_images_from_md(markdown_path, name_path_map)
+
+        assert len(images) == 15
+        assert all(image.name == f"test.{suffix}" for image in images)
+        assert [image.metadata for image in images].count("this is caption") == 6
+
+    def test_same_result_for_text_bytes_and_mmap(self, monkeypatch):
+        markdown_path = self.test_files_path / "test_png.md"
+        name_path_map = get_images_name_path_map(self.test_files_path)
+        text = markdown_path.read_text()
+
+        from_text = extract_images_from_text(text, name_path_map)
+        from_bytes = extract_images_from_text(text.encode(), name_path_map)
+        monkeypatch.setattr(markdown, "LARGE_NOTE_SIZE", 0)  # force mmap
+        from_mmap = extract_images_from_md(markdown_path, name_path_map)
+        assert from_text == from_bytes == from_mmap
+        assert [image.line_no for image in from_text][:4] == [4, 8, 8, 8]
+
+    def test_skip_external_and_unknown_images(self):
+        name_path_map = {"a.png": pathlib.Path("/images/a.png")}
+        text = (
+            "![](https://a.com/a.png) ![](./b.png)\n![[b.png]] ![x](a.png) ![[a.png|1]]"
+        )
+        images = extract_images_from_text(text, name_path_map)
+        assert [(image.line_no, image.metadata) for image in images] == [
+            (1, "x"),
+            (1, "1"),
+        ]
+
+
+class TestWriteMarkdown:
+    def test_replace_only_link_spans(self, tmp_path: pathlib.Path):
+        markdown_path = tmp_path / "note.md"
+        markdown_path.write_bytes(b"a ![[a.png|500]] b ![x](./a.png) c\r\nend\r\n")
+        name_path_map = {"a.png": tmp_path / "a.png"}
+
+        note = parse_md_file(markdown_path, name_path_map)
+        for image in note.images:
+            image.s3_url = "https://s3/a.png"
+        output_path = write_md_file(
+            markdown_path, tmp_path / "output", note.images, True, note.text
+        )
+
+        assert output_path == markdown_path
+        assert markdown_path.read_bytes() == (
+            b"a ![500](https://s3/a.png) b ![x](https://s3/a.png) c\r\nend\r\n"
+        )
+        assert list(tmp_path.iterdir()) == [markdown_path]  # no temp file left
+
+    def test_mirror_folders_and_skip_unchanged(self, tmp_path: pathlib.Path):
+        vault_path = tmp_path / "vault"
+        output_path = tmp_path / "output"
+        markdown_paths = [vault_path / "a" / "note.md", vault_path / "b" / "note.md"]
+        for markdown_path in markdown_paths:  # same name in other folders
+            markdown_path.parent.mkdir(parents=True)
+            markdown_path.write_text(f"{markdown_path.parent.name}\n")
+
+        output_paths = [
+            write_md_file(markdown_path, output_path, [], markdown_root_path=vault_path)
+            for markdown_path in markdown_paths
+        ]
+        assert output_paths == [
+            output_path / "a" / "note.md",
+            output_path / "b" / "note.md",
+        ]
+        assert [path.read_text() for path in output_paths] == ["a\n", "b\n"]
+
+        output_stat = output_paths[0].stat()
+        write_md_file(markdown_paths[0], output_path, [], markdown_root_path=vault_path)
+        assert output_paths[0].stat().st_ino == output_stat.st_ino  # not replaced
+
+        markdown_paths[0].write_text("changed\n")
+        write_md_file(markdown_paths[0], output_path, [], markdown_root_path=vault_path)
+        assert output_paths[0].read_text() == "changed\n"
+        assert output_paths[0].stat().st_ino != output_stat.st_ino  # atomic replace
+
+    def test_new_output_mode(self, tmp_path: pathlib.Path):
+        markdown_path = tmp_path / "note.md"
+        markdown_path.write_text("text\n")
+        umask = os.umask(0o027)
+        try:  # umask of write is applied, not umask of import
+            output_path = write_md_file(markdown_path, tmp_path / "output", [])
+        finally:
+            os.umask(umask)
+        assert output_path.stat().st_mode & 0o777 == 0o640
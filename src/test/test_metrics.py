@@ -0,0 +1,53 @@
+import json
+import pathlib
+
+import pytest
+
+from obs3dian.metrics import LATENCY_SAMPLES, Metrics, SLOWEST_SIZE
+
+
+class TestMetrics:
+    def test_timer_and_counter(self):
+        metrics = Metrics()
+        for _ in range(3):
+            with metrics.timer("parse"):
+                metrics.count("notes_parsed")
+        metrics.count("bytes_uploaded", 100)
+
+        report = metrics.report()
+        assert report["stages"]["parse"]["count"] == 3
+        assert report["counters"] == {"notes_parsed": 3, "bytes_uploaded": 100}
+
+    def test_latency_percentiles_and_slowest(self):
+        metrics = Metrics()
+        for i in range(100):
+            metrics.observe("upload", i / 100, f"image{i}.png")
+
+        report = metrics.report()
+        latency = report["latencies"]["upload"]
+        assert latency["count"] == 100
+        assert latency["p50"] == 0.5 and latency["max"] == 0.99
+
+        slowest = report["slowest"]["upload"]
+        assert len(slowest) == SLOWEST_SIZE
+        assert slowest[0] == {"label": "image99.png", "seconds": 0.99}
+
+    def test_save(self, tmp_path: pathlib.Path):
+        metrics = Metrics()
+        metrics.count("uploads")
+        metrics.save(tmp_path / "metrics.json")
+        assert json.loads((tmp_path / "metrics.json").read_text())["counters"] == {
+            "uploads": 1
+        }
+
+    def test_latency_memory_is_bounded(self):
+        metrics = Metrics()
+        for i in range(LATENCY_SAMPLES * 3):
+            metrics.observe("upload", (i % 1000 + 1) / 1000, "image.png")
+
+        latency = metrics.latencies["upload"]
+        assert latency.samples is None and len(latency.buckets) < 1000
+        report = metrics.report()["latencies"]["upload"]
+        assert report["count"] == LATENCY_SAMPLES * 3 and report["max"] == 1.0
+        assert report["p50"] == pytest.approx(0.5, rel=0.01)
+        assert report["p99"] == pytest.approx(0.99, rel=0.01)
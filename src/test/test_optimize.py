@@ -0,0 +1,103 @@
+import pathlib
+
+import pytest
+
+from obs3dian.markdown import ImageText
+from obs3dian.optimize import ImageOptimizer, get_display_width
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def _write_png(image_path: pathlib.Path, width: int, height: int) -> None:
+    image = Image.new("RGB", (width, height))
+    image.putdata(
+        [(x % 256, y % 256, (x * y) % 256) for y in range(height) for x in range(width)]
+    )
+    image.save(image_path, "PNG", compress_level=0)  # not optimized source
+
+
+class TestOptimize:
+    def test_get_display_width(self):
+        assert get_display_width("|500") == 500
+        assert get_display_width("caption|500x300") == 500
+        assert get_display_width("|caption") is None
+        assert get_display_width("") is None
+
+    def test_optimize(self, tmp_path: pathlib.Path):
+        image_path = tmp_path / "image.png"
+        _write_png(image_path, 400, 200)
+        gif_path = tmp_path / "image.gif"
+        gif_path.write_bytes(b"GIF89a")
+        images = [
+            ImageText("image.png", 0, image_path, "|100"),
+            ImageText("image.png", 1, image_path, "|100"),  # same transform
+            ImageText("image.png", 2, image_path, ""),
+            ImageText("image.gif", 3, gif_path, "|100"),
+        ]
+
+        optimizer = ImageOptimizer(tmp_path / "cache", is_resize=True, processes=1)
+        try:
+            upload_paths = optimizer.optimize(images)
+            assert upload_paths[0] == upload_paths[1]
+            assert upload_paths[0] != upload_paths[2]
+            assert upload_paths[3] == gif_path  # gif is uploaded as is
+            with Image.open(upload_paths[0]) as resized:
+                assert resized.size == (100, 50)
+            assert upload_paths[2].stat().st_size < image_path.stat().st_size
+
+            assert optimizer.optimize(images[:1]) == upload_paths[:1]  # cached
+        finally:
+            optimizer.close()
+
+    def test_webp_names_keep_source_suffix(self, tmp_path: pathlib.Path):
+        png_path = tmp_path / "image.png"
+        jpg_path = tmp_path / "image.jpg"
+        _write_png(png_path, 400, 200)
+        with Image.open(png_path) as source:
+            source.save(jpg_path, "JPEG", quality=100)
+        images = [
+            ImageText("image.png", 0, png_path, ""),
+            ImageText("image.jpg", 1, jpg_path, ""),
+        ]
+
+        optimizer = ImageOptimizer(tmp_path / "cache", is_webp=True, processes=1)
+        try:
+            upload_paths = optimizer.optimize(images)
+            names = [upload_path.name for upload_path in upload_paths]
+            assert names == ["image.png.webp", "image.jpg.webp"]  # other S3 keys
+        finally:
+            optimizer.close()
+
+    def test_optimize_jpeg(self, tmp_path: pathlib.Path):
+        image_path = tmp_path / "image.jpg"
+        rotated_path = tmp_path / "rotated.jpg"
+        _write_png(tmp_path / "source.png", 400, 200)
+        with Image.open(tmp_path / "source.png") as source:
+            exif = Image.Exif()
+            exif[0x010E] = "description" * 100  # metadata dropped by optimize
+            source.save(image_path, "JPEG", quality=95, exif=exif)
+            exif[0x0112] = 6  # rotated 90 degrees by camera
+            source.save(rotated_path, "JPEG", quality=95, exif=exif)
+        images = [
+            ImageText("image.jpg", 0, image_path, ""),
+            ImageText("rotated.jpg", 1, rotated_path, ""),
+        ]
+
+        optimizer = ImageOptimizer(tmp_path / "cache", processes=1)
+        try:
+            upload_paths = optimizer.optimize(images)
+            assert upload_paths[0] != image_path  # not failed back to source
+            with Image.open(upload_paths[0]) as optimized:
+                assert optimized.format == "JPEG"
+                assert not optimized.getexif()
+            with Image.open(upload_paths[1]) as rotated:
+                assert rotated.size == (200, 400)
+
+            broken_path = tmp_path / "broken.jpg"
+            broken_path.write_bytes(b"not a jpeg")
+            broken = ImageText("broken.jpg", 2, broken_path, "")
+            assert optimizer.optimize([broken]) == [broken_path]  # uploaded as is
+            assert list((tmp_path / "cache").rglob("*.failed"))  # not tried again
+            assert list(optimizer.errors) == [broken_path]  # reported by caller
+        finally:
+            optimizer.close()
@@ -0,0 +1,55 @@
+import pathlib
+
+import pytest
+
+from obs3dian.index import ImageIndex
+from obs3dian.plan import UploadPlan
+
+
+class TestPlan:
+    def _create_vault(self, tmp_path: pathlib.Path) -> tuple[pathlib.Path, ...]:
+        images_path = tmp_path / "images"
+        (images_path / "sub").mkdir(parents=True)
+        (images_path / "a.png").write_bytes(b"a" * 100)
+        (images_path / "b.png").write_bytes(b"b" * 300)
+        (images_path / "sub" / "a.png").write_bytes(b"c" * 50)  # duplicated name
+
+        notes_path = tmp_path / "notes"
+        notes_path.mkdir()
+        note1 = notes_path / "note1.md"
+        note1.write_text("![[a.png]]\n![[b.png|500]]\n![[a.png]]\n![[none.png]]\n")
+        note2 = notes_path / "note2.md"
+        note2.write_text("![](images/a.png)\n")
+        return images_path, note1, note2
+
+    def test_plan(self, tmp_path: pathlib.Path):
+        images_path, note1, note2 = self._create_vault(tmp_path)
+        upload_plan = UploadPlan(ImageIndex(images_path), "note")
+        upload_plan.add_notes([note1, note2])
+
+        report = upload_plan.report()
+        assert report["notes"] == 2
+        assert report["image_links"] == 4
+        assert report["unique_images"] == 2
+        assert report["total_bytes"] == 400
+        assert report["uploads"] == 3  # a.png is uploaded once per note
+        assert report["upload_bytes"] == 500
+        assert report["missing_images"] == {"none.png": 1}
+        assert list(report["referenced_duplicates"]) == ["a.png"]
+        assert report["largest_notes"][0]["path"] == str(note1)
+        assert report["projection"]["seconds"] is None
+
+    def test_projection(self, tmp_path: pathlib.Path):
+        images_path, note1, note2 = self._create_vault(tmp_path)
+        upload_plan = UploadPlan(
+            ImageIndex(images_path),
+            "hash",
+            multipart_threshold=200,
+            multipart_chunksize=100,
+        )
+        upload_plan.add_notes([note1, note2])
+
+        assert upload_plan.report()["uploads"] == 2  # same image in notes once
+        assert upload_plan.requests == 1 + 5  # b.png by 3 parts
+        assert upload_plan.project_seconds(0.1, None, 2) == pytest.approx(0.3)
+        assert upload_plan.project_seconds(0.1, 10, 2) == 40  # bandwidth bound
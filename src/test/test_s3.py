@@ -0,0 +1,272 @@
+import hashlib
+import pytest
+import pathlib
+from urllib import parse
+
+from botocore.awsrequest import AWSResponse
+from botocore.exceptions import ClientError, EndpointConnectionError
+from botocore.stub import Stubber
+
+from obs3dian.hashing import get_digest, get_file_etag
+from obs3dian.config import MB
+from obs3dian.markdown import ImageText
+from obs3dian.metrics import metrics
+from obs3dian.s3 import (
+    HASH_KEY_PREFIX,
+    IMMUTABLE_CACHE_CONTROL,
+    LIST_PAGE_KEYS,
+    LIST_PREFIX_LIMIT,
+    S3,
+    classify_error,
+    get_content_type,
+)
+from obs3dian.scheduler import THROTTLE, TRANSIENT
+
+
+class _Raw:
+    def __init__(self, body: bytes) -> None:
+        self.body = body
+
+    def stream(self, **kwargs):
+        yield self.body
+
+
+class TestS3:
+    test_files_path = pathlib.Path(__file__).parent / "test_files"
+
+    def _create_s3(self, key_mode: str) -> S3:
+        return S3(
+            bucket_name="obs3dian",
+            aws_access_key="test-access-key",
+            aws_secret_key="test-secret-key",
+            key_mode=key_mode,
+        )
+
+    def test_hash_key_uploads_once(self):
+        s3 = self._create_s3("hash")
+        image_path = self.test_files_path / "test.png"
+        key = s3.get_image_key(self.test_files_path / "a.md", image_path)
+
+        with Stubber(s3.s3) as stubber, Stubber(s3._put_client) as put_stubber:
+            stubber.add_client_error("head_object", "404", http_status_code=404)
+            put_stubber.add_response("put_object", {})
+            for note_name in ("a.md", "b.md", "c.md"):  # same image in 3 notes
+                image = ImageText("test.png", 0, image_path, "")
+                s3.put_image(self.test_files_path / note_name, image)
+                assert image.s3_url and image.s3_url.endswith(key)
+            stubber.assert_no_pending_responses()
+            put_stubber.assert_no_pending_responses()
+
+    def test_only_single_put_is_not_retried(self):
+        s3 = self._create_s3("note")
+        assert s3._put_client.meta.config.retries["total_max_attempts"] == 1
+        # head, list, create bucket and upload parts keep botocore retries
+        assert "total_max_attempts" not in s3.s3.meta.config.retries
+
+    def test_part_retries_are_counted(self, tmp_path: pathlib.Path):
+        s3 = S3(
+            bucket_name="obs3dian",
+            aws_access_key="test-access-key",
+            aws_secret_key="test-secret-key",
+            multipart_threshold=5 * MB,
+            multipart_chunksize=5 * MB,
+            transfer_concurrency=1,
+        )
+        image_path = tmp_path / "big.png"
+        image_path.write_bytes(b"a" * (6 * MB))  # two parts
+        failed_parts = []
+
+        def send(request, **kwargs) -> AWSResponse:
+            query = parse.urlsplit(request.url).query
+            if request.method == "PUT" and "partNumber=1" in query and not failed_parts:
+                failed_parts.append(query)  # first part is failed once
+                body = b"<Error><Code>SlowDown</Code><Message></Message></Error>"
+                return AWSResponse(request.url, 503, {}, _Raw(body))
+            if request.method == "PUT":
+                return AWSResponse(request.url, 200, {"ETag": '"part"'}, _Raw(b""))
+            if query == "uploads":
+                body = b"<InitiateMultipartUploadResult><UploadId>1</UploadId></InitiateMultipartUploadResult>"
+            else:
+                body = b"<CompleteMultipartUploadResult><ETag>a</ETag></CompleteMultipartUploadResult>"
+            return AWSResponse(request.url, 200, {}, _Raw(body))
+
+        s3.s3.meta.events.register("before-send.s3", send)  # behind botocore retries
+        metrics.reset()
+        s3.upload_image("big / big.png", image_path)
+        assert failed_parts
+        assert metrics.counters["retries"] == 1  # retried by botocore, not scheduler
+
+    def test_note_key_is_not_shared(self):
+        s3 = self._create_s3("note")
+        image_path = self.test_files_path / "test.png"
+        keys = {
+            s3.get_image_key(self.test_files_path / note_name, image_path)
+            for note_name in ("a.md", "b.md")
+        }
+        assert len(keys) == 2
+
+    def test_version_key_is_immutable(self, tmp_path: pathlib.Path):
+        s3 = self._create_s3("version")
+        image_path = tmp_path / "test.png"
+        image_path.write_bytes(b"a")
+        key = s3.get_image_key(tmp_path / "a.md", image_path)
+        assert key.startswith("a / test.") and key.endswith(".png")
+
+        image_path.write_bytes(b"b")
+        assert s3.get_image_key(tmp_path / "a.md", image_path) != key  # new url
+        assert s3.get_extra_args(image_path) == {
+            "ContentType": "image/png",
+            "CacheControl": IMMUTABLE_CACHE_CONTROL,
+        }
+        assert "CacheControl" not in self._create_s3("note").get_extra_args(image_path)
+        s3 = S3(
+            bucket_name="obs3dian",
+            aws_access_key="test-access-key",
+            aws_secret_key="test-secret-key",
+            key_mode="version",
+            cache_control="",
+        )
+        assert "CacheControl" not in s3.get_extra_args(image_path)  # turned off
+
+    def test_image_url(self, monkeypatch: pytest.MonkeyPatch):
+        monkeypatch.delenv("AWS_ENDPOINT_URL", raising=False)
+        s3 = self._create_s3("note")
+        assert s3.url_base == "https://obs3dian.s3.ap-northeast-2.amazonaws.com"
+
+        minio = S3(
+            bucket_name="obs3dian",
+            aws_access_key="test-access-key",
+            aws_secret_key="test-secret-key",
+            endpoint_url="http://minio.lan:9000",
+        )
+        assert minio.is_path_style  # other servers don't resolve bucket subdomain
+        assert minio.url_base == "http://minio.lan:9000/obs3dian"
+
+        cdn = S3(
+            bucket_name="obs3dian",
+            aws_access_key="test-access-key",
+            aws_secret_key="test-secret-key",
+            region_name="us-east-1",
+            public_url="https://cdn.example.com/",
+        )
+        assert cdn.region_name == "us-east-1"
+        image_path = self.test_files_path / "test.png"
+        assert (
+            cdn._get_image_url(
+                cdn.get_image_key(self.test_files_path / "a.md", image_path)
+            )
+            == "https://cdn.example.com/a%20/%20test.png"
+        )
+
+    def test_content_type(self):
+        assert get_content_type(pathlib.Path("a.PNG")) == "image/png"
+        assert get_content_type(pathlib.Path("a.jpg")) == "image/jpeg"
+        assert get_content_type(pathlib.Path("a.webp")) == "image/webp"
+        assert get_content_type(pathlib.Path("a")) == "application/octet-stream"
+
+    def test_invalid_key_mode(self):
+        with pytest.raises(ValueError):
+            self._create_s3("random")
+
+    def test_classify_error(self):
+        def client_error(code: str, status: int) -> ClientError:
+            response = {
+                "Error": {"Code": code},
+                "ResponseMetadata": {"HTTPStatusCode": status},
+            }
+            return ClientError(response, "PutObject")
+
+        assert classify_error(client_error("SlowDown", 503)) == THROTTLE
+        assert classify_error(client_error("InternalError", 500)) == TRANSIENT
+        assert classify_error(client_error("AccessDenied", 403)) is None
+        assert classify_error(EndpointConnectionError(endpoint_url="s3")) == TRANSIENT
+
+    def test_listed_objects_are_not_uploaded(self):
+        s3 = self._create_s3("note")
+        image_path = self.test_files_path / "test.png"
+        markdown_path = self.test_files_path / "a.md"
+        key = s3.get_image_key(markdown_path, image_path)
+        etag = get_file_etag(image_path, s3.transfer_config.multipart_threshold, 1)
+
+        with Stubber(s3.s3) as stubber:
+            stubber.add_response(
+                "list_objects_v2",
+                {
+                    "Contents": [
+                        {
+                            "Key": key,
+                            "Size": image_path.stat().st_size,
+                            "ETag": f'"{etag}"',
+                        }
+                    ],
+                    "IsTruncated": False,
+                },
+            )
+            s3.load_remote_objects([s3.get_key_prefix(markdown_path)])
+            assert s3.upload_image(key, image_path).endswith("test.png")  # no PUT
+            assert not s3._is_uploaded("a / other.png", image_path)  # listed, missing
+            stubber.assert_no_pending_responses()
+
+    def test_many_prefixes_of_small_bucket_are_listed_once(self):
+        s3 = self._create_s3("note")
+        assert (
+            self._create_s3("hash").get_key_prefix(self.test_files_path / "a.md")
+            == HASH_KEY_PREFIX
+        )  # hash keys don't list note keys
+        prefixes = [f"note{i} / " for i in range(LIST_PREFIX_LIMIT + 1)]
+
+        with Stubber(s3.s3) as stubber:
+            stubber.add_response(
+                "list_objects_v2",
+                {"Contents": [], "IsTruncated": False},
+                {"Bucket": "obs3dian", "MaxKeys": LIST_PAGE_KEYS},
+            )
+            s3.load_remote_objects(prefixes)  # one listing instead of LIST per note
+            s3.load_remote_objects(["other / "])  # already listed
+            stubber.assert_no_pending_responses()
+        assert s3._get_remote_object("other / a.png") == (True, None)
+
+    def test_many_prefixes_of_big_bucket_are_listed_by_prefix(self):
+        s3 = self._create_s3("note")
+        s3._max_list_workers = 1  # stubbed responses are taken in order
+        prefixes = [f"note{i} / " for i in range(LIST_PREFIX_LIMIT + 1)]
+        big_page = {
+            "Contents": [{"Key": "other / a.png", "Size": 1, "ETag": '"a"'}],
+            "IsTruncated": True,
+            "NextContinuationToken": "next",
+        }
+
+        with Stubber(s3.s3) as stubber:
+            stubber.add_response(
+                "list_objects_v2",
+                big_page,
+                {"Bucket": "obs3dian", "MaxKeys": LIST_PAGE_KEYS},
+            )
+            for _ in prefixes:
+                stubber.add_response(
+                    "list_objects_v2", {"Contents": [], "IsTruncated": False}
+                )
+            s3.load_remote_objects(prefixes)
+            stubber.add_response(
+                "list_objects_v2",
+                {"Contents": [], "IsTruncated": False},
+                {"Bucket": "obs3dian", "Prefix": "other / "},
+            )  # bucket is not probed again
+            s3.load_remote_objects(["other / "] + prefixes)
+            stubber.assert_no_pending_responses()
+        assert s3._listed_prefixes == set(prefixes) | {"other / "}
+        assert s3._get_remote_object("other / a.png") == (True, None)  # not kept
+
+    def test_multipart_etag(self, tmp_path: pathlib.Path):
+        file_path = tmp_path / "big.png"
+        file_path.write_bytes(b"a" * 10 + b"b" * 10 + b"c" * 5)
+        part_digests = b"".join(
+            hashlib.md5(part).digest() for part in (b"a" * 10, b"b" * 10, b"c" * 5)
+        )
+        assert get_file_etag(file_path, 100, 10) == get_digest(
+            file_path.read_bytes(), "md5"
+        )
+        assert (
+            get_file_etag(file_path, 20, 10)
+            == f"{hashlib.md5(part_digests).hexdigest()}-3"
+        )
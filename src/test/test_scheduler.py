@@ -0,0 +1,144 @@
+import asyncio
+import pytest
+import pathlib
+import threading
+import time
+from threading import Lock
+
+from obs3dian.scheduler import (
+    AdaptiveLimiter,
+    AsyncUploadScheduler,
+    UploadScheduler,
+    TRANSIENT,
+)
+
+
+class TestUploadScheduler:
+    image_path = pathlib.Path(__file__).parent / "test_files" / "test.png"
+
+    def test_same_upload_is_queued_once(self):
+        calls = []
+
+        def upload() -> str:
+            calls.append(1)
+            return "https://s3/test.png"
+
+        with UploadScheduler(4) as scheduler:
+            futures = [
+                scheduler.submit("test.png", self.image_path, upload) for _ in range(5)
+            ]
+            assert all(future.result() == "https://s3/test.png" for future in futures)
+        assert len(calls) == 1
+
+    def test_finished_uploads_are_forgotten(self):
+        release = threading.Event()
+        with UploadScheduler(4) as scheduler:
+            done = scheduler.submit("a.png", self.image_path, lambda: "a")
+            pending = scheduler.submit("b.png", self.image_path, release.wait)
+            done.result()
+            scheduler.forget_finished()  # called during run, memory stays flat
+            assert list(scheduler._futures.values()) == [pending]
+            release.set()
+
+    def test_concurrency_is_bounded(self):
+        lock = Lock()
+        running = [0, 0]  # current, max
+
+        def upload() -> str:
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            time.sleep(0.01)
+            with lock:
+                running[0] -= 1
+            return ""
+
+        with UploadScheduler(3) as scheduler:
+            for i in range(20):
+                scheduler.submit(f"{i}.png", self.image_path, upload)
+        assert running[1] <= 3
+
+    def test_invalid_concurrency(self):
+        with pytest.raises(ValueError):
+            UploadScheduler(0)
+
+    def test_transient_error_is_retried(self):
+        calls = []
+
+        def upload() -> str:
+            calls.append(1)
+            if len(calls) < 3:
+                raise TimeoutError()
+            return "https://s3/test.png"
+
+        with UploadScheduler(2, lambda e: TRANSIENT, base_delay=0.001) as scheduler:
+            future = scheduler.submit("test.png", self.image_path, upload)
+            assert future.result() == "https://s3/test.png"
+        assert len(calls) == 3
+
+    def test_unknown_error_is_not_retried(self):
+        calls = []
+
+        def upload() -> str:
+            calls.append(1)
+            raise ValueError()
+
+        with UploadScheduler(2, lambda e: None) as scheduler:
+            future = scheduler.submit("test.png", self.image_path, upload)
+            with pytest.raises(ValueError):
+                future.result()
+        assert len(calls) == 1
+
+
+class TestAdaptiveLimiter:
+    def test_throttle_decreases_and_success_increases(self):
+        limiter = AdaptiveLimiter(8)
+        limiter.acquire()
+        limiter.release(is_throttled=True)
+        assert limiter.limit == 4
+
+        for _ in range(20):
+            limiter.acquire()
+            limiter.release(0.01, 1024)
+        assert 4 < limiter.limit <= 8
+
+
+class TestAsyncUploadScheduler:
+    image_path = pathlib.Path(__file__).parent / "test_files" / "test.png"
+
+    def test_uploads_run_in_one_thread(self):
+        running = [0, 0]  # current, max
+        thread_ids = set()
+
+        async def upload() -> str:
+            thread_ids.add(threading.get_ident())
+            running[0] += 1
+            running[1] = max(running)
+            await asyncio.sleep(0.05)
+            running[0] -= 1
+            return "https://s3/test.png"
+
+        scheduler = AsyncUploadScheduler(200)
+        futures = [
+            scheduler.submit(f"{i}.png", self.image_path, upload) for i in range(300)
+        ]
+        assert all(future.result() == "https://s3/test.png" for future in futures)
+        scheduler.shutdown()
+
+        assert len(thread_ids) == 1
+        assert 100 < running[1] <= 200
+
+    def test_transient_error_is_retried(self):
+        calls = []
+
+        async def upload() -> str:
+            calls.append(1)
+            if len(calls) < 2:
+                raise TimeoutError()
+            return "https://s3/test.png"
+
+        scheduler = AsyncUploadScheduler(2, lambda e: TRANSIENT, base_delay=0.001)
+        future = scheduler.submit("test.png", self.image_path, upload)
+        assert future.result() == "https://s3/test.png"
+        scheduler.shutdown()
+        assert len(calls) == 2
@@ -0,0 +1,26 @@
+import pathlib
+
+import pytest
+
+from obs3dian.shard import get_shard_index, parse_shard
+
+
+class TestShard:
+    def test_parse_shard(self):
+        assert parse_shard("1/4") == (0, 4)
+        assert parse_shard("4/4") == (3, 4)
+        for shard in ("0/4", "5/4", "a/4", "1"):
+            with pytest.raises(ValueError):
+                parse_shard(shard)
+
+    def test_shards_are_disjoint_and_stable(self):
+        root = pathlib.Path("/vault")
+        paths = [root / f"folder{i % 7}" / f"note{i}.md" for i in range(1000)]
+        shards = [get_shard_index(path, root, 4) for path in paths]
+        assert set(shards) == {0, 1, 2, 3}
+
+        other_root = pathlib.Path("/other/checkout")  # same vault on other machine
+        assert shards == [
+            get_shard_index(other_root / path.relative_to(root), other_root, 4)
+            for path in paths
+        ]
@@ -0,0 +1,96 @@
+import pytest
+import pathlib
+import sys
+import threading
+import time
+
+from obs3dian.watch import (
+    InotifyWatcher,
+    PollingWatcher,
+    create_watcher,
+    watch_changes,
+)
+
+
+def _create_watchers(
+    root: pathlib.Path, ignore_paths: list, image_root: pathlib.Path | None = None
+) -> list:
+    watchers = [
+        PollingWatcher(root, ignore_paths, interval=0.05, image_root=image_root)
+    ]
+    if sys.platform.startswith("linux"):
+        watchers.append(InotifyWatcher(root, ignore_paths, image_root=image_root))
+    return watchers
+
+
+class TestWatcher:
+    @pytest.fixture
+    def vault_path(self, tmp_path: pathlib.Path) -> pathlib.Path:
+        (tmp_path / "notes").mkdir()
+        (tmp_path / "output").mkdir()
+        (tmp_path / ".obsidian").mkdir()
+        (tmp_path / "notes" / "a.md").write_text("a")
+        return tmp_path
+
+    def test_changed_notes_are_reported(self, vault_path: pathlib.Path):
+        for watcher in _create_watchers(vault_path, [vault_path / "output"]):
+            (vault_path / "notes" / "a.md").write_text("changed")
+            (vault_path / "notes" / "b.md").write_text("new")
+            (vault_path / "output" / "a.md").write_text("output")
+            (vault_path / ".obsidian" / "c.md").write_text("hidden")
+            (vault_path / "notes" / "image.png").write_bytes(b"image")
+
+            changed = watcher.poll(1.0) | watcher.poll(0.1)
+            watcher.close()
+            assert changed == {
+                vault_path / "notes" / "a.md",
+                vault_path / "notes" / "b.md",
+            }
+
+    def test_image_changes_are_flagged(self, vault_path: pathlib.Path):
+        image_root = vault_path / "images"  # out of watched notes folder
+        (image_root / "sub").mkdir(parents=True)
+        for watcher in _create_watchers(vault_path / "notes", [], image_root):
+            watcher.poll(0.1)  # events made while other watcher is tested
+            watcher.take_images_changed()
+            (vault_path / "notes" / "a.md").write_text("changed")
+            assert watcher.poll(1.0) | watcher.poll(0.1)
+            assert not watcher.take_images_changed()  # notes only
+
+            (image_root / "sub" / "image.png").write_bytes(b"image")
+            (image_root / "sub" / "note.md").write_text("not in notes folder")
+            assert not (watcher.poll(0.2) | watcher.poll(0.1))
+            assert watcher.take_images_changed()
+            assert not watcher.take_images_changed()  # reset by caller
+
+            (image_root / "sub" / "image.png").unlink()
+            (image_root / "sub" / "note.md").unlink()
+            watcher.poll(0.2)
+            watcher.close()
+            assert watcher.take_images_changed()  # removed image
+
+    def test_burst_of_saves_is_debounced(self, vault_path: pathlib.Path):
+        for watcher in _create_watchers(vault_path, []):
+
+            def save_many_times():
+                for i in range(5):
+                    (vault_path / "notes" / "a.md").write_text(str(i))
+                    time.sleep(0.02)
+
+            thread = threading.Thread(target=save_many_times)
+            thread.start()
+            changed = next(watch_changes(watcher, debounce=0.2))
+            thread.join()
+            watcher.close()
+            assert changed == {vault_path / "notes" / "a.md"}
+
+    @pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify")
+    def test_fallback_is_reported_by_caller(self, tmp_path: pathlib.Path, capsys):
+        errors = []
+        watcher = create_watcher(
+            tmp_path / "none", [], on_fallback=errors.append
+        )  # folder can't be watched by inotify
+        watcher.close()
+        assert isinstance(watcher, PollingWatcher)
+        assert isinstance(errors[0], OSError)
+        assert capsys.readouterr().out == ""